@@ -0,0 +1,45 @@
+"""
+Clones a todo list one INSERT per item, like clone_todo_list used to, and
+with the set-based clone_todo_list.
+"""
+import argparse
+import asyncio
+import uuid
+
+from common import database, delete_user, measure, seed_todo_list, seed_user
+from service import todo_item_service, todo_list_service
+
+
+async def clone_per_item(todo_list_id: int, author_id: int):
+    async with database.transaction():
+        cloned_id = await database.fetch_val(
+            "INSERT INTO todo_list (author_id, name) VALUES (:author_id, :name) RETURNING id",
+            {"author_id": author_id, "name": f"clone-{uuid.uuid4()}"},
+        )
+        for todo_item in await todo_item_service.find_todo_items(todo_list_id=todo_list_id):
+            await todo_item_service.create_todo_item(
+                author_id, cloned_id, todo_item.description, todo_item.due_date)
+
+
+async def main(items: int, runs: int):
+    await database.connect()
+    user_id = await seed_user()
+    try:
+        todo_list_id = await seed_todo_list(user_id, items)
+        per_item = await measure(lambda: clone_per_item(todo_list_id, user_id), runs)
+        set_based = await measure(
+            lambda: todo_list_service.clone_todo_list(todo_list_id, user_id, f"clone-{uuid.uuid4()}"), runs)
+        print(f"clone of {items} items, median of {runs} runs")
+        print(f"  one INSERT per item: {per_item:8.1f} ms")
+        print(f"  INSERT ... SELECT:   {set_based:8.1f} ms ({per_item / set_based:.0f}x)")
+    finally:
+        await delete_user(user_id)
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=5000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.items, args.runs))
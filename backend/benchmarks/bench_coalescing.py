@@ -0,0 +1,73 @@
+"""
+Runs typists sending todo_item_edit_description messages, one message per
+keystroke, through a Coalescer like the websocket endpoint does, and
+reports the messages and bytes per second submitted and broadcast per
+recipient from Coalescer.stats(). Needs no database.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from core.coalescing import Coalescer  # noqa: E402
+
+TEXT = "Buy milk, eggs and bread on the way home from work and call the plumber about the sink. "
+
+
+async def broadcast(_key: tuple[int, int], _message: str):
+    pass
+
+
+async def type_description(coalescer: Coalescer[tuple[int, int], str], todo_item_id: int,
+                           keystrokes_per_second: float, seconds: float) -> int:
+    """
+    :return: The number of bytes submitted.
+    """
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    keystrokes = int(keystrokes_per_second * seconds)
+    submitted_bytes = 0
+    for keystroke in range(1, keystrokes + 1):
+        description = (TEXT * (keystroke // len(TEXT) + 1))[:keystroke]
+        message = json.dumps(
+            {"action": "todo_item_edit_description", "todo_item_id": todo_item_id, "description": description})
+        await coalescer.submit((1, todo_item_id), message, size=len(message))
+        submitted_bytes += len(message)
+        # Keystrokes are scheduled on a fixed clock, so delays do not slow typing down
+        await asyncio.sleep(max(0.0, start + keystroke / keystrokes_per_second - loop.time()))
+    return submitted_bytes
+
+
+async def run(typists: int, keystrokes_per_second: float, seconds: float, window_ms: float) -> dict[str, int]:
+    coalescer: Coalescer[tuple[int, int], str] = Coalescer(window_ms / 1000, broadcast)
+    submitted_bytes = await asyncio.gather(*(
+        type_description(coalescer, todo_item_id, keystrokes_per_second, seconds)
+        for todo_item_id in range(typists)
+    ))
+    # Lets the last windows close
+    await asyncio.sleep(window_ms / 1000 * 2)
+    return {**coalescer.stats(), "submitted_bytes": sum(submitted_bytes)}
+
+
+async def main(typists: int, rates: list[float], seconds: float, window_ms: float):
+    print(f"{typists} typists for {seconds:g} s, {window_ms:g} ms window, per recipient")
+    for rate in rates:
+        stats = await run(typists, rate, seconds, window_ms)
+        broadcast_bytes = stats["submitted_bytes"] - stats["coalesced_bytes"]
+        saved = stats["coalesced"] / stats["submitted"] if stats["submitted"] else 0
+        print(f"  {rate:5g} keystrokes/s: {stats['submitted'] / seconds:7.0f} -> {stats['emitted'] / seconds:7.0f}"
+              f" messages/s ({saved:4.0%} saved), {stats['submitted_bytes'] / seconds / 1000:7.1f} ->"
+              f" {broadcast_bytes / seconds / 1000:7.1f} kB/s ({stats['coalesced_bytes'] / seconds / 1000:.1f} kB/s saved)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--typists", type=int, default=50)
+    parser.add_argument("--rates", type=float, nargs="+", default=[5, 10, 20, 40, 80])
+    parser.add_argument("--seconds", type=float, default=3)
+    parser.add_argument("--window-ms", type=float, default=50)
+    args = parser.parse_args()
+    asyncio.run(main(args.typists, args.rates, args.seconds, args.window_ms))
@@ -0,0 +1,76 @@
+"""
+Exports a todo list as NDJSON, streamed with export_todo_items and built
+in memory from find_todo_items, reporting the time to the first byte, the
+total time and the peak of traced memory.
+"""
+import argparse
+import asyncio
+import tracemalloc
+from time import perf_counter
+
+import orjson
+from common import database, delete_user, seed_todo_list, seed_user
+from core.responses import ORJSON_OPTIONS
+from service import todo_item_service
+
+
+async def export_streamed(todo_list_id: int) -> tuple[float, int]:
+    """
+    :return: The seconds until the first non-empty chunk and the number of bytes.
+    """
+    start = perf_counter()
+    first_byte = None
+    size = 0
+    async for chunk in await todo_item_service.export_todo_items(todo_list_id, "ndjson"):
+        if chunk and first_byte is None:
+            first_byte = perf_counter() - start
+        size += len(chunk)
+    return first_byte, size
+
+
+async def export_in_memory(todo_list_id: int) -> tuple[float, int]:
+    start = perf_counter()
+    todo_items = await todo_item_service.find_todo_items(todo_list_id=todo_list_id)
+    body = b"".join(orjson.dumps(todo_item.__dict__, option=ORJSON_OPTIONS) + b"\n" for todo_item in todo_items)
+    return perf_counter() - start, len(body)
+
+
+async def run(export, todo_list_id: int) -> tuple[float, float, int, float]:
+    """
+    :return: The milliseconds to the first byte and in total, the bytes and the traced peak in MiB.
+    """
+    start = perf_counter()
+    first_byte, size = await export(todo_list_id)
+    total = perf_counter() - start
+
+    tracemalloc.start()
+    await export(todo_list_id)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first_byte * 1000, total * 1000, size, peak / 2 ** 20
+
+
+async def main(items: int):
+    await database.connect()
+    user_id = await seed_user()
+    try:
+        todo_list_id = await seed_todo_list(user_id, items)
+        # Warms up the connection and the statements
+        await export_streamed(todo_list_id)
+        await export_in_memory(todo_list_id)
+
+        print(f"NDJSON export of {items} todo items")
+        for label, export in (("export_todo_items:", export_streamed), ("find_todo_items:", export_in_memory)):
+            first_byte, total, size, peak = await run(export, todo_list_id)
+            print(f"  {label:20} first byte {first_byte:8.1f} ms, total {total:8.1f} ms,"
+                  f" {size / 2 ** 20:.1f} MiB, peak {peak:6.1f} MiB")
+    finally:
+        await delete_user(user_id)
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=100000)
+    args = parser.parse_args()
+    asyncio.run(main(args.items))
@@ -0,0 +1,91 @@
+"""
+Broadcasts a message to a room of fake websockets, some of them slow, with
+ConnectionManager and by sending to each socket in turn. Needs no database.
+"""
+import argparse
+import asyncio
+from time import perf_counter
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from core.websocket import ConnectionManager  # noqa: E402
+
+
+class FakeWebSocket:
+    """
+    Records when it received its first message, sleeping delay seconds per send.
+    """
+
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.received_at: float | None = None
+
+    async def accept(self):
+        pass
+
+    async def close(self, code: int = 1000):
+        pass
+
+    async def send_text(self, message: str):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.received_at is None:
+            self.received_at = perf_counter()
+
+
+def create_sockets(sockets: int, slow: int, delay: float) -> list[FakeWebSocket]:
+    # The slow sockets come first, so they delay all fast ones when sending in turn
+    return [FakeWebSocket(delay if n < slow else 0) for n in range(sockets)]
+
+
+async def fan_out(sockets: int, slow: int, delay: float) -> tuple[float, float]:
+    """
+    :return: The milliseconds until broadcast returned and until every fast socket received the message.
+    """
+    manager = ConnectionManager()
+    websockets = create_sockets(sockets, slow, delay)
+    for websocket in websockets:
+        await manager.connect(websocket, room=1)
+    fast = [websocket for websocket in websockets if not websocket.delay]
+
+    start = perf_counter()
+    await manager.broadcast("message", None, room=1)
+    returned = perf_counter()
+    while any(websocket.received_at is None for websocket in fast):
+        await asyncio.sleep(0)
+    delivered = max(websocket.received_at for websocket in fast)
+
+    for websocket in websockets:
+        manager.disconnect(websocket)
+    return (returned - start) * 1000, (delivered - start) * 1000
+
+
+async def send_in_turn(sockets: int, slow: int, delay: float) -> float:
+    """
+    :return: The milliseconds until every fast socket received the message.
+    """
+    websockets = create_sockets(sockets, slow, delay)
+    start = perf_counter()
+    for websocket in websockets:
+        await websocket.send_text("message")
+    return (max(websocket.received_at for websocket in websockets if not websocket.delay) - start) * 1000
+
+
+async def main(sockets: int, slow: int, delay: float):
+    returned, delivered = await fan_out(sockets, slow, delay)
+    in_turn = await send_in_turn(sockets, slow, delay)
+    print(f"broadcast to {sockets} sockets, {slow} of them taking {delay * 1000:.0f} ms per send")
+    print(f"  ConnectionManager: broadcast returns after {returned:6.1f} ms,"
+          f" fast sockets receive after {delivered:6.1f} ms")
+    print(f"  sending in turn:   fast sockets receive after {in_turn:6.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sockets", type=int, default=1000)
+    parser.add_argument("--slow", type=int, default=10)
+    parser.add_argument("--delay", type=float, default=0.05, help="Seconds per send of a slow socket")
+    args = parser.parse_args()
+    asyncio.run(main(args.sockets, args.slow, args.delay))
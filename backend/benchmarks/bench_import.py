@@ -0,0 +1,87 @@
+"""
+Imports todo items from NDJSON and CSV uploads with import_todo_items and,
+for comparison, creates them one at a time with create_todo_item,
+reporting rows per second.
+"""
+import argparse
+import asyncio
+import csv
+import io
+from datetime import date, timedelta
+from time import perf_counter
+from typing import AsyncIterator
+
+import orjson
+from common import database, delete_user, seed_todo_list, seed_user
+from service import todo_item_service
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def upload(rows: int, format: str) -> bytes:
+    today = date.today()
+    records = [
+        {"description": f"Imported item {n}", "due_date": (today + timedelta(days=n % 30)).isoformat(),
+         "completed": n % 3 == 0}
+        for n in range(rows)
+    ]
+    if format == "ndjson":
+        return b"".join(orjson.dumps(record) + b"\n" for record in records)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=["description", "due_date", "completed"])
+    writer.writeheader()
+    writer.writerows(records)
+    return buffer.getvalue().encode()
+
+
+async def chunked(body: bytes) -> AsyncIterator[bytes]:
+    for start in range(0, len(body), UPLOAD_CHUNK_SIZE):
+        yield body[start:start + UPLOAD_CHUNK_SIZE]
+
+
+async def import_upload(todo_list_id: int, author_id: int, body: bytes, format: str) -> int:
+    result, _ = await todo_item_service.import_todo_items(todo_list_id, author_id, chunked(body), format)
+    assert not result.failed, result.errors[:3]
+    return result.imported
+
+
+async def create_one_at_a_time(todo_list_id: int, author_id: int, rows: int) -> int:
+    today = date.today()
+    for n in range(rows):
+        await todo_item_service.create_todo_item(
+            author_id, todo_list_id, f"Created item {n}", today + timedelta(days=n % 30))
+    return rows
+
+
+async def rows_per_second(run) -> tuple[int, float]:
+    start = perf_counter()
+    rows = await run()
+    return rows, rows / (perf_counter() - start)
+
+
+async def main(rows: int, baseline_rows: int):
+    await database.connect()
+    user_id = await seed_user()
+    try:
+        print(f"import of {rows} rows")
+        for format in ("ndjson", "csv"):
+            todo_list_id = await seed_todo_list(user_id, 0)
+            body = upload(rows, format)
+            imported, rate = await rows_per_second(lambda: import_upload(todo_list_id, user_id, body, format))
+            print(f"  import_todo_items ({format}):{' ' * (6 - len(format))} {rate:10.0f} rows/s"
+                  f" ({imported} rows, {len(body) / 2 ** 20:.1f} MiB)")
+
+        todo_list_id = await seed_todo_list(user_id, 0)
+        created, rate = await rows_per_second(lambda: create_one_at_a_time(todo_list_id, user_id, baseline_rows))
+        print(f"  create_todo_item:          {rate:10.0f} rows/s ({created} rows)")
+    finally:
+        await delete_user(user_id)
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--baseline-rows", type=int, default=2000)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.baseline_rows))
@@ -0,0 +1,47 @@
+"""
+Maps the rows of a todo list to TodoItemDto with validation, map_to_models,
+and without, construct_models.
+"""
+import argparse
+import asyncio
+from time import perf_counter
+
+from common import database, delete_user, seed_todo_list, seed_user
+from dto.response_dtos import TodoItemDto
+from statistics import median
+
+
+def time_mapping(map_rows, rows, runs: int) -> float:
+    durations = []
+    for _ in range(runs):
+        start = perf_counter()
+        map_rows(rows, TodoItemDto)
+        durations.append((perf_counter() - start) * 1000)
+    return median(durations)
+
+
+async def main(items: int, runs: int):
+    await database.connect()
+    user_id = await seed_user()
+    try:
+        todo_list_id = await seed_todo_list(user_id, items)
+        rows = await database.fetch_all_statement(
+            "benchmark_items", "SELECT * FROM todo_item WHERE todo_list_id = :todo_list_id ORDER BY id",
+            {"todo_list_id": todo_list_id})
+    finally:
+        await delete_user(user_id)
+        await database.disconnect()
+
+    validated = time_mapping(database.map_to_models, rows, runs)
+    constructed = time_mapping(database.construct_models, rows, runs)
+    print(f"mapping {len(rows)} rows, median of {runs} runs")
+    print(f"  map_to_models:    {validated:8.1f} ms")
+    print(f"  construct_models: {constructed:8.1f} ms ({validated / constructed:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=9)
+    args = parser.parse_args()
+    asyncio.run(main(args.items, args.runs))
@@ -0,0 +1,95 @@
+"""
+Serializes a page of todo items through FastAPI's response model handling
+with its default JSONResponse and with the app's ORJSONResponse, and
+through TrustedJSONResponse. Needs no database.
+"""
+import argparse
+import asyncio
+from datetime import date, datetime, timedelta, timezone
+from statistics import median
+from time import perf_counter
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+from fastapi.utils import create_model_field  # noqa: E402
+from core.database_wrapper import DatabaseWrapper  # noqa: E402
+from core.responses import ORJSONResponse, TrustedJSONResponse  # noqa: E402
+from dto.response_dtos import PageDto, TodoItemDto  # noqa: E402
+
+
+def todo_item_rows(items: int) -> list[dict]:
+    now = datetime.now(timezone.utc)
+    return [
+        {
+            "id": n,
+            "author_id": 1,
+            "todo_list_id": 1,
+            "description": f"Todo item {n}",
+            "due_date": date.today() + timedelta(days=n % 30),
+            "completed": n % 3 == 0,
+            "created": now + timedelta(milliseconds=n),
+            "updated": now + timedelta(milliseconds=n),
+        }
+        for n in range(items)
+    ]
+
+
+# The response field FastAPI creates for response_model=PageDto[TodoItemDto]
+response_field = create_model_field(name="Response", type_=PageDto[TodoItemDto], mode="serialization")
+
+
+async def fastapi_response(rows: list[dict], response_class) -> bytes:
+    page = PageDto[TodoItemDto](items=DatabaseWrapper.map_to_models(rows, TodoItemDto), next_cursor=None)
+    content = await serialize_response(field=response_field, response_content=page, is_coroutine=True)
+    return response_class(content).body
+
+
+async def default_response(rows: list[dict]) -> bytes:
+    return await fastapi_response(rows, JSONResponse)
+
+
+async def orjson_response(rows: list[dict]) -> bytes:
+    return await fastapi_response(rows, ORJSONResponse)
+
+
+async def trusted_response(rows: list[dict]) -> bytes:
+    page = PageDto.model_construct(items=DatabaseWrapper.construct_models(rows, TodoItemDto), next_cursor=None)
+    return TrustedJSONResponse(page).body
+
+
+async def time_response(respond, rows: list[dict], runs: int) -> float:
+    durations = []
+    for _ in range(runs):
+        start = perf_counter()
+        await respond(rows)
+        durations.append((perf_counter() - start) * 1000)
+    return median(durations)
+
+
+async def main(items: int, runs: int):
+    rows = todo_item_rows(items)
+    body = await default_response(rows)
+    assert await orjson_response(rows) == body and await trusted_response(rows) == body, "Responses differ"
+
+    print(f"response of {items} todo items, {len(body)} bytes, median of {runs} runs")
+    default_ms = None
+    for label, respond in (
+        ("FastAPI default (JSONResponse):", default_response),
+        ("ORJSONResponse:", orjson_response),
+        ("TrustedJSONResponse:", trusted_response),
+    ):
+        duration = await time_response(respond, rows, runs)
+        default_ms = default_ms or duration
+        print(f"  {label:32} {duration:8.1f} ms ({default_ms / duration:.1f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--runs", type=int, default=21)
+    args = parser.parse_args()
+    asyncio.run(main(args.items, args.runs))
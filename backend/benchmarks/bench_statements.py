@@ -0,0 +1,74 @@
+"""
+Runs the page query of find_todo_items through SQLAlchemy text statements,
+compiled on every call, and as a registered prepared statement with
+fetch_all_statement.
+"""
+import argparse
+import asyncio
+
+from common import database, delete_user, measure, seed_todo_list, seed_user
+from core.query_builder import WhereClause
+
+PAGE_SQL = """
+SELECT ti.*
+FROM todo_item ti
+JOIN todo_list tl ON ti.todo_list_id = tl.id
+{where}
+ORDER BY ti.created, ti.id
+LIMIT :limit
+"""
+
+
+def page_query(todo_list_id: int, user_id: int) -> tuple[str, WhereClause]:
+    where = (
+        WhereClause()
+        .equals("ti.todo_list_id", "todo_list_id", todo_list_id)
+        .add(
+            "(tl.author_id = :user_id OR EXISTS ("
+            "SELECT 1 FROM todo_list_member tlm"
+            " WHERE tlm.todo_list_id = tl.id AND tlm.user_id = :user_id))",
+            user_id=user_id,
+        )
+    )
+    return PAGE_SQL.format(where=where), where
+
+
+async def run_text(todo_list_id: int, user_id: int, limit: int, queries: int):
+    for _ in range(queries):
+        sql, where = page_query(todo_list_id, user_id)
+        await database.fetch_all(where.bind(sql, limit=limit))
+
+
+async def run_statement(todo_list_id: int, user_id: int, limit: int, queries: int):
+    for _ in range(queries):
+        sql, where = page_query(todo_list_id, user_id)
+        await database.fetch_all_statement("benchmark_page", sql, where.values(limit=limit))
+
+
+async def main(items: int, limit: int, queries: int, runs: int):
+    await database.connect()
+    user_id = await seed_user()
+    try:
+        todo_list_id = await seed_todo_list(user_id, items)
+        # Warms up the connection and asyncpg's statement cache
+        await run_text(todo_list_id, user_id, limit, 10)
+        await run_statement(todo_list_id, user_id, limit, 10)
+
+        text_ms = await measure(lambda: run_text(todo_list_id, user_id, limit, queries), runs)
+        statement_ms = await measure(lambda: run_statement(todo_list_id, user_id, limit, queries), runs)
+        print(f"{queries} page queries of {limit} rows, median of {runs} runs")
+        print(f"  text().bindparams():  {text_ms:8.1f} ms ({text_ms * 1000 / queries:.0f} us/query)")
+        print(f"  fetch_all_statement:  {statement_ms:8.1f} ms ({statement_ms * 1000 / queries:.0f} us/query)")
+    finally:
+        await delete_user(user_id)
+        await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--limit", type=int, default=51)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.items, args.limit, args.queries, args.runs))
@@ -0,0 +1,76 @@
+"""
+Helpers of the benchmarks: run them from backend/ against a migrated
+database, e.g.
+
+    DATABASE_URL=postgresql://postgres@localhost/todo python benchmarks/bench_clone.py
+
+Every benchmark seeds its own user and todo lists and deletes them again.
+"""
+from statistics import median
+from time import perf_counter
+from typing import Awaitable, Callable
+import os
+import sys
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+os.environ.setdefault("WS_BROADCAST_BACKEND", "local")
+
+from core.database import database  # noqa: E402
+
+
+async def seed_user() -> int:
+    return await database.fetch_val(
+        "INSERT INTO users (username, password) VALUES (:username, '') RETURNING id",
+        {"username": f"benchmark-{uuid.uuid4()}"},
+    )
+
+
+async def seed_todo_list(author_id: int, items: int, name: str | None = None) -> int:
+    """
+    Creates a todo list with the given number of todo items.
+    :return: The id of the todo list.
+    """
+    todo_list_id = await database.fetch_val(
+        "INSERT INTO todo_list (author_id, name) VALUES (:author_id, :name) RETURNING id",
+        {"author_id": author_id, "name": name or f"benchmark-{uuid.uuid4()}"},
+    )
+    await database.execute(
+        """
+        INSERT INTO todo_item (author_id, todo_list_id, description, due_date, completed, created)
+        SELECT :author_id, :todo_list_id, 'Todo item ' || n, CURRENT_DATE + n % 30, n % 3 = 0,
+               CURRENT_TIMESTAMP + n * INTERVAL '1 millisecond'
+        FROM generate_series(1, :items) n
+        """,
+        {"author_id": author_id, "todo_list_id": todo_list_id, "items": items},
+    )
+    return todo_list_id
+
+
+async def delete_user(user_id: int):
+    """
+    Deletes a seeded user with its todo lists, todo items and their tombstones.
+    """
+    values = {"user_id": user_id}
+    await database.execute(
+        "DELETE FROM todo_list_member WHERE user_id = :user_id"
+        " OR todo_list_id IN (SELECT id FROM todo_list WHERE author_id = :user_id)", values)
+    await database.execute(
+        "DELETE FROM todo_item WHERE todo_list_id IN (SELECT id FROM todo_list WHERE author_id = :user_id)", values)
+    await database.execute(
+        "DELETE FROM todo_item_tombstone"
+        " WHERE todo_list_id IN (SELECT id FROM todo_list WHERE author_id = :user_id)", values)
+    await database.execute("DELETE FROM todo_list WHERE author_id = :user_id", values)
+    await database.execute("DELETE FROM users WHERE id = :user_id", values)
+
+
+async def measure(run: Callable[[], Awaitable[object]], runs: int) -> float:
+    """
+    :return: The median duration of the runs in milliseconds.
+    """
+    durations = []
+    for _ in range(runs):
+        start = perf_counter()
+        await run()
+        durations.append((perf_counter() - start) * 1000)
+    return median(durations)
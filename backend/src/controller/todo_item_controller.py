@@ -1,8 +1,14 @@
-from typing import List
-from fastapi import APIRouter, Request
+from typing import Literal
+from fastapi import APIRouter, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from starlette.authentication import requires
 from service import todo_item_service, todo_list_service
-from dto.request_dtos import CreateTodoItemRequest, UpdateTodoItemRequest
+from core.etag import etag_headers, etag_matches, make_etag, not_modified
+from core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from controller.ws_controller import notify_todo_items_changed
+from dto.request_dtos import BatchTodoItemsRequest, CreateTodoItemRequest, UpdateTodoItemRequest
+from core.responses import TrustedJSONResponse
+from dto.response_dtos import BatchTodoItemsResultDto, PageDto, TodoItemChangesDto, TodoItemDto, TodoItemImportResultDto
 
 from model.todo_item import TodoItem
 
@@ -13,21 +19,100 @@ logger = logging.getLogger(__name__)
 todo_item_router = APIRouter()
 
 
-@todo_item_router.get("/{todo_list_id}/todos")
+@todo_item_router.get("/{todo_list_id}/todos", response_model=PageDto[TodoItemDto])
 @requires('authenticated')
-async def find_todo_items(todo_list_id: int, request: Request) -> List[TodoItem]:
+async def find_todo_items(
+    todo_list_id: int,
+    request: Request,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+) -> Response:
     logger.info(
         f"Finding todos for todo list {todo_list_id} for user {request.user.user_id}")
-    return await todo_item_service.find_todo_items(todo_list_id=todo_list_id, user_id=request.user.user_id)
+    await todo_list_service.authorize_todo_list_access(
+        todo_list_id=todo_list_id,
+        user_id=request.user.user_id,
+        roles=['owner', 'editor', 'viewer']
+    )
+    async with todo_list_service.versioned_read():
+        version = await todo_list_service.find_todo_list_version(todo_list_id)
+        etag = make_etag("todo-items", todo_list_id, version and version["items_version"], cursor, limit)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        page = await todo_item_service.find_todo_items_page(todo_list_id=todo_list_id, user_id=request.user.user_id, cursor=cursor, limit=limit)
+    return TrustedJSONResponse(page, headers=etag_headers(etag))
+
+
+@todo_item_router.get("/{todo_list_id}/changes", response_model=TodoItemChangesDto)
+@requires('authenticated')
+async def find_todo_item_changes(
+    todo_list_id: int,
+    request: Request,
+    since: str | None = None,
+    page: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+) -> TrustedJSONResponse:
+    await todo_list_service.authorize_todo_list_access(
+        todo_list_id=todo_list_id,
+        user_id=request.user.user_id,
+        roles=['owner', 'editor', 'viewer']
+    )
+    changes = await todo_item_service.find_todo_item_changes(
+        todo_list_id=todo_list_id, since=since, page=page, limit=limit)
+    return TrustedJSONResponse(changes)
+
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+@todo_item_router.get("/{todo_list_id}/export")
+@requires('authenticated')
+async def export_todo_items(
+    todo_list_id: int,
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+) -> StreamingResponse:
+    logger.info(
+        f"Exporting todos of todo list {todo_list_id} as {format} for user {request.user.user_id}")
+    await todo_list_service.authorize_todo_list_access(
+        todo_list_id=todo_list_id,
+        user_id=request.user.user_id,
+        roles=['owner', 'editor', 'viewer']
+    )
+    return StreamingResponse(
+        await todo_item_service.export_todo_items(todo_list_id, format),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="todo-list-{todo_list_id}.{format}"'},
+    )
+
+
+@todo_item_router.post("/{todo_list_id}/import", response_model=TodoItemImportResultDto)
+@requires('authenticated')
+async def import_todo_items(
+    todo_list_id: int,
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+) -> TrustedJSONResponse:
+    logger.info(
+        f"Importing todos into todo list {todo_list_id} from {format} for user {request.user.user_id}")
+    await todo_list_service.authorize_todo_list_access(todo_list_id, request.user.user_id, ['owner', 'editor'])
+    result, created_ids = await todo_item_service.import_todo_items(
+        todo_list_id=todo_list_id, author_id=request.user.user_id, chunks=request.stream(), format=format)
+    await notify_todo_items_changed(todo_list_id, created=created_ids, updated=[], deleted=[])
+    return TrustedJSONResponse(result)
 
 
 @todo_item_router.get("/{todo_list_id}/todos/{todo_item_id}")
 @requires('authenticated')
-async def get_todo_item(todo_list_id: int, todo_item_id: int, request: Request) -> TodoItem | None:
+async def get_todo_item(todo_list_id: int, todo_item_id: int, request: Request) -> TodoItem:
     logger.info(
         f"Getting todo {todo_item_id} for todo list {todo_list_id} for user {request.user.user_id}")
-    await todo_list_service.authorize_todo_list_access(todo_list_id, request.user.user_id, ['owner', 'editor', 'viewer'])
-    return await todo_item_service.find_todo_item(todo_list_id=todo_list_id, user_id=request.user.user_id, id=todo_item_id)
+    return await todo_item_service.find_authorized_todo_item(
+        id=todo_item_id,
+        todo_list_id=todo_list_id,
+        user_id=request.user.user_id,
+        roles=['owner', 'editor', 'viewer']
+    )
 
 
 @todo_item_router.post("/{todo_list_id}/todos")
@@ -39,14 +124,34 @@ async def create_todo_item(todo_list_id: int, todo_item: CreateTodoItemRequest,
     return await todo_item_service.create_todo_item(author_id=request.user.user_id, todo_list_id=todo_list_id, **todo_item.model_dump())
 
 
+@todo_item_router.post("/{todo_list_id}/todos:batch", response_model=BatchTodoItemsResultDto)
+@requires('authenticated')
+async def batch_todo_items(todo_list_id: int, batch: BatchTodoItemsRequest, request: Request) -> TrustedJSONResponse:
+    logger.info(
+        f"Applying {len(batch.operations)} todo operations to todo list {todo_list_id} for user {request.user.user_id}")
+    await todo_list_service.authorize_todo_list_access(todo_list_id, request.user.user_id, ['owner', 'editor'])
+    results = await todo_item_service.apply_todo_item_batch(
+        todo_list_id=todo_list_id, author_id=request.user.user_id, operations=batch.operations)
+
+    changed: dict[str, list[int]] = {"create": [], "update": [], "delete": []}
+    for result in results:
+        if result.status < 300:
+            changed["update" if result.op == "complete" else result.op].append(result.id)
+    await notify_todo_items_changed(
+        todo_list_id, created=changed["create"], updated=changed["update"], deleted=changed["delete"])
+    return TrustedJSONResponse(BatchTodoItemsResultDto.model_construct(results=results))
+
+
 @todo_item_router.put("/{todo_list_id}/todos/{todo_item_id}")
 @requires('authenticated')
 async def update_todo_item(todo_list_id: int, todo_item_id: int, todo_item_values: UpdateTodoItemRequest, request: Request) -> TodoItem:
     logger.info(
         f"Updating todo {todo_item_id} for todo list {todo_list_id} for user {request.user.user_id}")
-    await todo_list_service.authorize_todo_list_access(todo_list_id, request.user.user_id, ['owner', 'editor'])
-    return await todo_item_service.update_todo_item(
+    return await todo_item_service.update_authorized_todo_item(
         id=todo_item_id,
+        todo_list_id=todo_list_id,
+        user_id=request.user.user_id,
+        roles=['owner', 'editor'],
         values=todo_item_values
     )
 
@@ -56,8 +161,12 @@ async def update_todo_item(todo_list_id: int, todo_item_id: int, todo_item_value
 async def delete_todo_item(todo_list_id: int, todo_item_id: int, request: Request) -> bool:
     logger.info(
         f"Deleting todo {todo_item_id} for todo list {todo_list_id} for user {request.user.user_id}")
-    await todo_list_service.authorize_todo_list_access(todo_list_id, request.user.user_id, ['owner', 'editor'])
-    return await todo_item_service.delete_todo_item(id=todo_item_id, todo_list_id=todo_list_id)
+    return await todo_item_service.delete_authorized_todo_item(
+        id=todo_item_id,
+        todo_list_id=todo_list_id,
+        user_id=request.user.user_id,
+        roles=['owner', 'editor']
+    )
 
 
 @todo_item_router.post("/{todo_list_id}/todos/{todo_item_id}/clone")
@@ -65,5 +174,9 @@ async def delete_todo_item(todo_list_id: int, todo_item_id: int, request: Reques
 async def clone_todo_item(todo_list_id: int, todo_item_id: int, request: Request) -> TodoItem:
     logger.info(
         f"Cloning todo {todo_item_id} for todo list {todo_list_id} for user {request.user.user_id}")
-    await todo_list_service.authorize_todo_list_access(todo_list_id, request.user.user_id, ['owner', 'editor'])
-    return await todo_item_service.clone_todo_item(id=todo_item_id, author_id=request.user.user_id, todo_list_id=todo_list_id)
+    return await todo_item_service.clone_authorized_todo_item(
+        id=todo_item_id,
+        todo_list_id=todo_list_id,
+        user_id=request.user.user_id,
+        roles=['owner', 'editor']
+    )
@@ -1,8 +1,11 @@
 from http import HTTPStatus
 from typing import List
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from starlette.authentication import requires
-from dto.response_dtos import TodoListDto, TodoListMemberDto
+from core.etag import etag_headers, etag_matches, make_etag, not_modified
+from core.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from core.responses import TrustedJSONResponse
+from dto.response_dtos import PageDto, TodoListDto, TodoListMemberDto, TodoListMembersUpdateDto
 from model.todo_list_role import TodoListRole
 from service import todo_list_service
 from dto.request_dtos import CreateTodoListRequest, CloneTodoListRequest, ShareTodoListRequest
@@ -16,11 +19,21 @@ logger = logging.getLogger(__name__)
 todo_list_router = APIRouter()
 
 
-@todo_list_router.get("/")
+@todo_list_router.get("/", response_model=PageDto[TodoListDto])
 @requires('authenticated')
-async def find_todo_lists(request: Request) -> List[TodoListDto]:
+async def find_todo_lists(
+    request: Request,
+    cursor: str | None = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+) -> Response:
     logger.info(f"Finding todo lists for user {request.user.user_id}")
-    return await todo_list_service.find_todo_lists(user_id=request.user.user_id)
+    async with todo_list_service.versioned_read():
+        version = await todo_list_service.find_todo_lists_version(request.user.user_id)
+        etag = make_etag("todo-lists", request.user.user_id, version, cursor, limit)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        page = await todo_list_service.find_todo_lists_page(user_id=request.user.user_id, cursor=cursor, limit=limit)
+    return TrustedJSONResponse(page, headers=etag_headers(etag))
 
 
 @todo_list_router.post("/")
@@ -35,15 +48,26 @@ async def find_todo_list_roles() -> List[TodoListRole]:
     return await todo_list_service.find_todo_list_roles()
 
 
-@todo_list_router.get("/{todo_list_id}")
+@todo_list_router.get("/{todo_list_id}", response_model=TodoListDto)
 @requires('authenticated')
-async def find_todo_list(todo_list_id: int, request: Request) -> TodoListDto:
+async def find_todo_list(todo_list_id: int, request: Request, response: Response) -> TodoListDto | Response:
     logger.info(
         f"Finding todo list {todo_list_id} for user {request.user.user_id}")
-    todo_list = await todo_list_service.find_todo_list(id=todo_list_id, user_id=request.user.user_id)
+    role = await todo_list_service.find_todo_list_role(todo_list_id, request.user.user_id)
+    async with todo_list_service.versioned_read():
+        version = await todo_list_service.find_todo_list_version(todo_list_id)
+        if role is None or version is None:
+            raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
+                                detail=f"Todo list with id {todo_list_id} not found")
+        etag = make_etag("todo-list", todo_list_id, version["version"], role)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+
+        todo_list = await todo_list_service.find_todo_list(id=todo_list_id, user_id=request.user.user_id)
     if todo_list is None:
         raise HTTPException(status_code=HTTPStatus.NOT_FOUND,
                             detail=f"Todo list with id {todo_list_id} not found")
+    response.headers.update(etag_headers(etag))
     return todo_list
 
 
@@ -75,12 +99,11 @@ async def clone_todo_list(todo_list_id: int, todo_list_clone: CloneTodoListReque
 
 @todo_list_router.post("/{todo_list_id}/share")
 @requires('authenticated')
-async def share_todo_list(todo_list_id: int, share_request: ShareTodoListRequest, request: Request) -> bool:
+async def share_todo_list(todo_list_id: int, share_request: ShareTodoListRequest, request: Request) -> TodoListMembersUpdateDto:
     logger.info(
         f"Sharing todo list {todo_list_id} for users {share_request.user_ids} with role {share_request.role_id}")
     await todo_list_service.authorize_todo_list_access(todo_list_id, request.user.user_id, ['owner'])
-    await todo_list_service.add_todo_list_members(todo_list_id=todo_list_id, user_ids=share_request.user_ids, todo_list_role_id=share_request.role_id)
-    return True
+    return await todo_list_service.add_todo_list_members(todo_list_id=todo_list_id, user_ids=share_request.user_ids, todo_list_role_id=share_request.role_id)
 
 @todo_list_router.get("/{todo_list_id}/members")
 @requires('authenticated')
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Query
 from pydantic import BaseModel
 
 from dto.response_dtos import UserDto
@@ -39,7 +39,10 @@ async def refresh_token(body: TokenRefreshRequest) -> AuthData:
 
 
 @user_router.get("/")
-async def find_users(request: Request) -> list[UserDto]:
-    users = await user_service.find_users(query_string=request.query_params.get("queryString"))
+async def find_users(
+    query_string: str | None = Query(None, alias="queryString"),
+    limit: int = Query(10, ge=1, le=user_service.USER_SEARCH_MAX_LIMIT),
+) -> list[UserDto]:
+    users = await user_service.search_users(query_string=query_string, limit=limit)
     return [UserDto.from_user(user) for user in users]
 
@@ -1,4 +1,6 @@
+from datetime import date
 from typing import Annotated
+import os
 from fastapi import (
     APIRouter,
     Depends,
@@ -7,24 +9,125 @@ from fastapi import (
     WebSocketException,
     status as http_status,
 )
+from pydantic import ValidationError
 from starlette.authentication import AuthenticationError
 from core import jwt
+from dto.request_dtos import UpdateTodoItemRequest
 from dto.response_dtos import UserDto
-from service import todo_list_service
+from service import todo_item_service, todo_list_service
 import json
 
+from core.broadcast import create_broadcast_bus
+from core.coalescing import Coalescer
+from core.database_wrapper import is_connection_error
+from core.presence import PresenceStore
 from core.websocket import ConnectionManager
+from core.write_behind import Pending, WriteBehindBuffer
 
 
+WS_SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+
+# "postgres" shares broadcasts between workers through LISTEN/NOTIFY,
+# "local" keeps them within the worker
+WS_BROADCAST_BACKEND = os.getenv("WS_BROADCAST_BACKEND", "postgres")
+WS_BROADCAST_CHANNEL = os.getenv("WS_BROADCAST_CHANNEL", "ws_broadcast")
+
+broadcast_bus = create_broadcast_bus(WS_BROADCAST_BACKEND, os.environ["DATABASE_URL"], WS_BROADCAST_CHANNEL)
+
+# Unsaved edit buffers expire after WS_EDIT_STATE_TTL_SECONDS without updates
+# and are evicted once they take more than WS_EDIT_STATE_MAX_CHARS in total
+WS_EDIT_STATE_TTL_SECONDS = float(os.getenv("WS_EDIT_STATE_TTL_SECONDS", "300"))
+WS_EDIT_STATE_MAX_CHARS = int(os.getenv("WS_EDIT_STATE_MAX_CHARS", str(16 * 1024 * 1024)))
+
 ws_router = APIRouter()
-manager = ConnectionManager()
+manager = ConnectionManager(send_queue_size=WS_SEND_QUEUE_SIZE, bus=broadcast_bus)
+presence = PresenceStore(edit_ttl_seconds=WS_EDIT_STATE_TTL_SECONDS, max_edit_chars=WS_EDIT_STATE_MAX_CHARS)
+
+
+async def broadcast_edit(key: tuple[int, int], value: tuple[str, WebSocket]):
+    todo_list_id, _ = key
+    message, websocket = value
+    await manager.broadcast(message, websocket, todo_list_id)
+
+
+# Description edits of an item are merged within WS_EDIT_COALESCE_MS and
+# only the latest one is broadcast, 0 broadcasts every edit
+WS_EDIT_COALESCE_MS = float(os.getenv("WS_EDIT_COALESCE_MS", "50"))
+edit_coalescer: Coalescer[tuple[int, int], tuple[str, WebSocket]] = Coalescer(
+    WS_EDIT_COALESCE_MS / 1000, broadcast_edit)
+
+
+async def persist_todo_item_updates(updates: Pending) -> list[tuple[int, int]]:
+    """
+    :return: The updates that were not applied, which the buffer reports as dropped.
+    """
+    updated, not_applied = await todo_item_service.update_todo_items(updates)
+    for todo_list_id, todo_item_ids in updated.items():
+        for todo_item_id in todo_item_ids:
+            await manager.broadcast(
+                json.dumps({"action": "todo_item_update", "todo_item_id": todo_item_id}),
+                None,
+                todo_list_id,
+            )
+    return not_applied
+
+
+async def report_dropped_todo_item_update(
+    _todo_list_id: int, todo_item_id: int, _values: dict, websockets: set[WebSocket], error: Exception
+):
+    # Updates not applied by persist_todo_item_updates are reported as LookupErrors
+    if isinstance(error, LookupError):
+        detail = f"Todo item with id {todo_item_id} not found"
+    else:
+        detail = "The update could not be saved"
+    for websocket in websockets:
+        await send_error(websocket, todo_item_id, detail)
+
+
+# Todo item updates sent over websockets are persisted in batches every
+# WS_WRITE_BEHIND_INTERVAL_MS or once WS_WRITE_BEHIND_MAX_PENDING items wait.
+# An update failing WS_WRITE_BEHIND_MAX_ATTEMPTS flushes on its own is dropped
+# and its senders get an error. Updates are kept while the database is unreachable.
+WS_WRITE_BEHIND_INTERVAL_MS = float(os.getenv("WS_WRITE_BEHIND_INTERVAL_MS", "250"))
+WS_WRITE_BEHIND_MAX_PENDING = int(os.getenv("WS_WRITE_BEHIND_MAX_PENDING", "500"))
+WS_WRITE_BEHIND_MAX_ATTEMPTS = int(os.getenv("WS_WRITE_BEHIND_MAX_ATTEMPTS", "3"))
+todo_item_write_buffer = WriteBehindBuffer(
+    persist_todo_item_updates,
+    interval_seconds=WS_WRITE_BEHIND_INTERVAL_MS / 1000,
+    max_pending=WS_WRITE_BEHIND_MAX_PENDING,
+    max_attempts=WS_WRITE_BEHIND_MAX_ATTEMPTS,
+    on_drop=report_dropped_todo_item_update,
+    is_unavailable=is_connection_error,
+)
+
+
+async def notify_todo_items_changed(
+    todo_list_id: int, created: list[int], updated: list[int], deleted: list[int]
+):
+    """
+    Notifies the members of a todo list of many changed todo items in one message.
+    """
+    if not (created or updated or deleted):
+        return
+    await manager.broadcast(
+        json.dumps(
+            {
+                "action": "todo_items_batch",
+                "created": created,
+                "updated": sorted(set(updated) - set(deleted)),
+                "deleted": sorted(set(deleted)),
+            }
+        ),
+        None,
+        todo_list_id,
+    )
 
 
 def authenticate(_websocket: WebSocket, access_token: str | None) -> UserDto:
     if access_token is None:
         raise WebSocketException(code=http_status.WS_1008_POLICY_VIOLATION)
 
-    payload = jwt.decode(access_token)
+    payload = jwt.decode_cached(access_token)
     user_id = payload.get("user_id")
     username = payload.get("username")
 
@@ -34,6 +137,36 @@ def authenticate(_websocket: WebSocket, access_token: str | None) -> UserDto:
     return UserDto(id=user_id, username=username)
 
 
+async def send_error(websocket: WebSocket, todo_item_id: int | None, detail: str):
+    await manager.send_personal_message(
+        json.dumps({"action": "error", "todo_item_id": todo_item_id, "detail": detail}),
+        websocket,
+    )
+
+
+async def buffer_todo_item_update(websocket: WebSocket, todo_list_id: int, user: UserDto, data: dict):
+    """
+    Buffers a todo item update sent with its values. The update is
+    broadcast to the list once it has been persisted.
+    """
+    todo_item_id = data.get("todo_item_id")
+    role = await todo_list_service.find_todo_list_role(todo_list_id, user.id)
+    if role not in ("owner", "editor"):
+        await send_error(websocket, todo_item_id, "You do not have permission to perform this action")
+        return
+    try:
+        todo_item_id = int(todo_item_id)
+        values = UpdateTodoItemRequest.model_validate(data["values"]).model_dump(exclude_unset=True)
+        if values.get("due_date") is not None:
+            values["due_date"] = date.fromisoformat(values["due_date"])
+    except (ValidationError, ValueError, TypeError) as e:
+        await send_error(websocket, todo_item_id, str(e))
+        return
+
+    await edit_coalescer.flush((todo_list_id, todo_item_id))
+    presence.clear_edit(todo_list_id, todo_item_id)
+    todo_item_write_buffer.add(todo_list_id, todo_item_id, values, source=websocket)
+
 
 # Example websocket endpoint
 @ws_router.websocket("/{client_id}")
@@ -56,7 +189,12 @@ async def todo_list_websocket_endpoint(
     todo_list_id: int,
     user: Annotated[UserDto, Depends(authenticate)],
 ):
-    await manager.connect(websocket)
+    # Authorize before joining the room to not leak its messages
+    todo_list = await todo_list_service.find_todo_list(id=todo_list_id, user_id=user.id)
+    if todo_list is None:
+        raise WebSocketException(code=http_status.WS_1008_POLICY_VIOLATION)
+
+    await manager.connect(websocket, todo_list_id)
     await manager.broadcast(
         json.dumps(
             {
@@ -65,31 +203,45 @@ async def todo_list_websocket_endpoint(
             }
         ),
         websocket,
+        todo_list_id,
+    )
+    presence.join(todo_list_id, user.model_dump())
+    await manager.send_personal_message(
+        json.dumps({"action": "init", "data": presence.snapshot(todo_list_id)}),
+        websocket,
     )
-    manager.data.setdefault("users", {})[user.id] = user.model_dump()
 
-    todo_list = await todo_list_service.find_todo_list(id=todo_list_id, user_id=user.id)
-    if todo_list is None:
-        raise WebSocketException(code=http_status.WS_1008_POLICY_VIOLATION)
+    joined = True
 
-    data = manager.data
-    if len(data) > 0:
-        await manager.send_personal_message(
-            json.dumps({"action": "init", "data": data}),
+    async def leave():
+        nonlocal joined
+        if not joined:
+            return
+        joined = False
+        manager.disconnect(websocket)
+        presence.leave(todo_list_id, user.id)
+        await manager.broadcast(
+            json.dumps({"action": "disconnect", "user": user.model_dump()}),
             websocket,
+            todo_list_id,
         )
 
     try:
         while True:
             data = json.loads(await websocket.receive_text())
             action = data.get("action")
-            if action in (
+            if action == "todo_item_update" and "values" in data:
+                await buffer_todo_item_update(websocket, todo_list_id, user, data)
+
+            elif action in (
                 "todo_item_create",
                 "todo_item_update",
                 "todo_item_delete",
                 "todo_item_open_for_editing",
                 "todo_item_close_editing",
             ):
+                # Deliver pending description edits before e.g. closing the editor
+                await edit_coalescer.flush((todo_list_id, data.get("todo_item_id")))
                 await manager.broadcast(
                     json.dumps(
                         {
@@ -98,40 +250,29 @@ async def todo_list_websocket_endpoint(
                         }
                     ),
                     websocket,
+                    todo_list_id,
                 )
+                if action in ("todo_item_update", "todo_item_delete", "todo_item_close_editing"):
+                    presence.clear_edit(todo_list_id, data.get("todo_item_id"))
 
             elif action == "todo_item_edit_description":
                 todo_item_id = data.get("todo_item_id")
                 description = data.get("description")
-                await manager.broadcast(
-                    json.dumps(
-                        {
-                            "action": action,
-                            "todo_item_id": todo_item_id,
-                            "description": description,
-                        }
-                    ),
-                    websocket,
+                message = json.dumps(
+                    {
+                        "action": action,
+                        "todo_item_id": todo_item_id,
+                        "description": description,
+                    }
                 )
-                todo_item_edit_state = manager.data.setdefault(
-                    "todo_item_edit_state", {}
-                )
-                todo_item_edit_state.setdefault(
-                    todo_item_id, {"description": description}
-                )["description"] = description
+                await edit_coalescer.submit(
+                    (todo_list_id, todo_item_id), (message, websocket), size=len(message))
+                presence.set_edit(todo_list_id, todo_item_id, description or "")
 
             elif action == "disconnect":
-                manager.disconnect(websocket)
-                manager.data["users"].pop(user.id)
-                await manager.broadcast(
-                    json.dumps({"action": action, "user": user.model_dump()}),
-                    websocket,
-                )
+                await leave()
 
     except WebSocketDisconnect:
-        manager.disconnect(websocket)
-        manager.data["users"].pop(user.id)
-        await manager.broadcast(
-            json.dumps({"action": "disconnect", "user": user.model_dump()}),
-            websocket,
-        )
+        pass
+    finally:
+        await leave()
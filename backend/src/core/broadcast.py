@@ -0,0 +1,232 @@
+from itertools import count
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Hashable
+import asyncio
+import json
+import uuid
+
+import asyncpg
+
+from core.cache import TTLCache
+
+logger = getLogger("app.broadcast")
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more, leave room for the header
+NOTIFY_PAYLOAD_LIMIT = 7900
+
+# Maximum number of queued messages sent in one round trip
+PUBLISH_BATCH_SIZE = 100
+
+Deliver = Callable[[Hashable, str], Awaitable[None]]
+
+
+def split_utf8(data: bytes, size: int) -> list[str]:
+    """
+    Splits UTF-8 encoded data into strings of at most size bytes without
+    splitting multibyte characters.
+    """
+    chunks = []
+    start = 0
+    while start < len(data):
+        end = min(start + size, len(data))
+        # Continuation bytes look like 0b10xxxxxx
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        chunks.append(data[start:end].decode())
+        start = end
+    return chunks
+
+
+class BroadcastBus:
+    """
+    Delivers messages published to a room by one worker to the other workers.
+    Messages are delivered to the publishing worker's own connections
+    directly and never echoed back to it. This base implementation serves a
+    single worker.
+
+    Rooms have to be JSON scalars such as todo list ids.
+    """
+
+    def __init__(self):
+        self.deliver: Deliver | None = None
+
+    async def connect(self, deliver: Deliver):
+        """
+        :param deliver: Called with the room and message of every message
+            published by another worker.
+        """
+        self.deliver = deliver
+
+    async def disconnect(self):
+        self.deliver = None
+
+    async def publish(self, room: Hashable, message: str):
+        pass
+
+
+class PostgresBroadcastBus(BroadcastBus):
+    """
+    Shares messages between workers through Postgres LISTEN/NOTIFY on a
+    channel. Payloads above NOTIFY_PAYLOAD_LIMIT are split into chunks that
+    are sent in one transaction and reassembled by the listeners.
+
+    Publishing only queues a message. A publisher task sends the queued
+    messages in order, up to PUBLISH_BATCH_SIZE per round trip, so
+    publishers never wait for Postgres. Messages that cannot be sent, or
+    that do not fit into the full queue, are logged and dropped.
+    """
+
+    def __init__(self,
+                 database_url: str,
+                 channel: str = "ws_broadcast",
+                 chunk_ttl_seconds: float = 30,
+                 publish_queue_size: int = 10000):
+        super().__init__()
+        self.database_url = database_url
+        self.channel = channel
+        self.worker_id = uuid.uuid4().hex[:12]
+        self.published = 0
+        self.dropped = 0
+        self.received = 0
+        self._message_ids = count()
+        # Chunks of messages received partially, keyed by (worker id, message id)
+        self._partial: TTLCache[tuple[str, int], list[str | None]] = TTLCache(maxsize=1024, ttl=chunk_ttl_seconds)
+        self._listen_connection: asyncpg.Connection | None = None
+        self._notify_connection: asyncpg.Connection | None = None
+        # Payloads of each queued message
+        self._outbox: asyncio.Queue[list[str]] = asyncio.Queue(maxsize=publish_queue_size)
+        self._publisher: asyncio.Task | None = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def connect(self, deliver: Deliver):
+        await super().connect(deliver)
+        await self._listen()
+        self._notify_connection = await asyncpg.connect(self.database_url)
+        self._publisher = asyncio.create_task(self._publish_queued())
+
+    async def disconnect(self, drain_timeout_seconds: float = 5):
+        try:
+            await asyncio.wait_for(self._outbox.join(), drain_timeout_seconds)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self._outbox.qsize()} unpublished broadcast messages")
+        if self._publisher is not None:
+            self._publisher.cancel()
+            self._publisher = None
+        await super().disconnect()
+        for connection in (self._listen_connection, self._notify_connection):
+            if connection is not None:
+                await connection.close()
+        self._listen_connection = None
+        self._notify_connection = None
+
+    async def _listen(self):
+        self._listen_connection = await asyncpg.connect(self.database_url)
+        self._listen_connection.add_termination_listener(self._on_termination)
+        await self._listen_connection.add_listener(self.channel, self._on_notification)
+
+    def _on_termination(self, _connection: Any):
+        if self.deliver is not None:
+            self._spawn(self._relisten())
+
+    async def _relisten(self, retry_seconds: float = 1):
+        while self.deliver is not None:
+            try:
+                await self._listen()
+                logger.info(f"Listening to {self.channel!r} again")
+                return
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.warning(f"Reconnecting to listen to {self.channel!r} failed: {e}")
+                await asyncio.sleep(retry_seconds)
+
+    def _spawn(self, coroutine: Awaitable[None]):
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def publish(self, room: Hashable, message: str):
+        body = json.dumps([room, message], separators=(",", ":"), ensure_ascii=False).encode()
+        chunks = split_utf8(body, NOTIFY_PAYLOAD_LIMIT)
+        message_id = next(self._message_ids)
+        payloads = [
+            f"{self.worker_id}:{message_id}:{index}:{len(chunks)}:{chunk}"
+            for index, chunk in enumerate(chunks)
+        ]
+        try:
+            self._outbox.put_nowait(payloads)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Broadcast queue is full, dropping a message to room {room!r}")
+
+    async def _publish_queued(self):
+        while True:
+            batch = [await self._outbox.get()]
+            while len(batch) < PUBLISH_BATCH_SIZE and not self._outbox.empty():
+                batch.append(self._outbox.get_nowait())
+            try:
+                await self._notify([payload for payloads in batch for payload in payloads])
+                self.published += len(batch)
+            except Exception as e:
+                self.dropped += len(batch)
+                logger.warning(f"Publishing {len(batch)} broadcast messages failed: {e}")
+            finally:
+                for _ in batch:
+                    self._outbox.task_done()
+
+    async def _notify(self, payloads: list[str]):
+        if self._notify_connection is None or self._notify_connection.is_closed():
+            self._notify_connection = await asyncpg.connect(self.database_url)
+        if len(payloads) == 1:
+            await self._notify_connection.execute("SELECT pg_notify($1, $2)", self.channel, payloads[0])
+        else:
+            # Notifications of a transaction are delivered together and in order
+            async with self._notify_connection.transaction():
+                await self._notify_connection.executemany(
+                    "SELECT pg_notify($1, $2)", [(self.channel, payload) for payload in payloads])
+
+    def _on_notification(self, _connection: Any, _pid: int, _channel: str, payload: str):
+        worker_id, message_id, index, total, chunk = payload.split(":", 4)
+        if worker_id == self.worker_id:
+            return
+        index, total = int(index), int(total)
+        if total > 1:
+            key = (worker_id, int(message_id))
+            chunks = self._partial.get(key) or [None] * total
+            chunks[index] = chunk
+            if None in chunks:
+                self._partial.set(key, chunks)
+                return
+            self._partial.invalidate(key)
+            chunk = "".join(chunks)
+        room, message = json.loads(chunk)
+        self.received += 1
+        self._spawn(self._deliver(room, message))
+
+    async def _deliver(self, room: Hashable, message: str):
+        try:
+            await self.deliver(room, message)
+        except Exception as e:
+            logger.warning(f"Delivering a broadcast message to room {room!r} failed: {e}")
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "published": self.published,
+            "dropped": self.dropped,
+            "queued": self._outbox.qsize(),
+            "received": self.received,
+            "partial_messages": len(self._partial),
+        }
+
+
+def create_broadcast_bus(backend: str, database_url: str, channel: str) -> BroadcastBus:
+    """
+    :param backend: "postgres" to share messages between workers through
+        LISTEN/NOTIFY, "local" to keep them within the worker.
+    :param database_url: The database connection url for the postgres backend.
+    :param channel: The channel of the bus.
+    :raises ValueError: If the backend is unknown.
+    """
+    if backend == "postgres":
+        return PostgresBroadcastBus(database_url, channel=channel)
+    if backend == "local":
+        return BroadcastBus()
+    raise ValueError(f"Unknown broadcast backend {backend!r}, use postgres or local")
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Callable, Generic, Hashable, TypeVar
+
+KeyType = TypeVar("KeyType", bound=Hashable)
+ValueType = TypeVar("ValueType")
+
+
+class TTLCache(Generic[KeyType, ValueType]):
+    """
+    In-process cache with a bounded size and a time to live for its entries.
+    The least recently used entry is evicted when the cache is full.
+
+    The generation changes with every invalidation. Values loaded while an
+    invalidation happened may be stale, so set skips them when given the
+    generation read before loading.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = 0
+        self._entries: OrderedDict[KeyType, tuple[float, ValueType]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: KeyType) -> ValueType | None:
+        """
+        Returns the cached value or None if the key is missing or expired.
+        :param key: The cache key.
+        :return: The cached value or None.
+        """
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: KeyType, value: ValueType, ttl: float | None = None, generation: int | None = None) -> None:
+        """
+        Stores a value, evicting the least recently used entry if the cache is full.
+        :param key: The cache key.
+        :param value: The value to store.
+        :param ttl: Optional time to live overriding the cache default.
+        :param generation: Optional generation read before loading the value,
+            the value is not stored if the cache has been invalidated since.
+        """
+        if self.maxsize <= 0 or (generation is not None and generation != self.generation):
+            return
+        self._entries[key] = (monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: KeyType) -> None:
+        """
+        Removes a single entry.
+        :param key: The cache key.
+        """
+        self.generation += 1
+        self._entries.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[KeyType], bool]) -> None:
+        """
+        Removes every entry whose key matches the predicate.
+        :param predicate: Function returning True for keys to remove.
+        """
+        self.generation += 1
+        for key in [key for key in self._entries if predicate(key)]:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self.generation += 1
+        self._entries.clear()
+
+    def stats(self) -> dict[str, int | float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
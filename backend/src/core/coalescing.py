@@ -0,0 +1,71 @@
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+import asyncio
+
+KeyType = TypeVar("KeyType", bound=Hashable)
+ValueType = TypeVar("ValueType")
+
+
+class Coalescer(Generic[KeyType, ValueType]):
+    """
+    Merges values submitted under the same key within a time window and
+    emits only the latest one when the window closes.
+    """
+
+    def __init__(self, window_seconds: float, emit: Callable[[KeyType, ValueType], Awaitable[None]]):
+        self.window_seconds = window_seconds
+        self.emit = emit
+        self.submitted = 0
+        self.emitted = 0
+        self.coalesced_bytes = 0
+        # key -> (value, size)
+        self._pending: dict[KeyType, tuple[ValueType, int]] = {}
+        self._timers: dict[KeyType, asyncio.TimerHandle] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def submit(self, key: KeyType, value: ValueType, size: int = 0):
+        """
+        Replaces the pending value of the key, emitting right away if the
+        window is zero.
+        :param size: Size of the value in bytes for the statistics.
+        """
+        self.submitted += 1
+        if self.window_seconds <= 0:
+            self.emitted += 1
+            await self.emit(key, value)
+            return
+        replaced = self._pending.get(key)
+        if replaced is not None:
+            self.coalesced_bytes += replaced[1]
+        else:
+            self._timers[key] = asyncio.get_running_loop().call_later(
+                self.window_seconds, self._flush_later, key)
+        self._pending[key] = (value, size)
+
+    async def flush(self, key: KeyType):
+        """
+        Emits the pending value of the key now, e.g. before a message that
+        has to be delivered after it.
+        """
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(key, None)
+        if pending is None:
+            return
+        value, _ = pending
+        self.emitted += 1
+        await self.emit(key, value)
+
+    def _flush_later(self, key: KeyType):
+        self._timers.pop(key, None)
+        task = asyncio.create_task(self.flush(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "submitted": self.submitted,
+            "emitted": self.emitted,
+            "coalesced": self.submitted - self.emitted - len(self._pending),
+            "coalesced_bytes": self.coalesced_bytes,
+        }
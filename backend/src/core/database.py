@@ -11,4 +11,38 @@ if database_url is None:
 database_url = database_url.replace(
     "postgresql://", "postgresql+asyncpg://")
 
-database = DatabaseWrapper(database_url)
+# Query logging: a sample rate between 0 (off) and 1 (every query) and/or
+# a threshold in milliseconds above which every query is logged as slow
+query_log_sample_rate = float(os.getenv('DB_QUERY_LOG_SAMPLE_RATE', '0'))
+slow_query_ms = os.getenv('DB_SLOW_QUERY_MS')
+
+# Sizes of the compiled statement registry and of asyncpg's per connection
+# prepared statement cache
+statement_registry_size = int(os.getenv('DB_STATEMENT_REGISTRY_SIZE', '256'))
+prepared_statement_cache_size = int(os.getenv('DB_PREPARED_STATEMENT_CACHE_SIZE', '256'))
+
+# Read only service functions run in autocommit mode by default, set to
+# "transaction" to run them in READ ONLY transactions instead
+read_only_mode = os.getenv('DB_READ_ONLY_MODE', 'autocommit')
+
+# Optional comma separated read replica urls and the replication lag in
+# seconds above which reads fall back to the primary
+replica_urls = [
+    url.strip().replace("postgresql://", "postgresql+asyncpg://")
+    for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',')
+    if url.strip()
+]
+replica_max_lag_seconds = float(os.getenv('DB_REPLICA_MAX_LAG_SECONDS', '5'))
+replica_lag_check_interval_seconds = float(os.getenv('DB_REPLICA_LAG_CHECK_INTERVAL_SECONDS', '1'))
+
+database = DatabaseWrapper(
+    database_url,
+    query_log_sample_rate=query_log_sample_rate,
+    slow_query_ms=float(slow_query_ms) if slow_query_ms else None,
+    statement_registry_size=statement_registry_size,
+    prepared_statement_cache_size=prepared_statement_cache_size,
+    autocommit_reads=read_only_mode != 'transaction',
+    replica_urls=replica_urls,
+    replica_max_lag_seconds=replica_max_lag_seconds,
+    replica_lag_check_interval_seconds=replica_lag_check_interval_seconds,
+)
@@ -1,77 +1,519 @@
 from databases import Database
+from databases.core import Connection
 from databases.interfaces import Record
 from fastapi import HTTPException
 from pydantic import BaseModel
-from sqlalchemy import ClauseElement, Compiled
+from sqlalchemy import ClauseElement, text
+from sqlalchemy.dialects import postgresql
+import asyncpg
 
-from typing import Type, TypeVar
-from logging import getLogger
+from contextlib import AbstractAsyncContextManager, asynccontextmanager, nullcontext
+from contextvars import ContextVar, Token
+from hashlib import sha1
+from types import FunctionType
+from random import random
+from time import perf_counter
+from typing import Any, AsyncIterator, Awaitable, Callable, Type, TypeVar
+from logging import INFO, WARNING, getLogger
+import asyncio
+import functools
+import json
+import re
 
-from sqlmodel import SQLModel
+from core.cache import TTLCache
+from core.replicas import Replica, ReplicaRouter
 
 logger = getLogger("app.db.execute")
+transaction_logger = getLogger("app.db.transaction")
+
+ResultType = TypeVar("ResultType")
+
+
+class OpenScope:
+    """
+    The outermost transaction or read only scope open in a task, which
+    nested scopes of the same task join, and the callbacks to run once its
+    transaction has committed.
+    """
+
+    def __init__(self, readonly: bool, options: dict[str, Any]):
+        self.readonly = readonly
+        self.options = options
+        self.task = asyncio.current_task()
+        self.after_commit: list[Callable[[], Awaitable[None]]] = []
+
+
+# Routing state of the current task: the replica read only scopes run on,
+# the replica chosen for all reads of the task, the scope open in the task,
+# and whether the task reads from the primary, e.g. after writing to it
+READ_REPLICA: ContextVar[Replica | None] = ContextVar("app.db.read_replica", default=None)
+TASK_REPLICA: ContextVar[Replica | None] = ContextVar("app.db.task_replica", default=None)
+OPEN_SCOPE: ContextVar[OpenScope | None] = ContextVar("app.db.open_scope", default=None)
+PRIMARY_PINNED: ContextVar[bool] = ContextVar("app.db.primary_pinned", default=False)
+
+
+def reset_context_var(var: ContextVar, token: Token):
+    """
+    Resets a context variable, unless the token was created in another
+    context: the event loop closes abandoned async generators, e.g. of an
+    unfinished iterate_statement, in a context of their own.
+    """
+    try:
+        var.reset(token)
+    except ValueError:
+        pass
+
+
+CONNECTION_ERRORS = (
+    OSError,
+    TimeoutError,
+    asyncpg.InterfaceError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.CannotConnectNowError,
+    asyncpg.TooManyConnectionsError,
+    asyncpg.AdminShutdownError,
+    asyncpg.CrashShutdownError,
+)
+
+
+def is_connection_error(error: BaseException | None) -> bool:
+    """
+    Whether an error means the database could not be reached or went away,
+    as opposed to it rejecting a statement. The errors the error was raised
+    from are checked too, as run_logged raises an HTTPException for any
+    error of a query.
+    """
+    while error is not None:
+        if isinstance(error, CONNECTION_ERRORS):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+WHITESPACE = re.compile(r"\s+")
+
+
+# Compiles text statements into the positional ($1, $2, ...) form asyncpg expects
+POSITIONAL_DIALECT = postgresql.dialect(paramstyle="pyformat")
+
+
+class CompiledStatement:
+    """A named text statement compiled once into asyncpg's positional form."""
+
+    def __init__(self, name: str, sql: str):
+        compiled = text(sql).compile(dialect=POSITIONAL_DIALECT)
+        self.name = name
+        self.param_names = list(compiled.params.keys())
+        self.sql = compiled.string % {
+            param_name: f"${index}" for index, param_name in enumerate(self.param_names, start=1)
+        }
+
+    def args(self, values: dict[str, Any]) -> list[Any]:
+        """
+        :raises KeyError: If a bind parameter has no value.
+        """
+        try:
+            return [values[param_name] for param_name in self.param_names]
+        except KeyError as e:
+            raise KeyError(f"No value for bind parameter {e.args[0]!r} of statement {self.name!r}") from None
+
+
+class StatementRegistry:
+    """
+    Bounded registry of compiled statements keyed by their SQL text.
+
+    Statements built from optional filters have one entry per combination of
+    filters in use, each compiled the first time it is executed.
+    """
+
+    def __init__(self, maxsize: int):
+        self.statements: TTLCache[str, CompiledStatement] = TTLCache(maxsize=maxsize, ttl=float("inf"))
+
+    def register(self, name: str, sql: str) -> CompiledStatement:
+        statement = self.statements.get(sql)
+        if statement is None:
+            statement = CompiledStatement(name, sql)
+            self.statements.set(sql, statement)
+        return statement
+
+    def stats(self) -> dict[str, int | float]:
+        return self.statements.stats()
+
+
+class TransactionScope:
+    """
+    Transaction that joins the transaction already open in the current task
+    instead of nesting a savepoint into it. Joining fails if the scope asks
+    for other options, e.g. another isolation level, than the open one, or
+    if it writes within a read only scope.
+
+    Outside of a transaction, read only scopes either run their statements
+    in autocommit mode on a single connection, costing no extra round trips,
+    or open a READ ONLY transaction, on a replica when one is available.
+    Read only scopes with options, e.g. a repeatable read isolation level to
+    share one snapshot, always open a READ ONLY transaction.
+    Other scopes open a regular transaction on the primary.
+    Usable as a decorator or an async context manager.
+    """
+
+    def __init__(self, database: "DatabaseWrapper", readonly: bool, options: dict[str, Any]):
+        self.database = database
+        self.readonly = readonly
+        self.options = options
+        self.contexts: list[AbstractAsyncContextManager] = []
+
+    def join(self, scope: OpenScope):
+        """
+        :raises RuntimeError: If this scope cannot run within the open scope.
+        """
+        if scope.readonly and not self.readonly:
+            raise RuntimeError("Cannot open a writing transaction within a read only scope")
+        if self.options and self.options != scope.options:
+            raise RuntimeError(
+                f"Cannot join an open transaction with options {scope.options} using options {self.options}")
+
+    @asynccontextmanager
+    async def open(self) -> AsyncIterator[None]:
+        scope = self.database.open_scope()
+        if scope is not None:
+            self.join(scope)
+            yield
+        elif self.readonly:
+            async with self.database.read_scope(self.options):
+                yield
+        else:
+            # Later reads of the same request go to the primary to see this write
+            PRIMARY_PINNED.set(True)
+            replica_token = READ_REPLICA.set(None)
+            scope = OpenScope(False, self.options)
+            scope_token = OPEN_SCOPE.set(scope)
+            try:
+                async with Database.transaction(self.database, **self.options):
+                    yield
+            finally:
+                OPEN_SCOPE.reset(scope_token)
+                READ_REPLICA.reset(replica_token)
+            # Only reached once the transaction has committed
+            for callback in scope.after_commit:
+                await self.database.run_callback(callback)
+
+    def __call__(self, func: FunctionType) -> FunctionType:
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            async with self.open():
+                return await func(*args, **kwargs)
+        return wrapper  # type: ignore
+
+    async def __aenter__(self) -> None:
+        context = self.open()
+        await context.__aenter__()
+        self.contexts.append(context)
+
+    async def __aexit__(self, *exc_info) -> bool | None:
+        return await self.contexts.pop().__aexit__(*exc_info)
 
 
 class DatabaseWrapper(Database):
-    def __init__(self, database_url: str):
-        super().__init__(database_url)
+    def __init__(self,
+                 database_url: str,
+                 query_log_sample_rate: float = 0.0,
+                 slow_query_ms: float | None = None,
+                 statement_registry_size: int = 256,
+                 prepared_statement_cache_size: int = 256,
+                 autocommit_reads: bool = True,
+                 replica_urls: list[str] | None = None,
+                 replica_max_lag_seconds: float = 5.0,
+                 replica_lag_check_interval_seconds: float = 1.0):
+        """
+        :param database_url: The database connection url.
+        :param query_log_sample_rate: Share of queries to log, from 0 (off) to 1 (all).
+        :param slow_query_ms: Log every query taking at least this long, None to disable.
+        :param statement_registry_size: Number of compiled statements to keep.
+        :param prepared_statement_cache_size: Number of prepared statements asyncpg keeps per connection.
+        :param autocommit_reads: Run read only scopes without a transaction instead of READ ONLY transactions.
+        :param replica_urls: Connection urls of read replicas for read only scopes.
+        :param replica_max_lag_seconds: Replication lag above which a replica is not read from.
+        :param replica_lag_check_interval_seconds: Interval of replication lag checks.
+        """
+        super().__init__(database_url, statement_cache_size=prepared_statement_cache_size)
         self.database_url = database_url
+        self.query_log_sample_rate = query_log_sample_rate
+        self.slow_query_ms = slow_query_ms
+        self.statements = StatementRegistry(statement_registry_size)
+        self.autocommit_reads = autocommit_reads
+        self.replicas = ReplicaRouter(
+            replica_urls,
+            max_lag_seconds=replica_max_lag_seconds,
+            lag_check_interval_seconds=replica_lag_check_interval_seconds,
+            statement_cache_size=prepared_statement_cache_size,
+        ) if replica_urls else None
 
-    def print_query(self,
-                    query: ClauseElement | str | Compiled,
-                    values: list | dict | None = None,
-                    model: SQLModel | None = None):
-        if isinstance(query, ClauseElement):
-            query = query.compile(compile_kwargs={"literal_binds": True})
-            logger.info(f"{query}")
+    def connection(self) -> Connection:
+        replica = READ_REPLICA.get()
+        if replica is not None:
+            return replica.database.connection()
+        return super().connection()
+
+    def choose_replica(self) -> Replica | None:
+        """
+        Returns the replica the reads of the current task run on, or None for
+        the primary. The first read of a task, e.g. of a request, chooses a
+        replica and later reads stay on it, so they never see an older state
+        than an earlier read of the task. Once that replica lags too much the
+        task reads from the primary, which is never behind.
+        """
+        if self.replicas is None or PRIMARY_PINNED.get():
+            return None
+        replica = TASK_REPLICA.get()
+        if replica is None:
+            replica = self.replicas.choose()
+        elif not self.replicas.is_healthy(replica):
+            replica = None
+        if replica is None:
+            PRIMARY_PINNED.set(True)
         else:
-            logger.info(f"{query}")
-        if values is not None:
-            logger.info(f"parameters: {values}")
+            TASK_REPLICA.set(replica)
+        return replica
+
+    @asynccontextmanager
+    async def read_scope(self, options: dict[str, Any]) -> AsyncIterator[None]:
+        """
+        Routes the statements of a read only scope to the replica of the
+        current task, or to the primary if there are no replicas, all of them
+        lag too much or the current task has written to the primary, see
+        choose_replica.
+        :param options: Options of the READ ONLY transaction, which is opened
+            in autocommit mode too if there are any.
+        """
+        replica = self.choose_replica()
+        database = self if replica is None else replica.database
+
+        replica_token = READ_REPLICA.set(replica)
+        scope_token = OPEN_SCOPE.set(OpenScope(True, options))
+        if replica is not None:
+            replica.in_flight += 1
+        try:
+            if self.autocommit_reads and not options:
+                async with database.connection():
+                    yield
+            else:
+                async with Database.transaction(database, readonly=True, **options):
+                    yield
+        finally:
+            if replica is not None:
+                replica.in_flight -= 1
+            reset_context_var(OPEN_SCOPE, scope_token)
+            reset_context_var(READ_REPLICA, replica_token)
+
+    @staticmethod
+    def open_scope() -> OpenScope | None:
+        """
+        Returns the scope open in the current task. Tasks started within a
+        scope inherit the context variable but use their own connection, so
+        the scope is only returned to the task that opened it.
+        """
+        scope = OPEN_SCOPE.get()
+        if scope is None or scope.task is not asyncio.current_task():
+            return None
+        return scope
+
+    def in_transaction(self) -> bool:
+        """
+        Returns True if a transaction is open on the connection of the current task.
+        """
+        scope = self.open_scope()
+        return scope is not None and not (scope.readonly and self.autocommit_reads and not scope.options)
+
+    async def after_commit(self, callback: Callable[[], Awaitable[None]]):
+        """
+        Runs a callback once the transaction open in the current task has
+        committed, or right away outside of a transaction. The callbacks of
+        rolled back transactions are discarded. Failing callbacks are logged.
+        :param callback: The coroutine function to call.
+        """
+        scope = self.open_scope()
+        if scope is None or scope.readonly:
+            await self.run_callback(callback)
+        else:
+            scope.after_commit.append(callback)
+
+    @staticmethod
+    async def run_callback(callback: Callable[[], Awaitable[None]]):
+        try:
+            await callback()
+        except Exception as e:
+            transaction_logger.warning(f"After commit callback {callback!r} failed: {e}")
+
+    def transaction(self, *, readonly: bool = False, **kwargs: Any) -> TransactionScope:  # type: ignore[override]
+        """
+        Returns a transaction scope joining any transaction already open in the
+        current task, see TransactionScope.
+        :param readonly: Whether the scope only reads.
+        :param kwargs: Options passed to the transaction when one is opened.
+        """
+        return TransactionScope(self, readonly, kwargs)
+
+    @staticmethod
+    def normalize_query(query: ClauseElement | str) -> str:
+        """
+        Returns the statement with literals replaced by placeholders and
+        whitespace collapsed, so that executions of the same statement match.
+        """
+        statement = str(query.compile()) if isinstance(query, ClauseElement) else query
+        statement = STRING_LITERAL.sub("?", statement)
+        statement = NUMBER_LITERAL.sub("?", statement)
+        return WHITESPACE.sub(" ", statement).strip()
+
+    def log_query(self,
+                  query: ClauseElement | str,
+                  duration_ms: float,
+                  row_count: int | None,
+                  sampled: bool):
+        slow = self.slow_query_ms is not None and duration_ms >= self.slow_query_ms
+        level = WARNING if slow else INFO
+        if not (sampled or slow) or not logger.isEnabledFor(level):
+            return
+
+        # The statement is only compiled once a record is going to be emitted
+        statement = self.normalize_query(query)
+        record = {
+            "fingerprint": sha1(statement.encode()).hexdigest()[:16],
+            "duration_ms": round(duration_ms, 3),
+            "rows": row_count,
+            "slow": slow,
+            "statement": statement,
+        }
+        logger.log(level, "%s", json.dumps(record), extra={"query": record})
+
+    async def run_logged(self,
+                         operation: Callable[[], Awaitable[ResultType]],
+                         query: ClauseElement | str,
+                         row_count: Callable[[ResultType], int | None]) -> ResultType:
+        sampled = self.query_log_sample_rate > 0 and random() < self.query_log_sample_rate
+        start = perf_counter()
+        try:
+            result = await operation()
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        if sampled or self.slow_query_ms is not None:
+            self.log_query(query, (perf_counter() - start) * 1000, row_count(result), sampled)
+        return result
 
     async def connect(self):
         await super().connect()
+        if self.replicas is not None:
+            await self.replicas.connect()
 
     async def disconnect(self):
+        if self.replicas is not None:
+            await self.replicas.disconnect()
         await super().disconnect()
 
     async def fetch_all(self,
                         query: ClauseElement | str,
                         values: dict | None = None
                         ) -> list[Record]:
-        self.print_query(query, values)
-        try:
-            return await super().fetch_all(query, values)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+        return await self.run_logged(
+            lambda: super(DatabaseWrapper, self).fetch_all(query, values),
+            query,
+            len,
+        )
 
     async def fetch_one(self,
                         query: ClauseElement | str,
                         values: dict | None = None,
                         ) -> Record | None:
-        self.print_query(query, values)
-        try:
-            return await super().fetch_one(query, values)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+        return await self.run_logged(
+            lambda: super(DatabaseWrapper, self).fetch_one(query, values),
+            query,
+            lambda row: 0 if row is None else 1,
+        )
 
     async def execute(self,
                       query: ClauseElement | str,
                       values: dict | None = None):
-        self.print_query(query, values, None)
-        try:
-            return await super().execute(query, values)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+        return await self.run_logged(
+            lambda: super(DatabaseWrapper, self).execute(query, values),
+            query,
+            lambda _result: None,
+        )
 
     async def execute_many(self,
                            query: ClauseElement | str,
                            values: list) -> None:
-        self.print_query(query, values, None)
-        try:
-            return await super().execute_many(query, values)
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+        return await self.run_logged(
+            lambda: super(DatabaseWrapper, self).execute_many(query, values),
+            query,
+            lambda _result: len(values),
+        )
+
+    async def fetch_all_statement(self,
+                                  name: str,
+                                  sql: str,
+                                  values: dict[str, Any] | None = None) -> list[Record]:
+        """
+        Runs a registered statement directly on the asyncpg connection, skipping
+        the per call SQLAlchemy compilation. asyncpg prepares the statement once
+        per connection and reuses it from its statement cache.
+        :param name: The name of the statement, used for registration.
+        :param sql: The SQL text with :name bind parameters.
+        :param values: The values of the bind parameters.
+        :return: A list of records.
+        """
+        statement = self.statements.register(name, sql)
+        args = statement.args(values or {})
+
+        async def fetch():
+            async with self.connection() as connection:
+                return await connection.raw_connection.fetch(statement.sql, *args)
+
+        return await self.run_logged(fetch, statement.sql, len)
+
+    async def fetch_one_statement(self,
+                                  name: str,
+                                  sql: str,
+                                  values: dict[str, Any] | None = None) -> Record | None:
+        """
+        Runs a registered statement like fetch_all_statement and returns its first row.
+        """
+        statement = self.statements.register(name, sql)
+        args = statement.args(values or {})
+
+        async def fetch():
+            async with self.connection() as connection:
+                return await connection.raw_connection.fetchrow(statement.sql, *args)
+
+        return await self.run_logged(fetch, statement.sql, lambda row: 0 if row is None else 1)
+
+    async def iterate_statement(self,
+                                name: str,
+                                sql: str,
+                                values: dict[str, Any] | None = None,
+                                chunk_size: int = 1000) -> AsyncIterator[list[Record]]:
+        """
+        Runs a registered statement through a server side cursor and yields its
+        rows in chunks, so at most one chunk is held in memory at a time. The
+        statement runs in a read only scope, on a replica when one is
+        available, see read_scope. The cursor runs in the transaction open in
+        the current task, or else keeps a READ ONLY transaction open for as
+        long as the rows are consumed.
+        :param name: The name of the statement, used for registration.
+        :param sql: The SQL text with :name bind parameters.
+        :param values: The values of the bind parameters.
+        :param chunk_size: The number of rows fetched per round trip.
+        :return: An async iterator of lists of records.
+        """
+        statement = self.statements.register(name, sql)
+        args = statement.args(values or {})
+        async with self.transaction(readonly=True), self.connection() as connection:
+            raw_connection = connection.raw_connection
+            transaction = nullcontext() if self.in_transaction() else raw_connection.transaction(readonly=True)
+            async with transaction:
+                cursor = await raw_connection.cursor(statement.sql, *args)
+                while rows := await cursor.fetch(chunk_size):
+                    yield rows
 
     ModelType = TypeVar("ModelType", bound=BaseModel)
 
@@ -82,3 +524,37 @@ class DatabaseWrapper(Database):
     @staticmethod
     def map_to_models(rows: list[Record], model: Type[ModelType]) -> list[ModelType]:
         return [model(**row) for row in rows]  # type: ignore
+
+    @staticmethod
+    def construct_model(row: Record, model: Type[ModelType]) -> ModelType:
+        """
+        Maps a row to a model without validation. Only for rows that have a
+        column for every model field and whose values come from the database
+        as is. Other columns are ignored.
+        """
+        return DatabaseWrapper.construct_models([row], model)[0]
+
+    @staticmethod
+    def construct_models(rows: list[Record], model: Type[ModelType]) -> list[ModelType]:
+        """
+        Maps rows to models without validation, see construct_model.
+
+        The instances are set up like model_construct does, but without its
+        per field default and alias handling, which makes model_construct
+        slower than validating the row.
+        """
+        if model.__private_attributes__:
+            return [model.model_construct(**{name: row[name] for name in model.model_fields}) for row in rows]
+        names = tuple(model.model_fields)
+        fields_set = set(names)
+        new = object.__new__
+        set_attribute = object.__setattr__
+        models = []
+        for row in rows:
+            instance = new(model)
+            set_attribute(instance, "__dict__", {name: row[name] for name in names})
+            set_attribute(instance, "__pydantic_fields_set__", fields_set.copy())
+            set_attribute(instance, "__pydantic_extra__", None)
+            set_attribute(instance, "__pydantic_private__", None)
+            models.append(instance)
+        return models
@@ -0,0 +1,37 @@
+from hashlib import sha1
+from http import HTTPStatus
+from typing import Any
+
+from fastapi import Request, Response
+
+# Clients revalidate on every request and get 304 Not Modified while the
+# ETag still matches
+CACHE_CONTROL = "private, no-cache"
+
+
+def make_etag(*parts: Any) -> str:
+    """
+    Creates a strong ETag from the parts identifying a representation, e.g.
+    the resource, its version and the query parameters.
+    """
+    return '"' + sha1(repr(parts).encode()).hexdigest() + '"'
+
+
+def etag_headers(etag: str) -> dict[str, str]:
+    return {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """
+    Returns True if the If-None-Match header of the request matches the ETag.
+    """
+    header = request.headers.get("if-none-match")
+    if header is None:
+        return False
+    if header.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in header.split(","))
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=HTTPStatus.NOT_MODIFIED, headers=etag_headers(etag))
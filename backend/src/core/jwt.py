@@ -1,14 +1,25 @@
 from datetime import datetime, timedelta, UTC
+from hashlib import sha256
+from time import time
 from jose import ExpiredSignatureError, JWTError, jwt
 from starlette.authentication import AuthenticationError
 import os
 
+from core.cache import TTLCache
+
 # TODO: move constants to config/env
 
 SECRET_KEY = os.environ["SECRET_KEY"]
 ALGORITHM = os.environ["TOKEN_ENCRYPTION_ALGORITHM"]
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ["ACCESS_TOKEN_EXPIRE_MINUTES"])
 REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ["REFRESH_TOKEN_EXPIRE_DAYS"])
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", "10000"))
+
+# Claims of already verified tokens keyed by the SHA-256 digest of the token.
+# Entries expire together with their token.
+verified_token_cache: TTLCache[bytes, dict] = TTLCache(
+    maxsize=VERIFIED_TOKEN_CACHE_SIZE, ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60
+)
 
 
 jwtDecodeError = AuthenticationError("Invalid token")
@@ -38,6 +49,25 @@ def decode(token: str) -> dict:
         raise jwtDecodeError
 
 
+def decode_cached(token: str) -> dict:
+    """
+    Decodes a token like decode, returning the claims of tokens verified
+    before from the cache. Tokens without an expiration time are not cached.
+    """
+    key = sha256(token.encode()).digest()
+    payload = verified_token_cache.get(key)
+    if payload is not None:
+        return payload
+
+    payload = decode(token)
+    exp = payload.get("exp")
+    if isinstance(exp, (int, float)):
+        ttl = min(exp - time(), verified_token_cache.ttl)
+        if ttl > 0:
+            verified_token_cache.set(key, payload, ttl=ttl)
+    return payload
+
+
 @staticmethod
 def decode_expired(token: str) -> dict:
     try:
@@ -35,7 +35,7 @@ LOGGING_CONFIG = {
             "propagate": False,
         },
         "databases": {
-            "level": "DEBUG",
+            "level": "INFO",
             "handlers": ["default"],
             "propagate": False,
         },
@@ -0,0 +1,56 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+from http import HTTPStatus
+import binascii
+import json
+import os
+
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "1000"))
+
+Keyset = tuple[datetime, int]
+
+invalidCursorError = HTTPException(
+    status_code=HTTPStatus.BAD_REQUEST, detail="Invalid cursor")
+
+
+def encode_payload(payload: list) -> str:
+    return urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode()).decode().rstrip("=")
+
+
+def decode_payload(cursor: str) -> list:
+    """
+    :raises HTTPException: If the cursor is malformed.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(urlsafe_b64decode(padded))
+    except (binascii.Error, ValueError):
+        raise invalidCursorError
+    if not isinstance(payload, list):
+        raise invalidCursorError
+    return payload
+
+
+def encode_cursor(keyset: Keyset) -> str:
+    """
+    Encodes the (created, id) keyset of the last row of a page into an opaque cursor.
+    """
+    created, id = keyset
+    return encode_payload([created.isoformat(), id])
+
+
+def decode_cursor(cursor: str | None) -> Keyset | None:
+    """
+    Decodes a cursor created by encode_cursor.
+    :raises HTTPException: If the cursor is malformed.
+    """
+    if cursor is None:
+        return None
+    try:
+        created, id = decode_payload(cursor)
+        return datetime.fromisoformat(created), int(id)
+    except (ValueError, TypeError):
+        raise invalidCursorError
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from time import perf_counter
+from typing import Any, Callable, TypeVar
+import asyncio
+
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+ResultType = TypeVar("ResultType")
+
+passwordHasherBusyError = HTTPException(
+    status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+    detail="Too many concurrent authentication requests, please retry",
+    headers={"Retry-After": "1"},
+)
+
+
+class PasswordHasher:
+    """
+    Runs password hashing and verification in a thread pool so that bcrypt
+    does not block the event loop. At most max_workers operations run at a
+    time and at most max_queue_depth wait for a worker, further operations
+    are rejected with 503 Service Unavailable.
+    """
+
+    def __init__(self, context: CryptContext, max_workers: int, max_queue_depth: int):
+        self.context = context
+        self.max_workers = max_workers
+        self.max_queue_depth = max_queue_depth
+        self.pending = 0
+        self.operations = 0
+        self.rejections = 0
+        self.hash_seconds = 0.0
+        self.max_hash_seconds = 0.0
+        self.queue_wait_seconds = 0.0
+        self.max_queue_wait_seconds = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-hasher")
+
+    async def hash(self, password: str) -> str:
+        return await self.run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        return await self.run(self.context.verify, password, hashed_password)
+
+    async def run(self, function: Callable[..., ResultType], *args: Any) -> ResultType:
+        """
+        Runs a function in the thread pool and records its timings.
+        :raises HTTPException: If the queue of waiting operations is full.
+        """
+        if self.pending >= self.max_workers + self.max_queue_depth:
+            self.rejections += 1
+            raise passwordHasherBusyError
+
+        submitted = perf_counter()
+
+        def timed() -> tuple[ResultType, float, float]:
+            started = perf_counter()
+            result = function(*args)
+            return result, started, perf_counter()
+
+        self.pending += 1
+        try:
+            result, started, finished = await asyncio.get_running_loop().run_in_executor(self._executor, timed)
+        finally:
+            self.pending -= 1
+
+        queue_wait = started - submitted
+        duration = finished - started
+        self.operations += 1
+        self.queue_wait_seconds += queue_wait
+        self.max_queue_wait_seconds = max(self.max_queue_wait_seconds, queue_wait)
+        self.hash_seconds += duration
+        self.max_hash_seconds = max(self.max_hash_seconds, duration)
+        return result
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict[str, int | float]:
+        operations = self.operations or 1
+        return {
+            "operations": self.operations,
+            "rejections": self.rejections,
+            "pending": self.pending,
+            "mean_hash_ms": self.hash_seconds / operations * 1000,
+            "max_hash_ms": self.max_hash_seconds * 1000,
+            "mean_queue_wait_ms": self.queue_wait_seconds / operations * 1000,
+            "max_queue_wait_ms": self.max_queue_wait_seconds * 1000,
+        }
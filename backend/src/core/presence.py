@@ -0,0 +1,101 @@
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Hashable
+
+
+class PresenceStore:
+    """
+    Keeps the connected users and unsaved edit buffers of each todo list.
+
+    Users are counted per connection so a user stays present until their
+    last connection leaves. Edit buffers expire edit_ttl_seconds after their
+    last update and the least recently updated ones are evicted once their
+    descriptions take more than max_edit_chars characters in total.
+    """
+
+    def __init__(self, edit_ttl_seconds: float, max_edit_chars: int):
+        self.edit_ttl_seconds = edit_ttl_seconds
+        self.max_edit_chars = max_edit_chars
+        self.edit_chars = 0
+        self.evictions = 0
+        # todo_list_id -> user_id -> [user, connection count]
+        self.users: dict[Hashable, dict[int, list]] = {}
+        # (todo_list_id, todo_item_id) -> (expires, description), least recently updated first
+        self.edits: OrderedDict[tuple[Hashable, Any], tuple[float, str]] = OrderedDict()
+        # todo_list_id -> todo_item_ids with an edit buffer
+        self.list_edits: dict[Hashable, set] = {}
+
+    def join(self, todo_list_id: Hashable, user: dict[str, Any]):
+        present = self.users.setdefault(todo_list_id, {}).setdefault(user["id"], [user, 0])
+        present[1] += 1
+
+    def leave(self, todo_list_id: Hashable, user_id: int):
+        users = self.users.get(todo_list_id)
+        present = users.get(user_id) if users else None
+        if present is None:
+            return
+        present[1] -= 1
+        if present[1] <= 0:
+            del users[user_id]
+            if not users:
+                del self.users[todo_list_id]
+
+    def set_edit(self, todo_list_id: Hashable, todo_item_id: Any, description: str):
+        key = (todo_list_id, todo_item_id)
+        self._remove_edit(key)
+        self.edits[key] = (monotonic() + self.edit_ttl_seconds, description)
+        self.list_edits.setdefault(todo_list_id, set()).add(todo_item_id)
+        self.edit_chars += len(description)
+        self.expire()
+        while self.edit_chars > self.max_edit_chars and self.edits:
+            self._remove_edit(next(iter(self.edits)))
+            self.evictions += 1
+
+    def clear_edit(self, todo_list_id: Hashable, todo_item_id: Any):
+        self._remove_edit((todo_list_id, todo_item_id))
+
+    def expire(self):
+        """
+        Removes expired edit buffers, which are always the oldest ones.
+        """
+        now = monotonic()
+        while self.edits:
+            key, (expires, _) = next(iter(self.edits.items()))
+            if expires > now:
+                break
+            self._remove_edit(key)
+
+    def _remove_edit(self, key: tuple[Hashable, Any]):
+        entry = self.edits.pop(key, None)
+        if entry is None:
+            return
+        self.edit_chars -= len(entry[1])
+        todo_list_id, todo_item_id = key
+        items = self.list_edits[todo_list_id]
+        items.discard(todo_item_id)
+        if not items:
+            del self.list_edits[todo_list_id]
+
+    def snapshot(self, todo_list_id: Hashable) -> dict[str, Any]:
+        """
+        Returns the present users and edit buffers of a todo list.
+        """
+        self.expire()
+        return {
+            "users": {
+                user_id: user
+                for user_id, (user, _) in self.users.get(todo_list_id, {}).items()
+            },
+            "todo_item_edit_state": {
+                todo_item_id: {"description": self.edits[(todo_list_id, todo_item_id)][1]}
+                for todo_item_id in self.list_edits.get(todo_list_id, ())
+            },
+        }
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "lists": len(self.users),
+            "edit_buffers": len(self.edits),
+            "edit_chars": self.edit_chars,
+            "edit_evictions": self.evictions,
+        }
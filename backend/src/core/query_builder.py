@@ -0,0 +1,61 @@
+from typing import Any
+
+from sqlalchemy import TextClause, text
+
+
+class WhereClause:
+    """
+    Builds a WHERE clause out of the predicates that are actually used.
+
+    Catch-all predicates such as (col = :x OR :x IS NULL) keep Postgres from
+    using indexes, so optional filters are only added when a value is given.
+    """
+
+    def __init__(self):
+        self.predicates: list[str] = []
+        self.params: dict[str, Any] = {}
+
+    def add(self, predicate: str, **params: Any) -> "WhereClause":
+        """
+        Adds a predicate and the values of its bind parameters.
+        :param predicate: SQL predicate using :name bind parameters.
+        :param params: Values of the bind parameters.
+        :return: The where clause for chaining.
+        """
+        self.predicates.append(predicate)
+        self.params.update(params)
+        return self
+
+    def equals(self, column: str, name: str, value: Any | None) -> "WhereClause":
+        """
+        Adds a `column = :name` predicate if the value is not None.
+        :param column: The column to compare.
+        :param name: The name of the bind parameter.
+        :param value: The value to compare to.
+        :return: The where clause for chaining.
+        """
+        if value is not None:
+            self.add(f"{column} = :{name}", **{name: value})
+        return self
+
+    def __str__(self) -> str:
+        if not self.predicates:
+            return ""
+        return "WHERE " + "\n      AND ".join(self.predicates)
+
+    def values(self, **params: Any) -> dict[str, Any]:
+        """
+        Returns the parameters of the where clause merged with additional ones.
+        :param params: Additional bind parameters used outside the where clause.
+        :return: The bind parameter values of the statement.
+        """
+        return {**self.params, **params}
+
+    def bind(self, sql: str, **params: Any) -> TextClause:
+        """
+        Creates a text query bound to the parameters of the where clause.
+        :param sql: The complete SQL statement.
+        :param params: Additional bind parameters used outside the where clause.
+        :return: The bound text query.
+        """
+        return text(sql).bindparams(**self.values(**params))
@@ -0,0 +1,111 @@
+from logging import getLogger
+from typing import Any
+import asyncio
+
+from databases import Database
+
+logger = getLogger("app.db.replicas")
+
+# NULL while no WAL receiver streams from the primary, as a caught up
+# replica looks the same as a disconnected one otherwise. Zero when the
+# replica has replayed everything it has received, otherwise the age of the
+# last replayed transaction. Roles without pg_read_all_stats only see the
+# pid of the WAL receiver, so its status is only checked when visible.
+REPLICATION_LAG_SQL = """
+SELECT CASE
+    WHEN NOT EXISTS (
+        SELECT 1
+        FROM pg_stat_wal_receiver
+        WHERE pid IS NOT NULL AND COALESCE(status, 'streaming') = 'streaming'
+    ) THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class Replica:
+    def __init__(self, database_url: str, **options: Any):
+        self.database = Database(database_url, **options)
+        # Unknown lag keeps the replica out of rotation until it is checked
+        self.lag_seconds = float("inf")
+        self.in_flight = 0
+
+
+class ReplicaRouter:
+    """
+    Chooses read replicas for read only scopes. Replicas lagging behind the
+    primary by more than max_lag_seconds, or failing the lag check, are
+    skipped. Among the rest the least busy one is chosen, rotating between
+    equally busy replicas.
+    """
+
+    def __init__(self,
+                 database_urls: list[str],
+                 max_lag_seconds: float,
+                 lag_check_interval_seconds: float,
+                 **options: Any):
+        self.replicas = [Replica(database_url, **options) for database_url in database_urls]
+        self.max_lag_seconds = max_lag_seconds
+        self.lag_check_interval_seconds = lag_check_interval_seconds
+        self.primary_fallbacks = 0
+        self._next = 0
+        self._lag_monitor: asyncio.Task | None = None
+
+    async def connect(self):
+        for replica in self.replicas:
+            await replica.database.connect()
+        await self.check_lag()
+        self._lag_monitor = asyncio.create_task(self.monitor_lag())
+
+    async def disconnect(self):
+        if self._lag_monitor is not None:
+            self._lag_monitor.cancel()
+            self._lag_monitor = None
+        for replica in self.replicas:
+            await replica.database.disconnect()
+
+    async def check_lag(self):
+        for replica in self.replicas:
+            try:
+                lag = await replica.database.fetch_val(REPLICATION_LAG_SQL)
+                if lag is None:
+                    logger.warning(f"Replica {replica.database.url!r} is not streaming from the primary")
+                replica.lag_seconds = float("inf") if lag is None else float(lag)
+            except Exception as e:
+                logger.warning(f"Replication lag check failed for {replica.database.url!r}: {e}")
+                replica.lag_seconds = float("inf")
+
+    async def monitor_lag(self):
+        while True:
+            await asyncio.sleep(self.lag_check_interval_seconds)
+            await self.check_lag()
+
+    def is_healthy(self, replica: Replica) -> bool:
+        return replica.lag_seconds <= self.max_lag_seconds
+
+    def choose(self) -> Replica | None:
+        """
+        Returns the replica to read from or None to read from the primary.
+        """
+        healthy = [replica for replica in self.replicas if self.is_healthy(replica)]
+        if not healthy:
+            self.primary_fallbacks += 1
+            return None
+        start = self._next % len(healthy)
+        self._next += 1
+        rotated = healthy[start:] + healthy[:start]
+        return min(rotated, key=lambda replica: replica.in_flight)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "primary_fallbacks": self.primary_fallbacks,
+            "replicas": [
+                {
+                    "url": repr(replica.database.url),
+                    "lag_seconds": replica.lag_seconds,
+                    "in_flight": replica.in_flight,
+                }
+                for replica in self.replicas
+            ],
+        }
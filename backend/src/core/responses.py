@@ -0,0 +1,39 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse as FastAPIORJSONResponse
+from pydantic import BaseModel
+
+# UTC datetimes are written with a Z suffix like pydantic does, keeping the
+# output byte-compatible with FastAPI's default JSON responses
+ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+
+
+class ORJSONResponse(FastAPIORJSONResponse):
+    """
+    Default response class of the app, serializing with orjson. Dates and
+    datetimes are handled natively by orjson.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=ORJSON_OPTIONS)
+
+
+def serialize_model(obj: Any) -> dict[str, Any]:
+    if isinstance(obj, BaseModel):
+        return obj.__dict__
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class TrustedJSONResponse(ORJSONResponse):
+    """
+    JSON response for DTOs built from trusted data, e.g. with model_construct.
+
+    The models are written by orjson from their field values, skipping both
+    the validation and the jsonable_encoder pass FastAPI otherwise runs on
+    the return value. The output matches FastAPI's default serialization of
+    the same models.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=serialize_model, option=ORJSON_OPTIONS)
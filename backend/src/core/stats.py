@@ -0,0 +1,20 @@
+from logging import getLogger
+from typing import Any, Callable
+import asyncio
+import json
+
+logger = getLogger("app.stats")
+
+
+async def log_stats_periodically(sources: dict[str, Callable[[], dict[str, Any]]], interval_seconds: float):
+    """
+    Logs the stats of each source every interval_seconds, one JSON record
+    per source.
+    :param sources: Functions returning the stats of a source by its name.
+    :param interval_seconds: The time between two logs.
+    """
+    while True:
+        await asyncio.sleep(interval_seconds)
+        for name, stats in sources.items():
+            record = {"source": name, **stats()}
+            logger.info("%s", json.dumps(record), extra={"stats": record})
@@ -1,24 +1,136 @@
-from fastapi import WebSocket
+from typing import Hashable
+import asyncio
+
+from fastapi import WebSocket, status
+
+from core.broadcast import BroadcastBus
+
+# Close code sent to clients that cannot keep up with their messages
+SLOW_CONSUMER_CLOSE_CODE = status.WS_1013_TRY_AGAIN_LATER
+
+
+class Connection:
+    """
+    A websocket with a bounded outbound queue drained by its own writer task,
+    so a slow client only delays its own messages.
+    """
+
+    def __init__(self, websocket: WebSocket, room: Hashable, queue_size: int):
+        self.websocket = websocket
+        self.room = room
+        self.queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self.writer = asyncio.create_task(self.write())
+
+    def send(self, message: str) -> bool:
+        """
+        Queues a message for the writer task.
+        :return: False if the queue is full.
+        """
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def write(self):
+        try:
+            while True:
+                message = await self.queue.get()
+                await self.websocket.send_text(message)
+        except Exception:
+            # The socket is gone, the reading side handles the disconnect
+            pass
 
 
 class ConnectionManager:
-    data = {}
+    """
+    Groups websockets into rooms, e.g. one per todo list. Messages are queued
+    per connection and connections whose queue overflows are closed with
+    SLOW_CONSUMER_CLOSE_CODE. Broadcasts are shared with other workers
+    through the broadcast bus.
+    """
 
-    def __init__(self):
-        self.active_connections: list[WebSocket] = []
+    def __init__(self, send_queue_size: int = 256, bus: BroadcastBus | None = None):
+        self.send_queue_size = send_queue_size
+        self.bus = bus or BroadcastBus()
+        self.rooms: dict[Hashable, dict[WebSocket, Connection]] = {}
+        self.connections: dict[WebSocket, Connection] = {}
+        self.dropped_connections = 0
+        self._closing: set[asyncio.Task] = set()
 
-    async def connect(self, websocket: WebSocket):
+    async def start(self):
+        await self.bus.connect(self.deliver)
+
+    async def stop(self):
+        await self.bus.disconnect()
+
+    async def connect(self, websocket: WebSocket, room: Hashable = None):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        connection = Connection(websocket, room, self.send_queue_size)
+        self.connections[websocket] = connection
+        self.rooms.setdefault(room, {})[websocket] = connection
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        connection = self.connections.pop(websocket, None)
+        if connection is None:
+            return
+        connection.writer.cancel()
+        room = self.rooms[connection.room]
+        del room[websocket]
+        if not room:
+            del self.rooms[connection.room]
+
+    def drop(self, connection: Connection):
+        """
+        Disconnects a slow consumer and closes its socket in the background.
+        """
+        self.disconnect(connection.websocket)
+        self.dropped_connections += 1
+        task = asyncio.create_task(self._close(connection.websocket))
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def _close(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
 
     async def send_personal_message(self, message: str, websocket: WebSocket):
-        await websocket.send_text(message)
+        connection = self.connections.get(websocket)
+        if connection is not None and not connection.send(message):
+            self.drop(connection)
+
+    async def broadcast(self, message: str, websocket: WebSocket | None, room: Hashable = None):
+        """
+        Queues a message for every connection in a room except the sender
+        and publishes it to the other workers.
+        :param message: The message to send.
+        :param websocket: The sender, or None to send to everyone.
+        :param room: The room to send to.
+        """
+        self.fan_out(message, websocket, room)
+        await self.bus.publish(room, message)
+
+    async def deliver(self, room: Hashable, message: str):
+        """
+        Queues a message published by another worker for the connections of a room.
+        """
+        self.fan_out(message, None, room)
+
+    def fan_out(self, message: str, websocket: WebSocket | None, room: Hashable):
+        slow = [
+            connection
+            for other, connection in self.rooms.get(room, {}).items()
+            if other != websocket and not connection.send(message)
+        ]
+        for connection in slow:
+            self.drop(connection)
 
-    async def broadcast(self, message: str, websocket: WebSocket):
-        for connection in self.active_connections:
-            print(f'connection {connection}')
-            if connection != websocket:
-                await connection.send_text(message)
+    def stats(self) -> dict[str, int]:
+        return {
+            "rooms": len(self.rooms),
+            "connections": len(self.connections),
+            "dropped_connections": self.dropped_connections,
+            **getattr(self.bus, "stats", dict)(),
+        }
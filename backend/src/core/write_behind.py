@@ -0,0 +1,237 @@
+from logging import getLogger
+from typing import Any, Awaitable, Callable, Hashable, Iterable
+import asyncio
+
+logger = getLogger("app.write_behind")
+
+# group -> key -> values
+Pending = dict[Hashable, dict[Hashable, dict[str, Any]]]
+
+# A write that failed on its own: group, key, values and the error
+Failure = tuple[Hashable, Hashable, dict[str, Any], Exception]
+
+# The group and key of each write a flush did not apply, e.g. to a row that no longer exists
+Skipped = Iterable[tuple[Hashable, Hashable]]
+
+# Called with the group, key, values and sources of a dropped write and the last error
+OnDrop = Callable[[Hashable, Hashable, dict[str, Any], set[Hashable], Exception], Awaitable[None]]
+
+
+def is_os_error(error: Exception) -> bool:
+    return isinstance(error, (OSError, TimeoutError))
+
+
+class WriteBehindBuffer:
+    """
+    Collects writes per group, e.g. per todo list, and persists them in
+    batches. Writes to the same key are merged, later values winning. The
+    buffer is flushed every interval_seconds and as soon as max_pending keys
+    are waiting.
+
+    When a batch fails, its groups and then the keys of the failing groups
+    are written separately, so a write the database rejects, e.g. invalid
+    data, does not hold back the others. Writes failing on their own are
+    retried with the next flush and dropped after max_attempts, reporting
+    them to on_drop with the sources that added them. Writes failing with
+    an error is_unavailable accepts, e.g. because the database is down, are
+    kept for the next flush without counting an attempt. The flush may
+    return the writes it skipped, which are dropped right away.
+    """
+
+    def __init__(self,
+                 flush: Callable[[Pending], Awaitable[Skipped | None]],
+                 interval_seconds: float,
+                 max_pending: int,
+                 max_attempts: int = 3,
+                 on_drop: OnDrop | None = None,
+                 is_unavailable: Callable[[Exception], bool] = is_os_error):
+        self._flush = flush
+        self.interval_seconds = interval_seconds
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.on_drop = on_drop
+        self.is_unavailable = is_unavailable
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.written = 0
+        self.merged = 0
+        self.dropped = 0
+        self._pending: Pending = {}
+        self._pending_count = 0
+        self._sources: dict[tuple[Hashable, Hashable], set[Hashable]] = {}
+        self._attempts: dict[tuple[Hashable, Hashable], int] = {}
+        self._lock = asyncio.Lock()
+        self._flusher: asyncio.Task | None = None
+        self._size_flush: asyncio.Task | None = None
+
+    def start(self):
+        self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        """
+        Stops flushing periodically and drains the buffer.
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        for _ in range(3):
+            await self.flush()
+            if not self._pending_count:
+                return
+            await asyncio.sleep(1)
+        if self._pending_count:
+            logger.error(f"{self._pending_count} buffered writes could not be persisted on shutdown")
+
+    def add(self, group: Hashable, key: Hashable, values: dict[str, Any], source: Hashable | None = None):
+        """
+        :param source: Optional sender of the write, e.g. a websocket, told
+            through on_drop if the write is dropped.
+        """
+        writes = self._pending.setdefault(group, {})
+        if key in writes:
+            writes[key].update(values)
+            self.merged += 1
+        else:
+            writes[key] = dict(values)
+            self._pending_count += 1
+        if source is not None:
+            self._sources.setdefault((group, key), set()).add(source)
+        if self._pending_count >= self.max_pending and (self._size_flush is None or self._size_flush.done()):
+            self._size_flush = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            count, self._pending_count = self._pending_count, 0
+            sources, self._sources = self._sources, {}
+
+            failures, skipped, written = await self._write(batch)
+            if not written and all(self.is_unavailable(error) for *_, error in failures):
+                logger.warning(f"Flushing {count} buffered writes failed, retrying later: {failures[0][3]}")
+                self._restore(batch, sources)
+                return
+
+            failed_keys = set()
+            for group, key in skipped:
+                values = batch.get(group, {}).get(key)
+                if values is None or (group, key) in failed_keys:
+                    continue
+                failed_keys.add((group, key))
+                await self._drop(group, key, values, sources.get((group, key), set()),
+                                 LookupError(f"Write {key!r} of {group!r} was not applied"))
+            for group, key, values, error in failures:
+                failed_keys.add((group, key))
+                if self.is_unavailable(error):
+                    logger.warning(f"Buffered write {key!r} of {group!r} failed, retrying later: {error}")
+                    self._restore({group: {key: values}}, sources)
+                    continue
+                attempts = self._attempts.get((group, key), 0) + 1
+                if attempts < self.max_attempts:
+                    logger.warning(f"Buffered write {key!r} of {group!r} failed, retrying later: {error}")
+                    self._attempts[(group, key)] = attempts
+                    self._restore({group: {key: values}}, sources)
+                else:
+                    await self._drop(group, key, values, sources.get((group, key), set()), error)
+            self.written += count - len(failed_keys)
+            for group, writes in batch.items():
+                for key in writes:
+                    if (group, key) not in failed_keys:
+                        self._attempts.pop((group, key), None)
+
+    async def _write(self, batch: Pending) -> tuple[list[Failure], list[tuple[Hashable, Hashable]], bool]:
+        """
+        Writes a batch, and if it fails its groups and the keys of failing
+        groups separately.
+        :return: The writes that failed on their own, the writes the flushes
+            skipped, and whether any write succeeded.
+        """
+        skipped: list[tuple[Hashable, Hashable]] = []
+        error = await self._try_flush(batch, skipped)
+        if error is None:
+            return [], skipped, True
+        if self.is_unavailable(error):
+            return [(group, key, values, error) for group, writes in batch.items()
+                    for key, values in writes.items()], skipped, False
+
+        written = False
+        failed_groups: list[tuple[Hashable, dict[Hashable, dict[str, Any]], Exception]] = []
+        if len(batch) > 1:
+            for group, writes in batch.items():
+                group_error = await self._try_flush({group: writes}, skipped)
+                if group_error is None:
+                    written = True
+                else:
+                    failed_groups.append((group, writes, group_error))
+            if not written:
+                return [(group, key, values, error) for group, writes, error in failed_groups
+                        for key, values in writes.items()], skipped, False
+        else:
+            (group, writes), = batch.items()
+            failed_groups.append((group, writes, error))
+
+        failures = []
+        for group, writes, group_error in failed_groups:
+            if len(writes) == 1:
+                (key, values), = writes.items()
+                failures.append((group, key, values, group_error))
+                continue
+            for key, values in writes.items():
+                key_error = await self._try_flush({group: {key: values}}, skipped)
+                if key_error is None:
+                    written = True
+                else:
+                    failures.append((group, key, values, key_error))
+        return failures, skipped, written
+
+    async def _try_flush(self, batch: Pending, skipped: list[tuple[Hashable, Hashable]]) -> Exception | None:
+        """
+        Flushes a batch, adding the writes the flush skipped to skipped.
+        :return: The error of the flush, or None if it succeeded.
+        """
+        try:
+            skipped.extend(await self._flush(batch) or ())
+            self.flushes += 1
+            return None
+        except Exception as e:
+            self.failed_flushes += 1
+            return e
+
+    async def _drop(self, group: Hashable, key: Hashable, values: dict[str, Any], sources: set[Hashable], error: Exception):
+        self.dropped += 1
+        self._attempts.pop((group, key), None)
+        logger.error(f"Dropping buffered write {key!r} of {group!r}: {error}")
+        if self.on_drop is None:
+            return
+        try:
+            await self.on_drop(group, key, values, sources, error)
+        except Exception as e:
+            logger.warning(f"Reporting the dropped write {key!r} of {group!r} failed: {e}")
+
+    def _restore(self, batch: Pending, sources: dict[tuple[Hashable, Hashable], set[Hashable]]):
+        for group, writes in batch.items():
+            pending = self._pending.setdefault(group, {})
+            for key, values in writes.items():
+                if key in pending:
+                    pending[key] = {**values, **pending[key]}
+                else:
+                    pending[key] = values
+                    self._pending_count += 1
+                if (group, key) in sources:
+                    self._sources.setdefault((group, key), set()).update(sources[(group, key)])
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            await self.flush()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "pending": self._pending_count,
+            "written": self.written,
+            "merged": self.merged,
+            "dropped": self.dropped,
+            "flushes": self.flushes,
+            "failed_flushes": self.failed_flushes,
+        }
@@ -1,5 +1,8 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import Literal, Optional
+import os
+
+MAX_BATCH_OPERATIONS = int(os.getenv("MAX_BATCH_OPERATIONS", "1000"))
 
 
 class CreateTodoItemRequest(BaseModel):
@@ -13,6 +16,23 @@ class UpdateTodoItemRequest(BaseModel):
     due_date: Optional[str] = None
 
 
+class TodoItemOperation(BaseModel):
+    """
+    Operation of a todo item batch. create uses description and due_date,
+    update the fields that are set, complete sets completed (true by
+    default) and delete only the id.
+    """
+    op: Literal["create", "update", "complete", "delete"]
+    id: Optional[int] = None
+    description: Optional[str] = None
+    due_date: Optional[str] = None
+    completed: Optional[bool] = None
+
+
+class BatchTodoItemsRequest(BaseModel):
+    operations: list[TodoItemOperation] = Field(min_length=1, max_length=MAX_BATCH_OPERATIONS)
+
+
 class CreateTodoListRequest(BaseModel):
     name: str
     description: Optional[str] = None
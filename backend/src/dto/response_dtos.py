@@ -1,5 +1,8 @@
+from typing import Callable, Generic, TypeVar
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime
+
+from core.pagination import Keyset, encode_cursor
 
 from model.todo_list_role import TodoListRole
 from model.user import User
@@ -33,6 +36,11 @@ class TodoListMemberDto(BaseModel):
         return TodoListMemberDto(user=user, role=role)
 
 
+class TodoListMembersUpdateDto(BaseModel):
+    added_user_ids: list[int]
+    updated_user_ids: list[int]
+
+
 class TodoListDto(BaseModel):
     id: int
     name: str
@@ -44,12 +52,73 @@ class TodoListDto(BaseModel):
 
     @staticmethod
     def from_raw(id: int, name: str, description: str | None, author_id: int, author_username: str, role: Role, created: datetime, updated: datetime):
-        return TodoListDto(
+        # Constructed without validation as the values come straight from the database
+        return TodoListDto.model_construct(
             id=id,
             name=name,
             description=description,
-            author=UserDto(id=author_id, username=author_username),
+            author=UserDto.model_construct(id=author_id, username=author_username),
             role=role,
             created=created,
             updated=updated
         )
+
+
+class TodoItemDto(BaseModel):
+    id: int
+    author_id: int
+    todo_list_id: int
+    description: str
+    due_date: date | None = None
+    completed: bool = False
+    created: datetime
+    updated: datetime
+
+
+class TodoItemChangesDto(BaseModel):
+    items: list[TodoItemDto]
+    deleted_ids: list[int]
+    next_cursor: str
+    next_page: str | None = None
+
+
+class TodoItemOperationResultDto(BaseModel):
+    op: str
+    status: int
+    id: int | None = None
+    item: TodoItemDto | None = None
+    detail: str | None = None
+
+
+class BatchTodoItemsResultDto(BaseModel):
+    results: list[TodoItemOperationResultDto]
+
+
+class TodoItemImportErrorDto(BaseModel):
+    line: int
+    detail: str
+
+
+class TodoItemImportResultDto(BaseModel):
+    imported: int
+    failed: int
+    errors: list[TodoItemImportErrorDto]
+
+
+ItemType = TypeVar("ItemType")
+
+
+class PageDto(BaseModel, Generic[ItemType]):
+    items: list[ItemType]
+    next_cursor: str | None
+
+    @staticmethod
+    def from_items(items: list[ItemType], limit: int, keyset: Callable[[ItemType], Keyset]) -> "PageDto[ItemType]":
+        """
+        Creates a page from items fetched with a limit of one over the page size,
+        the extra item only signalling that a next page exists.
+        """
+        if len(items) <= limit:
+            return PageDto.model_construct(items=items, next_cursor=None)
+        items = items[:limit]
+        return PageDto.model_construct(items=items, next_cursor=encode_cursor(keyset(items[-1])))
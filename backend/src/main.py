@@ -4,29 +4,72 @@ from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from starlette.middleware.cors import CORSMiddleware
 from starlette.middleware.authentication import AuthenticationMiddleware
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
+import asyncio
+import os
 
 from core.database import database
 from core.middleware.authentication import AuthBackend
+from core.responses import ORJSONResponse
+from core.stats import log_stats_periodically
+from service.authentication_service import password_hasher
+from service.todo_item_service import prune_todo_item_tombstones_periodically
+from service.todo_list_service import (
+    receive_todo_list_role_invalidation,
+    role_invalidation_bus,
+    todo_list_role_cache,
+)
 
 from controller.user_controller import user_router
 from controller.todo_list_controller import todo_list_router
 from controller.todo_item_controller import todo_item_router
-from controller.ws_controller import ws_router
+from controller.ws_controller import manager as ws_manager, todo_item_write_buffer, ws_router
+
+# Cache stats are logged every STATS_LOG_INTERVAL_SECONDS, 0 disables them
+STATS_LOG_INTERVAL_SECONDS = float(os.getenv("STATS_LOG_INTERVAL_SECONDS", "60"))
+
+auth_backend = AuthBackend()
 
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
     await database.connect()
+    await role_invalidation_bus.connect(receive_todo_list_role_invalidation)
+    await ws_manager.start()
+    todo_item_write_buffer.start()
+    tombstone_pruner = asyncio.create_task(prune_todo_item_tombstones_periodically())
+    stats_logger = None
+    if STATS_LOG_INTERVAL_SECONDS > 0:
+        stats_logger = asyncio.create_task(log_stats_periodically(
+            {
+                "todo_list_role_cache": todo_list_role_cache.stats,
+                "authentication": auth_backend.stats,
+                "password_hasher": password_hasher.stats,
+            },
+            STATS_LOG_INTERVAL_SECONDS,
+        ))
     yield
+    if stats_logger is not None:
+        stats_logger.cancel()
+        with suppress(asyncio.CancelledError):
+            await stats_logger
+    tombstone_pruner.cancel()
+    # Waits for a running prune to finish before the database closes
+    with suppress(asyncio.CancelledError):
+        await tombstone_pruner
+    # Persist buffered writes while the database and the broadcast bus are up
+    await todo_item_write_buffer.stop()
+    await ws_manager.stop()
+    await role_invalidation_bus.disconnect()
     await database.disconnect()
+    password_hasher.shutdown()
 
 
 def on_auth_error(_connection: HTTPConnection, exception: Exception):
     return JSONResponse(content={"detail": str(exception)}, status_code=status.HTTP_401_UNAUTHORIZED)
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 app.include_router(user_router, prefix="/api/users", tags=["users"])
 app.include_router(
     todo_list_router, prefix="/api/todo-lists", tags=["todo-lists"])
@@ -35,7 +78,7 @@ app.include_router(
 app.include_router(ws_router, prefix="/ws", tags=["websockets"])
 
 app.add_middleware(AuthenticationMiddleware,
-                   backend=AuthBackend(), on_error=on_auth_error)
+                   backend=auth_backend, on_error=on_auth_error)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=['http://localhost', 'http://localhost:4321'],  # TODO: swithc through env
@@ -1,4 +1,5 @@
 from http import HTTPStatus
+import os
 
 from fastapi import HTTPException
 from passlib.context import CryptContext
@@ -7,6 +8,7 @@ from starlette.authentication import AuthenticationError
 
 from core import jwt
 from core.database import database
+from core.password_hasher import PasswordHasher
 from service import user_service
 
 
@@ -17,17 +19,25 @@ class AuthData(BaseModel):
     refreshToken: str
 
 
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+PASSWORD_HASH_QUEUE_DEPTH = int(os.getenv("PASSWORD_HASH_QUEUE_DEPTH", "32"))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+password_hasher = PasswordHasher(
+    pwd_context, max_workers=PASSWORD_HASH_WORKERS, max_queue_depth=PASSWORD_HASH_QUEUE_DEPTH)
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await password_hasher.verify(plain_password, hashed_password)
 
 
-@database.transaction()
 async def register(username: str, password: str) -> AuthData:
-    password = pwd_context.hash(password)
+    # Hash before opening the transaction to not hold a connection meanwhile
+    return await create_registered_user(username, await password_hasher.hash(password))
 
+
+@database.transaction()
+async def create_registered_user(username: str, password: str) -> AuthData:
     created_user = await user_service.create_user(
         username=username,
         password=password
@@ -44,7 +54,7 @@ async def register(username: str, password: str) -> AuthData:
 async def login(username: str, password: str) -> AuthData:
     user = await user_service.find_user(username=username)
 
-    if not user or not verify_password(password, user.password):
+    if not user or not await verify_password(password, user.password):
         raise HTTPException(status_code=HTTPStatus.UNAUTHORIZED,
                             detail="Incorrect username or password")
 
@@ -1,47 +1,99 @@
+from http import HTTPStatus
+from databases.interfaces import Record
 from fastapi import HTTPException
-from typing import List
-from sqlalchemy import select, text, update
-from dto.request_dtos import UpdateTodoItemRequest
+from logging import getLogger
+from typing import AsyncIterator, List, Literal
+import asyncio
+from contextlib import aclosing, suppress
+import csv
+import io
+import os
+
+import orjson
+from sqlalchemy import ARRAY, Boolean, Date, Integer, String, bindparam, text, update
+from dto.request_dtos import TodoItemOperation, UpdateTodoItemRequest
+from dto.response_dtos import (
+    PageDto,
+    TodoItemChangesDto,
+    TodoItemDto,
+    TodoItemImportErrorDto,
+    TodoItemImportResultDto,
+    TodoItemOperationResultDto,
+)
 from model import todo_list
+from model.role import Role
 from model.todo_item import TodoItem
 from core.database import database
-from datetime import date
+from core.pagination import DEFAULT_PAGE_SIZE, Keyset, decode_cursor, decode_payload, encode_payload, invalidCursorError
+from core.query_builder import WhereClause
+from core.responses import ORJSON_OPTIONS
+from datetime import date, datetime, timedelta
+from service.todo_list_service import todo_list_role_cache
 
+logger = getLogger("app.todo_items")
 
-@database.transaction()
+
+@database.transaction(readonly=True)
 async def find_todo_items(
     id: int | None = None,
     todo_list_id: int | None = None,
     author_id: int | None = None,
     user_id: int | None = None,
     completed: bool | None = None,
+    after: Keyset | None = None,
     limit: int | None = None,
-) -> List[TodoItem]:
-    sql = """
+) -> List[TodoItemDto]:
+    where = (
+        WhereClause()
+        .equals("ti.id", "id", id)
+        .equals("ti.author_id", "author_id", author_id)
+        .equals("ti.todo_list_id", "todo_list_id", todo_list_id)
+        .equals("ti.completed", "completed", completed)
+    )
+    if user_id is not None:
+        where.add(
+            "(tl.author_id = :user_id OR EXISTS ("
+            "SELECT 1 FROM todo_list_member tlm"
+            " WHERE tlm.todo_list_id = tl.id AND tlm.user_id = :user_id))",
+            user_id=user_id,
+        )
+    if after is not None:
+        where.add(
+            "(ti.created, ti.id) > (:after_created, :after_id)",
+            after_created=after[0],
+            after_id=after[1],
+        )
+
+    sql = f"""
     SELECT ti.*
     FROM todo_item ti
     JOIN todo_list tl ON ti.todo_list_id = tl.id
-    LEFT JOIN todo_list_member tlm ON tl.id = tlm.todo_list_id
-    WHERE (ti.id = :id OR :id IS NULL)
-      AND (tlm.user_id = :user_id OR tl.author_id = :user_id OR :user_id IS NULL)
-      AND (ti.author_id = :author_id OR :author_id IS NULL)
-      AND (ti.todo_list_id = :todo_list_id OR :todo_list_id IS NULL)
-      AND (ti.completed = :completed OR :completed IS NULL)
+    {where}
+    ORDER BY ti.created, ti.id
     """
+    params = {}
     if limit is not None:
-        sql = sql + "\nLIMIT :limit\n"
+        sql = sql + "LIMIT :limit\n"
+        params.update(limit=limit)
 
-    query = text(sql).bindparams(
-        id=id,
+    rows = await database.fetch_all_statement(
+        "find_todo_items", sql, where.values(**params)
+    )
+    return database.construct_models(rows, TodoItemDto)
+
+
+async def find_todo_items_page(
+    todo_list_id: int, user_id: int, cursor: str | None, limit: int
+) -> PageDto[TodoItemDto]:
+    todo_items = await find_todo_items(
         todo_list_id=todo_list_id,
-        author_id=author_id,
         user_id=user_id,
-        completed=completed,
+        after=decode_cursor(cursor),
+        limit=limit + 1,
+    )
+    return PageDto.from_items(
+        todo_items, limit, lambda todo_item: (todo_item.created, todo_item.id)
     )
-    query = select(TodoItem).from_statement(query)
-
-    rows = await database.fetch_all(query=query)
-    return database.map_to_models(rows, TodoItem)
 
 
 @database.transaction()
@@ -65,70 +117,835 @@ async def create_todo_item(
     return database.map_to_model(row, TodoItem)
 
 
-@database.transaction()
+@database.transaction(readonly=True)
 async def find_todo_item(
     id: int, todo_list_id: int | None = None, user_id: int | None = None
-) -> TodoItem | None:
+) -> TodoItemDto | None:
     todo_items = await find_todo_items(
         id=id, todo_list_id=todo_list_id, user_id=user_id, limit=1
     )
     return todo_items[0] if todo_items else None
 
 
-@database.transaction()
-async def update_todo_item(id: int, values: UpdateTodoItemRequest) -> TodoItem:
+# Role of the user in the todo list, used to authorize item operations
+# within the same statement as the operation itself
+TODO_LIST_ACCESS_CTE = """
+    access AS (
+        SELECT 'owner' AS role
+        FROM todo_list tl
+        WHERE tl.id = :todo_list_id AND tl.author_id = :user_id
+        UNION ALL
+        SELECT tlr.name AS role
+        FROM todo_list_member tlm
+        JOIN todo_list_role tlr ON tlm.todo_list_role_id = tlr.id
+        WHERE tlm.todo_list_id = :todo_list_id AND tlm.user_id = :user_id
+        LIMIT 1
+    )
+"""
+
+
+def bind_access_params(sql: str, todo_list_id: int, user_id: int, roles: list[Role], **values):
+    return text(sql).bindparams(
+        bindparam("roles", value=list(roles), type_=ARRAY(String)),
+        todo_list_id=todo_list_id,
+        user_id=user_id,
+        **values,
+    )
+
+
+def map_authorized_row(
+    row: Record | None, id: int, todo_list_id: int, user_id: int, roles: list[Role], generation: int
+) -> TodoItem:
+    """
+    Maps a row of an access-checked statement to a todo item or raises the
+    HTTP error matching the result of the access check.
+    :param generation: The generation of the role cache before running the statement.
+    """
+    if row is None:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND, detail=f"Todo list with id {todo_list_id} not found"
+        )
+    todo_list_role_cache.set((user_id, todo_list_id), row["todo_list_role"], generation=generation)
+    if row["todo_list_role"] not in roles:
+        raise HTTPException(
+            status_code=HTTPStatus.FORBIDDEN, detail="You do not have permission to perform this action"
+        )
+    if row["id"] is None:
+        raise HTTPException(
+            status_code=HTTPStatus.NOT_FOUND, detail=f"Todo item with id {id} not found"
+        )
+    return TodoItem(**{key: row[key] for key in row.keys() if key != "todo_list_role"})
+
+
+@database.transaction(readonly=True)
+async def find_authorized_todo_item(
+    id: int, todo_list_id: int, user_id: int, roles: list[Role]
+) -> TodoItem:
     sql = f"""
-    UPDATE todo_item
-    SET
-        description = :description,
-        due_date = :due_date,
-        completed = :completed,
-        updated = NOW()
-    WHERE id = :id
-    RETURNING *
+    WITH {TODO_LIST_ACCESS_CTE}
+    SELECT access.role AS todo_list_role, ti.*
+    FROM access
+    LEFT JOIN todo_item ti
+      ON ti.id = :id
+     AND ti.todo_list_id = :todo_list_id
+     AND access.role = ANY(:roles)
     """
+    query = bind_access_params(sql, todo_list_id, user_id, roles, id=id)
+    generation = todo_list_role_cache.generation
+    row = await database.fetch_one(query=query)
+    return map_authorized_row(row, id, todo_list_id, user_id, roles, generation)
 
-    todo_item = await find_todo_item(id)
-    if todo_item is None:
-        raise HTTPException(status_code=404, detail=f"Todo item with id {id} not found")
 
-    for key, value in values.model_dump(exclude_unset=True).items():
-        setattr(todo_item, key, value)
+@database.transaction()
+async def update_authorized_todo_item(
+    id: int, todo_list_id: int, user_id: int, roles: list[Role], values: UpdateTodoItemRequest
+) -> TodoItem:
+    # Only the fields set in the request are updated. The keys come from
+    # the request model so they are safe to use as column names.
+    attributes = values.model_dump(exclude_unset=True)
+    assignments = "".join(f"{key} = :{key}, " for key in attributes)
+    sql = f"""
+    WITH {TODO_LIST_ACCESS_CTE}, updated AS (
+        UPDATE todo_item ti
+        SET {assignments}updated = NOW()
+        FROM access
+        WHERE ti.id = :id
+          AND ti.todo_list_id = :todo_list_id
+          AND access.role = ANY(:roles)
+        RETURNING ti.*
+    )
+    SELECT access.role AS todo_list_role, updated.*
+    FROM access
+    LEFT JOIN updated ON TRUE
+    """
+    query = bind_access_params(sql, todo_list_id, user_id, roles, id=id, **attributes)
+    generation = todo_list_role_cache.generation
+    row = await database.fetch_one(query=query)
+    return map_authorized_row(row, id, todo_list_id, user_id, roles, generation)
 
-    query = text(sql).bindparams(
-        id=id,
-        description=todo_item.description,
-        due_date=todo_item.due_date,
-        completed=todo_item.completed,
+
+@database.transaction()
+async def delete_authorized_todo_item(
+    id: int, todo_list_id: int, user_id: int, roles: list[Role]
+) -> bool:
+    sql = f"""
+    WITH {TODO_LIST_ACCESS_CTE}, deleted AS (
+        DELETE FROM todo_item ti
+        USING access
+        WHERE ti.id = :id
+          AND ti.todo_list_id = :todo_list_id
+          AND access.role = ANY(:roles)
+        RETURNING ti.*
     )
+    SELECT access.role AS todo_list_role, deleted.*
+    FROM access
+    LEFT JOIN deleted ON TRUE
+    """
+    query = bind_access_params(sql, todo_list_id, user_id, roles, id=id)
+    generation = todo_list_role_cache.generation
+    row = await database.fetch_one(query=query)
+    map_authorized_row(row, id, todo_list_id, user_id, roles, generation)
+    return True
 
+
+@database.transaction()
+async def clone_authorized_todo_item(
+    id: int, todo_list_id: int, user_id: int, roles: list[Role]
+) -> TodoItem:
+    sql = f"""
+    WITH {TODO_LIST_ACCESS_CTE}, cloned AS (
+        INSERT INTO todo_item (author_id, todo_list_id, description, due_date)
+        SELECT :user_id, ti.todo_list_id, ti.description || ' (cloned)', ti.due_date
+        FROM todo_item ti, access
+        WHERE ti.id = :id
+          AND ti.todo_list_id = :todo_list_id
+          AND access.role = ANY(:roles)
+        RETURNING *
+    )
+    SELECT access.role AS todo_list_role, cloned.*
+    FROM access
+    LEFT JOIN cloned ON TRUE
+    """
+    query = bind_access_params(sql, todo_list_id, user_id, roles, id=id)
+    generation = todo_list_role_cache.generation
     row = await database.fetch_one(query=query)
-    if row is None:
-        raise HTTPException(status_code=500, detail="Failed to update todo item")
-    return database.map_to_model(row, TodoItem)
+    return map_authorized_row(row, id, todo_list_id, user_id, roles, generation)
 
 
 @database.transaction()
-async def delete_todo_item(id: int, todo_list_id: int) -> bool:
+async def update_todo_items(
+    updates: dict[int, dict[int, dict]]
+) -> tuple[dict[int, list[int]], list[tuple[int, int]]]:
+    """
+    Updates many todo items in one statement. Updates of todo items that do
+    not exist in the given todo list, e.g. deleted ones, are not applied.
+    :param updates: Values of UpdateTodoItemRequest fields by todo item id by todo list id,
+        due dates as date objects.
+    :return: The ids of the updated todo items by todo list id, and the
+        todo list id and todo item id of each update not applied.
+    """
+    # Items and, through the version triggers, their todo lists are locked in
+    # todo_list_id, id order so concurrent batches cannot deadlock
+    writes = sorted(
+        (todo_list_id, id, values)
+        for todo_list_id, items in updates.items()
+        for id, values in items.items()
+    )
+    lock_sql = """
+    SELECT ti.id
+    FROM todo_item ti
+    WHERE ti.id = ANY(CAST(:ids AS INTEGER[]))
+    ORDER BY ti.todo_list_id, ti.id
+    FOR UPDATE
+    """
+    lock_query = text(lock_sql).bindparams(
+        bindparam("ids", value=[id for _, id, _ in writes], type_=ARRAY(Integer)),
+    )
+    await database.fetch_all(query=lock_query)
+
     sql = """
-    DELETE FROM todo_item
-    WHERE id = :id AND todo_list_id = :todo_list_id
-    RETURNING *
+    UPDATE todo_item ti
+    SET description = COALESCE(v.description, ti.description),
+        completed = COALESCE(v.completed, ti.completed),
+        due_date = CASE WHEN v.set_due_date THEN v.due_date ELSE ti.due_date END,
+        updated = NOW()
+    FROM UNNEST(
+        CAST(:ids AS INTEGER[]),
+        CAST(:todo_list_ids AS INTEGER[]),
+        CAST(:descriptions AS TEXT[]),
+        CAST(:completed AS BOOLEAN[]),
+        CAST(:due_dates AS DATE[]),
+        CAST(:set_due_dates AS BOOLEAN[])
+    ) AS v(id, todo_list_id, description, completed, due_date, set_due_date)
+    WHERE ti.id = v.id AND ti.todo_list_id = v.todo_list_id
+    RETURNING ti.todo_list_id, ti.id
     """
-    query = text(sql).bindparams(id=id, todo_list_id=todo_list_id)
-    deleted = await database.execute(query=query)
-    return deleted is not None
+    query = text(sql).bindparams(
+        bindparam("ids", value=[id for _, id, _ in writes], type_=ARRAY(Integer)),
+        bindparam("todo_list_ids", value=[todo_list_id for todo_list_id, _, _ in writes], type_=ARRAY(Integer)),
+        bindparam("descriptions", value=[values.get("description") for _, _, values in writes], type_=ARRAY(String)),
+        bindparam("completed", value=[values.get("completed") for _, _, values in writes], type_=ARRAY(Boolean)),
+        bindparam("due_dates", value=[values.get("due_date") for _, _, values in writes], type_=ARRAY(Date)),
+        bindparam("set_due_dates", value=["due_date" in values for _, _, values in writes], type_=ARRAY(Boolean)),
+    )
+    rows = await database.fetch_all(query=query)
 
+    updated: dict[int, list[int]] = {}
+    for row in rows:
+        updated.setdefault(row["todo_list_id"], []).append(row["id"])
+    applied = {(row["todo_list_id"], row["id"]) for row in rows}
+    not_applied = [(todo_list_id, id) for todo_list_id, id, _ in writes if (todo_list_id, id) not in applied]
+    return updated, not_applied
 
-@database.transaction()
-async def clone_todo_item(id: int, author_id: int, todo_list_id: int) -> TodoItem:
-    todo_item = await find_todo_item(id)
-    if todo_item is None:
-        raise HTTPException(status_code=404, detail=f"Todo item with id {id} not found")
 
-    return await create_todo_item(
-        author_id=author_id,
-        todo_list_id=todo_list_id,
-        description=todo_item.description + " (cloned)",
-        due_date=todo_item.due_date,
+# Tombstones of deleted todo items are kept TODO_ITEM_TOMBSTONE_RETENTION_DAYS
+# and pruned every TODO_ITEM_TOMBSTONE_PRUNE_INTERVAL_SECONDS. Syncs from an
+# older cursor get a 410 and have to start over without one.
+TODO_ITEM_TOMBSTONE_RETENTION_DAYS = int(os.getenv("TODO_ITEM_TOMBSTONE_RETENTION_DAYS", "30"))
+TODO_ITEM_TOMBSTONE_PRUNE_INTERVAL_SECONDS = float(os.getenv("TODO_ITEM_TOMBSTONE_PRUNE_INTERVAL_SECONDS", "3600"))
+
+expiredSyncCursorError = HTTPException(
+    status_code=HTTPStatus.GONE, detail="Sync cursor expired, sync again without since")
+
+# The since and next sync cursors of a sync and the (changed_xid, id) keyset of the last change of a page
+ChangesPage = tuple[str | None, str, tuple[str, int]]
+
+
+def encode_changes_page(since: str | None, next_cursor: str, after: tuple[str, int]) -> str:
+    return encode_payload([since, next_cursor, after[0], after[1]])
+
+
+def decode_changes_page(page: str) -> ChangesPage:
+    """
+    :raises HTTPException: If the page cursor is malformed.
+    """
+    try:
+        since, next_cursor, after_xid, after_id = decode_payload(page)
+    except ValueError:
+        raise invalidCursorError
+    xids = [next_cursor, after_xid] if since is None else [since, next_cursor, after_xid]
+    if not all(isinstance(xid, str) and xid.isdigit() for xid in xids) or not isinstance(after_id, int):
+        raise invalidCursorError
+    return since, next_cursor, (after_xid, after_id)
+
+
+@database.transaction(isolation="repeatable_read")
+async def find_todo_item_changes(
+    todo_list_id: int, since: str | None = None, page: str | None = None, limit: int = DEFAULT_PAGE_SIZE
+) -> TodoItemChangesDto:
+    """
+    Returns a page of the todo items of a list written and deleted since a
+    sync cursor, or of all todo items without one, in (changed_xid, id)
+    order. The oldest transaction running when the first page is read is
+    the next sync cursor, so changes committed later, also while paging,
+    are returned by the next sync. The statements of a page share one
+    snapshot, so this must not be called in an open transaction, which
+    raises a RuntimeError.
+    :param todo_list_id: The id of the todo list.
+    :param since: The next_cursor of the last page of a previous sync.
+    :param page: The next_page of the previous page of this sync, which replaces since.
+    :param limit: The maximum number of changed and deleted todo items.
+    :raises HTTPException: If a cursor is malformed, or GONE if tombstones
+        since the sync cursor have been pruned.
+    """
+    if page is not None:
+        since, next_cursor, after = decode_changes_page(page)
+    else:
+        if since is not None and not since.isdigit():
+            raise invalidCursorError
+        next_cursor = await database.fetch_val(
+            "SELECT CAST(pg_snapshot_xmin(pg_current_snapshot()) AS TEXT)")
+        after = None
+
+    if since is not None:
+        sql = """
+        SELECT EXISTS (
+            SELECT 1 FROM todo_item_tombstone_horizon
+            WHERE pruned_xid >= CAST(CAST(:since AS TEXT) AS xid8)
+        )
+        """
+        if await database.fetch_val(query=text(sql).bindparams(since=since)):
+            raise expiredSyncCursorError
+
+    changes: list[tuple[int, int, dict | None]] = []
+
+    where = WhereClause().add("ti.todo_list_id = :todo_list_id", todo_list_id=todo_list_id)
+    if since is not None:
+        where.add("ti.changed_xid >= CAST(CAST(:since AS TEXT) AS xid8)", since=since)
+    if after is not None:
+        where.add(
+            "(ti.changed_xid, ti.id) > (CAST(CAST(:after_xid AS TEXT) AS xid8), :after_id)",
+            after_xid=after[0],
+            after_id=after[1],
+        )
+    sql = f"""
+    SELECT ti.id, ti.author_id, ti.todo_list_id, ti.description, ti.due_date, ti.completed, ti.created, ti.updated,
+           CAST(ti.changed_xid AS TEXT) AS changed_xid
+    FROM todo_item ti
+    {where}
+    ORDER BY ti.changed_xid, ti.id
+    LIMIT :limit
+    """
+    for row in await database.fetch_all(query=where.bind(sql, limit=limit + 1)):
+        item = dict(row)
+        changes.append((int(item.pop("changed_xid")), item["id"], item))
+
+    if since is not None:
+        where = (
+            WhereClause()
+            .add("tt.todo_list_id = :todo_list_id", todo_list_id=todo_list_id)
+            .add("tt.changed_xid >= CAST(CAST(:since AS TEXT) AS xid8)", since=since)
+        )
+        if after is not None:
+            where.add(
+                "(tt.changed_xid, tt.todo_item_id) > (CAST(CAST(:after_xid AS TEXT) AS xid8), :after_id)",
+                after_xid=after[0],
+                after_id=after[1],
+            )
+        sql = f"""
+        SELECT tt.todo_item_id, CAST(tt.changed_xid AS TEXT) AS changed_xid
+        FROM todo_item_tombstone tt
+        {where}
+        ORDER BY tt.changed_xid, tt.todo_item_id
+        LIMIT :limit
+        """
+        for row in await database.fetch_all(query=where.bind(sql, limit=limit + 1)):
+            changes.append((int(row["changed_xid"]), row["todo_item_id"], None))
+
+    changes.sort(key=lambda change: change[:2])
+    next_page = None
+    if len(changes) > limit:
+        changes = changes[:limit]
+        changed_xid, id, _ = changes[-1]
+        next_page = encode_changes_page(since, next_cursor, (str(changed_xid), id))
+
+    return TodoItemChangesDto.model_construct(
+        items=[TodoItemDto.model_construct(**item) for _, _, item in changes if item is not None],
+        deleted_ids=[id for _, id, item in changes if item is None],
+        next_cursor=next_cursor,
+        next_page=next_page,
     )
+
+
+@database.transaction()
+async def prune_todo_item_tombstones() -> int:
+    """
+    Deletes the tombstones older than TODO_ITEM_TOMBSTONE_RETENTION_DAYS.
+    :return: The number of deleted tombstones.
+    """
+    query = text("SELECT prune_todo_item_tombstones(:retention)").bindparams(
+        retention=timedelta(days=TODO_ITEM_TOMBSTONE_RETENTION_DAYS))
+    return await database.fetch_val(query=query)
+
+
+async def prune_todo_item_tombstones_periodically():
+    """
+    Prunes tombstones every TODO_ITEM_TOMBSTONE_PRUNE_INTERVAL_SECONDS. When
+    cancelled, a running prune is finished first, as cancelling a transaction
+    while it starts leaks its pooled connection and closing the pool then
+    waits for it forever.
+    """
+    while True:
+        prune = asyncio.create_task(prune_todo_item_tombstones())
+        try:
+            pruned = await asyncio.shield(prune)
+            if pruned:
+                logger.info(f"Pruned {pruned} todo item tombstones")
+        except asyncio.CancelledError:
+            with suppress(Exception):
+                await prune
+            raise
+        except Exception as e:
+            logger.warning(f"Pruning todo item tombstones failed: {e}")
+        await asyncio.sleep(TODO_ITEM_TOMBSTONE_PRUNE_INTERVAL_SECONDS)
+
+
+def parse_due_date(due_date: str | None) -> date | None:
+    return None if due_date is None else date.fromisoformat(due_date)
+
+
+@database.transaction()
+async def apply_todo_item_batch(
+    todo_list_id: int, author_id: int, operations: list[TodoItemOperation]
+) -> list[TodoItemOperationResultDto]:
+    """
+    Applies a batch of operations to the todo items of a list. Operations are
+    grouped by kind and each kind runs as one statement: creates first, then
+    updates and completions, then deletes. Updates of the same item are
+    merged in the order given. Invalid operations get a 400 result without
+    affecting the others.
+    :return: The result of each operation in the order of the operations.
+    """
+    results: list[TodoItemOperationResultDto | None] = [None] * len(operations)
+    creates: list[tuple[int, str, date | None]] = []
+    updates: dict[int, dict] = {}
+    update_indexes: dict[int, list[int]] = {}
+    delete_indexes: dict[int, list[int]] = {}
+
+    for index, operation in enumerate(operations):
+        try:
+            if operation.op == "create":
+                if operation.description is None:
+                    raise ValueError("description is required")
+                creates.append((index, operation.description, parse_due_date(operation.due_date)))
+            elif operation.id is None:
+                raise ValueError("id is required")
+            elif operation.op == "delete":
+                delete_indexes.setdefault(operation.id, []).append(index)
+            else:
+                if operation.op == "complete":
+                    values = {"completed": True if operation.completed is None else operation.completed}
+                else:
+                    values = operation.model_dump(
+                        include={"description", "due_date", "completed"}, exclude_unset=True)
+                    if "due_date" in values:
+                        values["due_date"] = parse_due_date(values["due_date"])
+                updates.setdefault(operation.id, {}).update(values)
+                update_indexes.setdefault(operation.id, []).append(index)
+        except ValueError as e:
+            results[index] = TodoItemOperationResultDto.model_construct(
+                op=operation.op, status=HTTPStatus.BAD_REQUEST, id=operation.id, item=None, detail=str(e))
+
+    if creates:
+        # Ids are allocated up front to match the inserted rows with the operations
+        sql = """
+        WITH input AS (
+            SELECT nextval(pg_get_serial_sequence('todo_item', 'id')) AS id, v.ord, v.description, v.due_date
+            FROM UNNEST(CAST(:descriptions AS TEXT[]), CAST(:due_dates AS DATE[]))
+                WITH ORDINALITY AS v(description, due_date, ord)
+        ), inserted AS (
+            INSERT INTO todo_item (id, author_id, todo_list_id, description, due_date)
+            SELECT id, :author_id, :todo_list_id, description, due_date
+            FROM input
+            RETURNING *
+        )
+        SELECT input.ord, inserted.*
+        FROM input
+        JOIN inserted ON inserted.id = input.id
+        """
+        query = text(sql).bindparams(
+            bindparam("descriptions", value=[description for _, description, _ in creates], type_=ARRAY(String)),
+            bindparam("due_dates", value=[due_date for _, _, due_date in creates], type_=ARRAY(Date)),
+            author_id=author_id,
+            todo_list_id=todo_list_id,
+        )
+        for row in await database.fetch_all(query=query):
+            index = creates[row["ord"] - 1][0]
+            results[index] = TodoItemOperationResultDto.model_construct(
+                op="create", status=HTTPStatus.CREATED, id=row["id"],
+                item=database.construct_model(row, TodoItemDto), detail=None)
+
+    if updates:
+        ids = list(updates)
+        sql = """
+        UPDATE todo_item ti
+        SET description = COALESCE(v.description, ti.description),
+            completed = COALESCE(v.completed, ti.completed),
+            due_date = CASE WHEN v.set_due_date THEN v.due_date ELSE ti.due_date END,
+            updated = NOW()
+        FROM UNNEST(
+            CAST(:ids AS INTEGER[]),
+            CAST(:descriptions AS TEXT[]),
+            CAST(:completed AS BOOLEAN[]),
+            CAST(:due_dates AS DATE[]),
+            CAST(:set_due_dates AS BOOLEAN[])
+        ) AS v(id, description, completed, due_date, set_due_date)
+        WHERE ti.id = v.id AND ti.todo_list_id = :todo_list_id
+        RETURNING ti.*
+        """
+        query = text(sql).bindparams(
+            bindparam("ids", value=ids, type_=ARRAY(Integer)),
+            bindparam("descriptions", value=[updates[id].get("description") for id in ids], type_=ARRAY(String)),
+            bindparam("completed", value=[updates[id].get("completed") for id in ids], type_=ARRAY(Boolean)),
+            bindparam("due_dates", value=[updates[id].get("due_date") for id in ids], type_=ARRAY(Date)),
+            bindparam("set_due_dates", value=["due_date" in updates[id] for id in ids], type_=ARRAY(Boolean)),
+            todo_list_id=todo_list_id,
+        )
+        updated = {row["id"]: row for row in await database.fetch_all(query=query)}
+        for id, indexes in update_indexes.items():
+            row = updated.get(id)
+            for index in indexes:
+                results[index] = TodoItemOperationResultDto.model_construct(
+                    op=operations[index].op,
+                    status=HTTPStatus.OK if row is not None else HTTPStatus.NOT_FOUND,
+                    id=id,
+                    item=database.construct_model(row, TodoItemDto) if row is not None else None,
+                    detail=None if row is not None else f"Todo item with id {id} not found",
+                )
+
+    if delete_indexes:
+        sql = """
+        DELETE FROM todo_item
+        WHERE todo_list_id = :todo_list_id AND id = ANY(:ids)
+        RETURNING id
+        """
+        query = text(sql).bindparams(
+            bindparam("ids", value=list(delete_indexes), type_=ARRAY(Integer)),
+            todo_list_id=todo_list_id,
+        )
+        deleted = {row["id"] for row in await database.fetch_all(query=query)}
+        for id, indexes in delete_indexes.items():
+            for index in indexes:
+                results[index] = TodoItemOperationResultDto.model_construct(
+                    op="delete",
+                    status=HTTPStatus.OK if id in deleted else HTTPStatus.NOT_FOUND,
+                    id=id,
+                    item=None,
+                    detail=None if id in deleted else f"Todo item with id {id} not found",
+                )
+
+    return results  # type: ignore
+
+
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "1000"))
+EXPORT_MAX_CONCURRENT = int(os.getenv("EXPORT_MAX_CONCURRENT", "4"))
+EXPORT_COLUMNS = ["id", "author_id", "todo_list_id", "description", "due_date", "completed", "created", "updated"]
+
+# Every running export holds a pooled connection until it is consumed
+export_slots = asyncio.Semaphore(EXPORT_MAX_CONCURRENT)
+
+exportsBusyError = HTTPException(
+    status_code=HTTPStatus.SERVICE_UNAVAILABLE,
+    detail="Too many exports running, please retry",
+    headers={"Retry-After": "5"},
+)
+
+
+async def export_todo_items(todo_list_id: int, format: Literal["ndjson", "csv"]) -> AsyncIterator[bytes]:
+    """
+    Returns the todo items of a list as NDJSON or CSV, streamed in chunks
+    from a server side cursor. An export slot is taken before returning.
+    :raises HTTPException: If EXPORT_MAX_CONCURRENT exports are already running.
+    """
+    if export_slots.locked():
+        raise exportsBusyError
+    chunks = stream_todo_items(todo_list_id, format)
+    # Takes the slot without waiting, as it is free and nothing awaited since
+    await anext(chunks)
+    return chunks
+
+
+async def stream_todo_items(todo_list_id: int, format: Literal["ndjson", "csv"]) -> AsyncIterator[bytes]:
+    """
+    Yields an empty chunk once it holds an export slot, then the export.
+    Started async generators are closed when collected, so the slot is
+    released even if the export is never streamed.
+    """
+    sql = f"""
+    SELECT {", ".join(f"ti.{column}" for column in EXPORT_COLUMNS)}
+    FROM todo_item ti
+    WHERE ti.todo_list_id = :todo_list_id
+    ORDER BY ti.created, ti.id
+    """
+    await export_slots.acquire()
+    try:
+        yield b""
+        if format == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue().encode()
+
+        # Closing the export closes the cursor and returns its connection right away
+        async with aclosing(database.iterate_statement(
+            "export_todo_items", sql, {"todo_list_id": todo_list_id}, chunk_size=EXPORT_CHUNK_SIZE
+        )) as chunks:
+            async for rows in chunks:
+                if format == "ndjson":
+                    yield b"".join(orjson.dumps(dict(row), option=ORJSON_OPTIONS) + b"\n" for row in rows)
+                else:
+                    buffer.seek(0)
+                    buffer.truncate()
+                    writer.writerows(
+                        [value.isoformat() if isinstance(value, date) else value for value in row]
+                        for row in rows
+                    )
+                    yield buffer.getvalue().encode()
+    finally:
+        export_slots.release()
+
+
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "100000"))
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "1000"))
+# Every running import holds a pooled connection until it is uploaded
+IMPORT_MAX_BYTES = int(os.getenv("IMPORT_MAX_BYTES", str(64 * 1024 * 1024)))
+IMPORT_TIMEOUT_SECONDS = float(os.getenv("IMPORT_TIMEOUT_SECONDS", "300"))
+
+importTooLargeError = HTTPException(
+    status_code=HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+    detail=f"Imports are limited to {IMPORT_MAX_BYTES} bytes",
+)
+
+importTimeoutError = HTTPException(
+    status_code=HTTPStatus.REQUEST_TIMEOUT,
+    detail=f"Imports have to be uploaded within {IMPORT_TIMEOUT_SECONDS:g} seconds",
+)
+
+BOOLEAN_STRINGS = {
+    "": None, "true": True, "false": False, "1": True, "0": False, "yes": True, "no": False,
+}
+
+
+async def limit_upload(chunks: AsyncIterator[bytes], max_bytes: int) -> AsyncIterator[bytes]:
+    """
+    :raises HTTPException: Once the upload exceeds max_bytes.
+    """
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            raise importTooLargeError
+        yield chunk
+
+
+async def iterate_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Splits a byte stream into lines without their line breaks.
+    """
+    remainder = b""
+    async for chunk in chunks:
+        lines = (remainder + chunk).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            yield line.removesuffix(b"\r")
+    if remainder:
+        yield remainder.removesuffix(b"\r")
+
+
+async def iterate_import_rows(
+    chunks: AsyncIterator[bytes], format: Literal["ndjson", "csv"]
+) -> AsyncIterator[tuple[int, dict | None, str | None]]:
+    """
+    Parses an UTF-8 encoded NDJSON or CSV upload incrementally. CSV uploads
+    need a header row, records spanning lines in quoted fields are supported.
+    :return: Tuples of the starting line number and the values of a row or an error.
+    """
+    if format == "ndjson":
+        number = 0
+        async for line in iterate_lines(chunks):
+            number += 1
+            if not line.strip():
+                continue
+            try:
+                values = orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                yield number, None, f"Invalid JSON: {e}"
+                continue
+            if isinstance(values, dict):
+                yield number, values, None
+            else:
+                yield number, None, "Expected a JSON object"
+        return
+
+    header: list[str] | None = None
+    record: list[str] = []
+    start = 0
+    number = 0
+    async for raw_line in iterate_lines(chunks):
+        number += 1
+        if not record:
+            start = number
+        try:
+            record.append(raw_line.decode())
+        except UnicodeDecodeError:
+            yield start, None, f"Invalid UTF-8 in line {number}"
+            record = []
+            continue
+        # A record continues while a quoted field is open
+        if "\n".join(record).count('"') % 2:
+            continue
+        text_record, record = "\n".join(record), []
+        if not text_record.strip():
+            continue
+        try:
+            fields = next(csv.reader([text_record]))
+        except csv.Error as e:
+            yield start, None, f"Invalid CSV: {e}"
+            continue
+        if header is None:
+            header = [field.strip() for field in fields]
+            continue
+        if len(fields) != len(header):
+            yield start, None, f"Expected {len(header)} fields, got {len(fields)}"
+            continue
+        yield start, dict(zip(header, fields)), None
+    if record:
+        yield start, None, "Unterminated quoted field"
+
+
+def parse_import_date(value: str) -> date:
+    """
+    Parses an ISO 8601 date, or the date of an ISO 8601 date and time.
+    :raises ValueError: If the whole value is not a date or a date and time.
+    """
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).date()
+    except ValueError:
+        raise ValueError("due_date must be an ISO 8601 date")
+
+
+def parse_import_row(values: dict) -> tuple[str, date | None, bool | None]:
+    """
+    Validates the description, due_date and completed values of an imported row.
+    :raises ValueError: If a value is missing or invalid.
+    """
+    description = values.get("description")
+    if not isinstance(description, str) or not description:
+        raise ValueError("description is required")
+    # Postgres text cannot contain NUL characters, COPY would fail the whole import
+    if "\x00" in description:
+        raise ValueError("description must not contain NUL characters")
+
+    due_date = values.get("due_date")
+    if due_date is not None and due_date != "":
+        if not isinstance(due_date, str):
+            raise ValueError("due_date must be an ISO 8601 date")
+        due_date = parse_import_date(due_date)
+    else:
+        due_date = None
+
+    completed = values.get("completed")
+    if isinstance(completed, str):
+        if completed.strip().lower() not in BOOLEAN_STRINGS:
+            raise ValueError("completed must be true or false")
+        completed = BOOLEAN_STRINGS[completed.strip().lower()]
+    elif completed is not None and not isinstance(completed, bool):
+        raise ValueError("completed must be true or false")
+    return description, due_date, completed
+
+
+async def import_todo_items(
+    todo_list_id: int, author_id: int, chunks: AsyncIterator[bytes], format: Literal["ndjson", "csv"]
+) -> tuple[TodoItemImportResultDto, list[int]]:
+    """
+    Imports todo items from an NDJSON or CSV upload. Rows are validated as
+    they arrive and copied into a temporary staging table in chunks of
+    IMPORT_CHUNK_SIZE with COPY. Staging runs outside of a transaction, so a
+    slow upload holds no snapshot, and only inserting the staged rows into
+    todo_item in one statement runs in a transaction. Invalid rows are
+    reported and skipped.
+    :return: The import result and the ids of the created todo items.
+    :raises HTTPException: If the upload exceeds IMPORT_MAX_BYTES or IMPORT_TIMEOUT_SECONDS.
+    """
+    errors: list[TodoItemImportErrorDto] = []
+    failed = 0
+    staged = 0
+    batch: list[tuple[int, str, date | None, bool | None]] = []
+
+    async with database.connection() as connection:
+        raw_connection = connection.raw_connection
+
+        async def copy_batch():
+            await raw_connection.copy_records_to_table(
+                "todo_item_import", records=batch, columns=["line", "description", "due_date", "completed"])
+            batch.clear()
+
+        await raw_connection.execute("""
+        CREATE TEMP TABLE todo_item_import (
+            line INTEGER NOT NULL,
+            description TEXT NOT NULL,
+            due_date DATE,
+            completed BOOLEAN
+        )
+        """)
+        try:
+            try:
+                async with asyncio.timeout(IMPORT_TIMEOUT_SECONDS):
+                    async for line, values, error in iterate_import_rows(
+                        limit_upload(chunks, IMPORT_MAX_BYTES), format
+                    ):
+                        if error is None:
+                            if staged >= IMPORT_MAX_ROWS:
+                                error = f"Imports are limited to {IMPORT_MAX_ROWS} rows"
+                            else:
+                                try:
+                                    batch.append((line, *parse_import_row(values)))
+                                    staged += 1
+                                except ValueError as e:
+                                    error = str(e)
+                        if error is not None:
+                            failed += 1
+                            if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+                                errors.append(TodoItemImportErrorDto.model_construct(line=line, detail=error))
+                        if len(batch) >= IMPORT_CHUNK_SIZE:
+                            await copy_batch()
+                    if batch:
+                        await copy_batch()
+            except TimeoutError:
+                raise importTimeoutError
+
+            # Ids are allocated in line order, as the imported items share their
+            # created timestamp, and returned with their lines, as RETURNING
+            # rows come in no guaranteed order
+            async with database.transaction():
+                rows = await raw_connection.fetch("""
+                WITH staged_item AS (
+                    SELECT
+                        line,
+                        nextval(pg_get_serial_sequence('todo_item', 'id')) AS id,
+                        description,
+                        due_date,
+                        completed
+                    FROM todo_item_import
+                    ORDER BY line
+                ), imported_item AS (
+                    INSERT INTO todo_item (id, author_id, todo_list_id, description, due_date, completed)
+                    SELECT id, $1, $2, description, due_date, COALESCE(completed, FALSE)
+                    FROM staged_item
+                    RETURNING id
+                )
+                SELECT si.line, si.id
+                FROM staged_item si
+                JOIN imported_item ii ON ii.id = si.id
+                ORDER BY si.line
+                """, author_id, todo_list_id)
+        finally:
+            await raw_connection.execute("DROP TABLE IF EXISTS todo_item_import")
+
+    result = TodoItemImportResultDto.model_construct(imported=len(rows), failed=failed, errors=errors)
+    return result, [row["id"] for row in rows]
@@ -1,60 +1,229 @@
 from http import HTTPStatus
+import json
+import os
 from typing import List
+from databases.interfaces import Record
 from fastapi import HTTPException
-from sqlalchemy import text
-from dto.response_dtos import TodoListDto, TodoListMemberDto, TodoListRoleDto, UserDto
+from sqlalchemy import ARRAY, Integer, bindparam, text
+from dto.response_dtos import PageDto, TodoListDto, TodoListMemberDto, TodoListMembersUpdateDto, TodoListRoleDto, UserDto
 from model.role import Role
 from model.todo_list_role import TodoListRole
 from model.todo_list import TodoList
+from core.broadcast import create_broadcast_bus
+from core.cache import TTLCache
 from core.database import database
-from service import todo_item_service
+from core.database_wrapper import TransactionScope
+from core.pagination import Keyset, decode_cursor
+from core.query_builder import WhereClause
+
+
+TODO_LIST_ROLE_CACHE_SIZE = int(os.getenv("TODO_LIST_ROLE_CACHE_SIZE", "10000"))
+TODO_LIST_ROLE_CACHE_TTL_SECONDS = float(os.getenv("TODO_LIST_ROLE_CACHE_TTL_SECONDS", "60"))
+
+# Roles of users in todo lists keyed by (user_id, todo_list_id). Functions
+# changing todo list membership must invalidate the affected entries.
+todo_list_role_cache: TTLCache[tuple[int, int], Role] = TTLCache(
+    maxsize=TODO_LIST_ROLE_CACHE_SIZE, ttl=TODO_LIST_ROLE_CACHE_TTL_SECONDS
+)
+
+# Invalidations reach the role caches of the other workers over their own
+# channel of the broadcast bus, see WS_BROADCAST_BACKEND
+TODO_LIST_ROLE_INVALIDATION_CHANNEL = os.getenv("TODO_LIST_ROLE_INVALIDATION_CHANNEL", "todo_list_role_invalidation")
+role_invalidation_bus = create_broadcast_bus(
+    os.getenv("WS_BROADCAST_BACKEND", "postgres"), os.environ["DATABASE_URL"], TODO_LIST_ROLE_INVALIDATION_CHANNEL
+)
 
 
 async def authorize_todo_list_access(todo_list_id: int, user_id: int, roles: list[Role]) -> bool:
-    todo_list = await find_todo_list(todo_list_id, user_id)
-    if todo_list is None:
+    role = await find_todo_list_role(todo_list_id, user_id)
+    if role is None:
         raise HTTPException(
             status_code=HTTPStatus.NOT_FOUND, detail=f"Todo list with id {todo_list_id} not found"
         )
-    if todo_list.role not in roles:
+    if role not in roles:
         raise HTTPException(
             status_code=HTTPStatus.FORBIDDEN, detail="You do not have permission to perform this action"
         )
     return True
 
 
-@database.transaction()
+async def find_todo_list_role(todo_list_id: int, user_id: int) -> Role | None:
+    role = todo_list_role_cache.get((user_id, todo_list_id))
+    if role is not None:
+        return role
+    generation = todo_list_role_cache.generation
+
+    sql = """
+    SELECT 'owner' AS role
+    FROM todo_list tl
+    WHERE tl.id = :todo_list_id AND tl.author_id = :user_id
+    UNION ALL
+    SELECT tlr.name AS role
+    FROM todo_list_member tlm
+    JOIN todo_list_role tlr ON tlm.todo_list_role_id = tlr.id
+    WHERE tlm.todo_list_id = :todo_list_id AND tlm.user_id = :user_id
+    LIMIT 1
+    """
+    query = text(sql).bindparams(todo_list_id=todo_list_id, user_id=user_id)
+    row = await database.fetch_one(query=query)
+    if row is None:
+        return None
+
+    todo_list_role_cache.set((user_id, todo_list_id), row["role"], generation=generation)
+    return row["role"]
+
+
+def evict_todo_list_roles(todo_list_id: int, user_ids: list[int] | None = None) -> None:
+    if user_ids is None:
+        todo_list_role_cache.invalidate_where(lambda key: key[1] == todo_list_id)
+        return
+    for user_id in user_ids:
+        todo_list_role_cache.invalidate((user_id, todo_list_id))
+
+
+async def invalidate_todo_list_roles(todo_list_id: int, user_ids: list[int] | None = None) -> None:
+    """
+    Evicts cached roles of a todo list once the current transaction has
+    committed, on this worker and on the others, so that no request reloads
+    a role the transaction is about to change.
+    :param todo_list_id: The id of the todo list.
+    :param user_ids: The users whose roles change, None for all members.
+    """
+    async def evict():
+        evict_todo_list_roles(todo_list_id, user_ids)
+        await role_invalidation_bus.publish(todo_list_id, json.dumps(user_ids))
+
+    await database.after_commit(evict)
+
+
+async def receive_todo_list_role_invalidation(todo_list_id: int, message: str) -> None:
+    evict_todo_list_roles(todo_list_id, json.loads(message))
+
+
+@database.transaction(readonly=True)
 async def find_todo_lists(
     id: int | None = None,
     user_id: int | None = None,
     name: str | None = None,
+    after: Keyset | None = None,
     limit: int | None = None,
 ) -> List[TodoListDto]:
-    sql = """
-    SELECT tl.*, 'owner' as role, u.username as author_username
+    owned_where = (
+        WhereClause()
+        .equals("tl.id", "id", id)
+        .equals("tl.author_id", "user_id", user_id)
+        .equals("tl.name", "name", name)
+    )
+    shared_where = (
+        WhereClause()
+        .equals("tl.id", "id", id)
+        .equals("tlm.user_id", "user_id", user_id)
+        .equals("tl.name", "name", name)
+    )
+    if after is not None:
+        for where in (owned_where, shared_where):
+            where.add(
+                "(tl.created, tl.id) > (:after_created, :after_id)",
+                after_created=after[0],
+                after_id=after[1],
+            )
+
+    # Both branches are ordered and limited on their own so that each one
+    # can be served by an index range scan
+    params = {}
+    branch_limit = ""
+    if limit is not None:
+        branch_limit = "LIMIT :limit"
+        params.update(limit=limit)
+
+    sql = f"""
+    (
+    SELECT tl.id, tl.name, tl.description, tl.author_id, tl.created, tl.updated, 'owner' as role, u.username as author_username
     FROM todo_list tl
     JOIN users u ON tl.author_id = u.id
-    WHERE (tl.id = :id OR :id IS NULL)
-      AND (tl.author_id = :user_id OR :user_id IS NULL) 
-      AND (tl.name = :name OR :name IS NULL)
+    {owned_where}
+    ORDER BY tl.created, tl.id
+    {branch_limit}
+    )
     UNION
-    SELECT tl.*, tlr.name as role, u.username as author_username
+    (
+    SELECT tl.id, tl.name, tl.description, tl.author_id, tl.created, tl.updated, tlr.name as role, u.username as author_username
     FROM todo_list tl
     JOIN todo_list_member tlm ON tl.id = tlm.todo_list_id
     JOIN users u ON tl.author_id = u.id
     JOIN todo_list_role tlr ON tlm.todo_list_role_id = tlr.id
-    WHERE (tl.id = :id OR :id IS NULL)
-      AND (tlm.user_id = :user_id OR :user_id IS NULL)
-      AND (tl.name = :name OR :name IS NULL)
+    {shared_where}
+    ORDER BY tl.created, tl.id
+    {branch_limit}
+    )
+    ORDER BY created, id
+    {branch_limit}
     """
-    if limit:
-        sql = sql + f"\nLIMIT {limit}\n"
-    query = text(sql).bindparams(id=id, name=name, user_id=user_id)
-    rows = await database.fetch_all(query=query)
+    params.update(owned_where.params)
+    rows = await database.fetch_all_statement(
+        "find_todo_lists", sql, shared_where.values(**params)
+    )
     return [TodoListDto.from_raw(**row) for row in rows]  # type: ignore
 
 
-@database.transaction()
+async def find_todo_lists_page(
+    user_id: int, cursor: str | None, limit: int
+) -> PageDto[TodoListDto]:
+    todo_lists = await find_todo_lists(
+        user_id=user_id, after=decode_cursor(cursor), limit=limit + 1
+    )
+    return PageDto.from_items(
+        todo_lists, limit, lambda todo_list: (todo_list.created, todo_list.id)
+    )
+
+
+def versioned_read() -> TransactionScope:
+    """
+    Returns a read only scope whose statements run on one connection and
+    share one snapshot, so a version matches the data read along with it.
+    """
+    return database.transaction(readonly=True, isolation="repeatable_read")
+
+
+@database.transaction(readonly=True)
+async def find_todo_list_version(id: int) -> Record | None:
+    """
+    Returns the version counters of a todo list: version changes with the
+    list and its members, items_version with its todo items.
+    """
+    sql = """
+    SELECT tl.version, tl.items_version
+    FROM todo_list tl
+    WHERE tl.id = :id
+    """
+    query = text(sql).bindparams(id=id)
+    return await database.fetch_one(query=query)
+
+
+@database.transaction(readonly=True)
+async def find_todo_lists_version(user_id: int) -> str:
+    """
+    Returns a digest of the ids and versions of the todo lists of a user,
+    changing whenever a list is added, removed or changed.
+    """
+    sql = """
+    SELECT md5(COALESCE(string_agg(id || ':' || version, ',' ORDER BY id), ''))
+    FROM (
+        SELECT tl.id, tl.version
+        FROM todo_list tl
+        WHERE tl.author_id = :user_id
+        UNION ALL
+        SELECT tl.id, tl.version
+        FROM todo_list_member tlm
+        JOIN todo_list tl ON tl.id = tlm.todo_list_id
+        WHERE tlm.user_id = :user_id
+    ) todo_lists
+    """
+    query = text(sql).bindparams(user_id=user_id)
+    return await database.fetch_val(query=query)
+
+
+@database.transaction(readonly=True)
 async def find_todo_list(id: int, user_id: int | None = None) -> TodoListDto | None:
     todo_lists = await find_todo_lists(id=id, user_id=user_id, limit=1)
     return todo_lists[0] if todo_lists else None
@@ -90,7 +259,7 @@ async def update_todo_list(
 ) -> TodoList:
     sql = """
     UPDATE todo_list
-    SET name = :name, description = :description
+    SET name = :name, description = :description, updated = NOW()
     WHERE id = :id
     RETURNING *
     """
@@ -118,6 +287,7 @@ async def delete_todo_list(id: int) -> bool:
     """
     query = text(sql).bindparams(id=id)
     await database.execute(query=query)
+    await invalidate_todo_list_roles(id)
     return True
 
 
@@ -135,52 +305,81 @@ async def clone_todo_list(id: int, author_id: int, name: str) -> TodoListDto:
             detail=f"User {author_id} already has a todo list with name {name}",
         )
 
-    todo_items = await todo_item_service.find_todo_items(todo_list_id=id)
-
     cloned = await create_todo_list(
         author_id=author_id, name=name, description=todo_list.description
     )
-    for todo_item in todo_items:
-        await todo_item_service.create_todo_item(
-            author_id=author_id,
-            todo_list_id=cloned.id,
-            description=todo_item.description,
-            due_date=todo_item.due_date,
-        )
 
-    return TodoListDto.from_raw(
-        id=cloned.id,
-        name=cloned.name,
-        description=cloned.description,
-        author_id=author_id,
-        role="owner",
-        author_username=todo_list.author.username,
-        created=cloned.created,
-        updated=cloned.updated,
+    # Item ids are allocated up front so that item assignees and tags can be
+    # mapped onto the cloned items within the same statement. The cloned
+    # items share their created timestamp, so ids are allocated in the
+    # (created, id) order of the source items to keep the list order; nextval
+    # is evaluated after the sort.
+    sql = """
+    WITH source_item AS (
+        SELECT
+            ti.id AS source_id,
+            nextval(pg_get_serial_sequence('todo_item', 'id')) AS cloned_id,
+            ti.description,
+            ti.due_date
+        FROM todo_item ti
+        WHERE ti.todo_list_id = :id
+        ORDER BY ti.created, ti.id
+    ), cloned_item AS (
+        INSERT INTO todo_item (id, author_id, todo_list_id, description, due_date)
+        SELECT si.cloned_id, :author_id, :cloned_todo_list_id, si.description, si.due_date
+        FROM source_item si
+        RETURNING id
+    ), cloned_item_assignee AS (
+        INSERT INTO todo_item_assignee (todo_item_id, user_id)
+        SELECT si.cloned_id, tia.user_id
+        FROM source_item si
+        JOIN todo_item_assignee tia ON tia.todo_item_id = si.source_id
+    ), cloned_item_tag AS (
+        INSERT INTO todo_item_tag (todo_item_id, tag_id)
+        SELECT si.cloned_id, tit.tag_id
+        FROM source_item si
+        JOIN todo_item_tag tit ON tit.todo_item_id = si.source_id
+    ), cloned_list_tag AS (
+        INSERT INTO todo_list_tag (todo_list_id, tag_id)
+        SELECT :cloned_todo_list_id, tlt.tag_id
+        FROM todo_list_tag tlt
+        WHERE tlt.todo_list_id = :id
     )
+    SELECT COUNT(*) AS cloned_item_count FROM cloned_item
+    """
+    query = text(sql).bindparams(id=id, author_id=author_id, cloned_todo_list_id=cloned.id)
+    await database.execute(query=query)
+
+    return cloned
 
 
 @database.transaction()
 async def add_todo_list_members(
     todo_list_id: int, user_ids: list[int], todo_list_role_id: int
-) -> bool:
+) -> TodoListMembersUpdateDto:
+    # xmax is zero only for rows inserted (not updated) by this statement
     sql = """
     INSERT INTO todo_list_member (todo_list_id, user_id, todo_list_role_id)
-    VALUES (:todo_list_id, :user_id, :todo_list_role_id)
+    SELECT :todo_list_id, member.user_id, :todo_list_role_id
+    FROM (SELECT DISTINCT UNNEST(CAST(:user_ids AS INTEGER[])) AS user_id) member
+    ON CONFLICT (todo_list_id, user_id) DO UPDATE
+    SET todo_list_role_id = EXCLUDED.todo_list_role_id, updated = NOW()
+    RETURNING user_id, (xmax = 0) AS inserted
     """
-    query = text(sql)
-    for user_id in user_ids:
-        await database.execute(
-            query=query.bindparams(
-                todo_list_id=todo_list_id,
-                user_id=user_id,
-                todo_list_role_id=todo_list_role_id,
-            )
-        )
-    return True
+    query = text(sql).bindparams(
+        bindparam("user_ids", value=user_ids, type_=ARRAY(Integer)),
+        todo_list_id=todo_list_id,
+        todo_list_role_id=todo_list_role_id,
+    )
+    rows = await database.fetch_all(query=query)
+    await invalidate_todo_list_roles(todo_list_id, user_ids)
+    return TodoListMembersUpdateDto(
+        added_user_ids=[row["user_id"] for row in rows if row["inserted"]],
+        updated_user_ids=[row["user_id"] for row in rows if not row["inserted"]],
+    )
 
 
-@database.transaction()
+@database.transaction(readonly=True)
 async def find_todo_list_members(todo_list_id: int) -> list[TodoListMemberDto]:
     sql = """
     SELECT u.id as user_id, u.username, tlr.id as todo_list_role_id, tlr.name as todo_list_role_name
@@ -203,7 +402,7 @@ async def find_todo_list_members(todo_list_id: int) -> list[TodoListMemberDto]:
     ]
 
 
-@database.transaction()
+@database.transaction(readonly=True)
 async def find_todo_list_roles() -> List[TodoListRole]:
     sql = """
     SELECT * 
@@ -1,3 +1,4 @@
+import os
 from typing import List
 from sqlalchemy import select, text
 from http import HTTPStatus
@@ -6,29 +7,84 @@ from fastapi import HTTPException
 from core.base_service import BaseService
 from model.user import User
 from core.database import database
+from core.query_builder import WhereClause
 
 
-@database.transaction()
+@database.transaction(readonly=True)
 async def find_users(
     id: int | None = None,
     username: str | None = None,
-    query_string: str | None = None,
     limit: int | None = None,
 ) -> List[User]:
-    sql = """
+    where = (
+        WhereClause()
+        .equals("id", "id", id)
+        .equals("username", "username", username)
+    )
+
+    sql = f"""
     SELECT * 
     FROM users
-    WHERE (id = :id OR :id IS NULL)
-      AND (username = :username OR :username IS NULL)
-      AND (username ILIKE '%' || :query || '%' OR :query IS NULL)
+    {where}
     """
+    params = {}
     if limit:
         sql = sql + "\nLIMIT :limit\n"
-    
-    query = text(sql).bindparams(id=id, username=username, query=query_string)
-    query = select(User).from_statement(query)
+        params.update(limit=limit)
+
+    rows = await database.fetch_all_statement("find_users", sql, where.values(**params))
+    return database.map_to_models(rows, User)
+
+
+USER_SEARCH_MAX_LIMIT = int(os.getenv("USER_SEARCH_MAX_LIMIT", "50"))
+
+
+LIST_USERS_SQL = """
+SELECT *
+FROM users
+ORDER BY username
+LIMIT :limit
+"""
+
+SEARCH_USERS_SQL = """
+SELECT *
+FROM users
+WHERE username ILIKE '%' || :pattern || '%'
+ORDER BY
+  username ILIKE :pattern || '%' DESC,
+  similarity(username, :query) DESC,
+  username
+LIMIT :limit
+"""
 
-    rows = await database.fetch_all(query=query)
+database.statements.register("list_users", LIST_USERS_SQL)
+database.statements.register("search_users", SEARCH_USERS_SQL)
+
+
+def escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+async def search_users(query_string: str | None, limit: int) -> List[User]:
+    """
+    Returns users whose username contains the query string, prefix matches
+    first and then by trigram similarity. The pg_trgm GIN index on
+    users.username serves the ILIKE filter.
+    :param query_string: The string to search for, or None to list users.
+    :param limit: The maximum number of users, capped to USER_SEARCH_MAX_LIMIT.
+    :return: A list of users.
+    """
+    limit = min(limit, USER_SEARCH_MAX_LIMIT)
+    if not query_string:
+        rows = await database.fetch_all_statement(
+            "list_users", LIST_USERS_SQL, {"limit": limit}
+        )
+    else:
+        rows = await database.fetch_all_statement(
+            "search_users",
+            SEARCH_USERS_SQL,
+            {"pattern": escape_like(query_string), "query": query_string, "limit": limit},
+        )
     return database.map_to_models(rows, User)
 
 
@@ -53,7 +109,7 @@ async def create_user(username: str, password: str) -> User:
     return database.map_to_model(user, User)
 
 
-@database.transaction()
+@database.transaction(readonly=True)
 async def find_user(
     id: int | None = None,
     username: str | None = None,
@@ -67,24 +123,27 @@ class UserService(BaseService):
     def __init__(self):
         super().__init__(User)
 
-    @database.transaction()
+    @database.transaction(readonly=True)
     async def find_users(
         self,
         id: int | None = None,
         username: str | None = None,
         limit: int | None = None,
     ) -> List[User]:
-        sql = """
+        where = (
+            WhereClause()
+            .equals("id", "id", id)
+            .equals("username", "username", username)
+        )
+        sql = f"""
         SELECT * 
         FROM users
-        WHERE (id = :id OR :id IS NULL)
-          AND (username = :username OR :username IS NULL)
+        {where}
         """
         if limit:
-            query = text(sql + "\nLIMIT :limit\n").bindparams(id=id,
-                                                              username=username, limit=limit)
+            query = where.bind(sql + "\nLIMIT :limit\n", limit=limit)
         else:
-            query = text(sql).bindparams(id=id, username=username)
+            query = where.bind(sql)
 
         query = select(User).from_statement(query)
         return await super().fetch_all(query=query)
@@ -109,7 +168,7 @@ class UserService(BaseService):
                 status_code=500, detail="Failed to create user")
         return database.map_to_model(user, User)
 
-    @database.transaction()
+    @database.transaction(readonly=True)
     async def get_user(self, id: int) -> User | None:
         users = await self.find_users(id, limit=1)
         return users[0] if users else None
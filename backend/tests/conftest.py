@@ -0,0 +1,6 @@
+import os
+
+# Service modules configure the database and the broadcast bus on import,
+# without connecting. Tests using a database connect on their own.
+os.environ.setdefault("DATABASE_URL", os.getenv("TEST_DATABASE_URL", "postgresql://localhost/todo"))
+os.environ.setdefault("WS_BROADCAST_BACKEND", "local")
@@ -0,0 +1,77 @@
+"""
+Broadcasts between two buses through Postgres, which needs TEST_DATABASE_URL.
+"""
+import asyncio
+import os
+
+import pytest
+
+from core.broadcast import NOTIFY_PAYLOAD_LIMIT, PostgresBroadcastBus, split_utf8
+
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+
+needs_database = pytest.mark.skipif(DATABASE_URL is None, reason="TEST_DATABASE_URL is not set")
+
+
+def test_split_utf8_keeps_multibyte_characters_whole():
+    data = ("aä€𝄞" * 100).encode()
+    chunks = split_utf8(data, 7)
+    assert "".join(chunks).encode() == data
+    assert all(len(chunk.encode()) <= 7 for chunk in chunks)
+
+
+async def connect_buses(channel: str) -> tuple[PostgresBroadcastBus, PostgresBroadcastBus, list]:
+    received = []
+
+    async def deliver(room, message):
+        received.append((room, message))
+
+    async def ignore(_room, _message):
+        pass
+
+    publisher = PostgresBroadcastBus(DATABASE_URL, channel=channel)
+    listener = PostgresBroadcastBus(DATABASE_URL, channel=channel)
+    await publisher.connect(ignore)
+    await listener.connect(deliver)
+    return publisher, listener, received
+
+
+async def wait_for(predicate, timeout_seconds: float = 5):
+    for _ in range(int(timeout_seconds * 100)):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("Timed out")
+
+
+@needs_database
+@pytest.mark.asyncio
+async def test_delivers_messages_in_order_to_other_workers():
+    publisher, listener, received = await connect_buses("test_broadcast_order")
+    try:
+        large = "x" * (NOTIFY_PAYLOAD_LIMIT * 2) + "ä"
+        messages = [(1, f"message {index}") for index in range(200)] + [(2, large)]
+        for room, message in messages:
+            await publisher.publish(room, message)
+        await wait_for(lambda: len(received) == len(messages))
+        assert received == messages
+        assert publisher.stats()["published"] == len(messages)
+    finally:
+        await publisher.disconnect()
+        await listener.disconnect()
+
+
+@needs_database
+@pytest.mark.asyncio
+async def test_publish_failures_are_dropped_without_raising():
+    publisher, listener, received = await connect_buses("test_broadcast_failure")
+    try:
+        publisher.database_url = "postgresql://invalid@127.0.0.1:1/invalid"
+        await publisher._notify_connection.close()
+
+        await publisher.publish(1, "lost")
+        await wait_for(lambda: publisher.dropped == 1)
+        assert received == []
+    finally:
+        await publisher.disconnect()
+        await listener.disconnect()
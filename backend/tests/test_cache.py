@@ -0,0 +1,30 @@
+from core.cache import TTLCache
+
+
+def test_evicts_least_recently_used_entry():
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_expired_entries_are_misses():
+    cache: TTLCache[str, int] = TTLCache(maxsize=2, ttl=60)
+    cache.set("a", 1, ttl=0)
+    assert cache.get("a") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_skips_values_loaded_across_an_invalidation():
+    cache: TTLCache[tuple[int, int], str] = TTLCache(maxsize=10, ttl=60)
+    generation = cache.generation
+    # Another request invalidates while the value is being loaded
+    cache.invalidate_where(lambda key: key[1] == 1)
+    cache.set((1, 1), "viewer", generation=generation)
+    assert cache.get((1, 1)) is None
+
+    cache.set((1, 1), "editor", generation=cache.generation)
+    assert cache.get((1, 1)) == "editor"
@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+
+from core.coalescing import Coalescer
+
+
+def collect(window_seconds: float) -> tuple[Coalescer[str, str], list]:
+    emitted = []
+
+    async def emit(key, value):
+        emitted.append((key, value))
+
+    return Coalescer(window_seconds, emit), emitted
+
+
+@pytest.mark.asyncio
+async def test_emits_only_the_latest_value_per_window():
+    coalescer, emitted = collect(0.02)
+    for text in ["h", "he", "hel"]:
+        await coalescer.submit("a", text, size=len(text))
+    await coalescer.submit("b", "x")
+    assert emitted == []
+
+    await asyncio.sleep(0.05)
+    assert sorted(emitted) == [("a", "hel"), ("b", "x")]
+    assert coalescer.stats() == {"submitted": 4, "emitted": 2, "coalesced": 2, "coalesced_bytes": 3}
+
+
+@pytest.mark.asyncio
+async def test_flush_emits_the_pending_value_once():
+    coalescer, emitted = collect(10)
+    await coalescer.submit("a", "draft")
+    await coalescer.flush("a")
+    await coalescer.flush("a")
+    assert emitted == [("a", "draft")]
+
+
+@pytest.mark.asyncio
+async def test_zero_window_emits_every_value():
+    coalescer, emitted = collect(0)
+    await coalescer.submit("a", "1")
+    await coalescer.submit("a", "2")
+    assert emitted == [("a", "1"), ("a", "2")]
@@ -0,0 +1,20 @@
+import pytest
+
+from core.database_wrapper import CompiledStatement
+
+
+def test_compiles_bind_parameters_to_positional_ones():
+    statement = CompiledStatement("find", "SELECT * FROM t WHERE a = :a AND b = :b AND c = :a")
+    assert statement.sql == "SELECT * FROM t WHERE a = $1 AND b = $2 AND c = $1"
+    assert statement.args({"b": 2, "a": 1}) == [1, 2]
+
+
+def test_passes_none_values_as_null():
+    statement = CompiledStatement("find", "SELECT * FROM t WHERE a = :a")
+    assert statement.args({"a": None}) == [None]
+
+
+def test_missing_bind_parameter_raises():
+    statement = CompiledStatement("find", "SELECT * FROM t WHERE a = :a AND b = :b")
+    with pytest.raises(KeyError, match="'b' of statement 'find'"):
+        statement.args({"a": 1})
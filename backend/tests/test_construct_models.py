@@ -0,0 +1,29 @@
+from datetime import date, datetime, timezone
+
+from core.database_wrapper import DatabaseWrapper
+from dto.response_dtos import TodoItemDto
+
+ROW = {
+    "id": 1,
+    "author_id": 2,
+    "todo_list_id": 3,
+    "description": "Todo item",
+    "due_date": date(2026, 1, 1),
+    "completed": False,
+    "created": datetime(2026, 1, 1, tzinfo=timezone.utc),
+    "updated": datetime(2026, 1, 2, tzinfo=timezone.utc),
+    "changed_xid": 42,
+}
+
+
+def test_constructs_models_like_validation():
+    constructed, = DatabaseWrapper.construct_models([ROW], TodoItemDto)
+    validated = TodoItemDto(**ROW)
+    assert constructed == validated
+    assert constructed.model_dump_json() == validated.model_dump_json()
+    assert constructed.model_fields_set == validated.model_fields_set
+
+
+def test_ignores_columns_without_a_field():
+    constructed = DatabaseWrapper.construct_model(ROW, TodoItemDto)
+    assert "changed_xid" not in constructed.__dict__
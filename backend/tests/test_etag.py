@@ -0,0 +1,65 @@
+import os
+from http import HTTPStatus
+
+import pytest
+from starlette.requests import Request
+
+from core.etag import etag_matches, make_etag, not_modified
+
+needs_database = pytest.mark.skipif(os.getenv("TEST_DATABASE_URL") is None, reason="TEST_DATABASE_URL is not set")
+
+
+def request_with(if_none_match: str | None) -> Request:
+    headers = [] if if_none_match is None else [(b"if-none-match", if_none_match.encode())]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_etags_change_with_any_part():
+    etag = make_etag("todo-items", 1, 5, None, 100)
+    assert etag == make_etag("todo-items", 1, 5, None, 100)
+    assert etag.startswith('"') and etag.endswith('"')
+    assert etag != make_etag("todo-items", 1, 6, None, 100)
+    assert etag != make_etag("todo-items", 1, 5, "cursor", 100)
+
+
+@pytest.mark.parametrize("if_none_match, matches", [
+    (None, False),
+    ('"other"', False),
+    ("{etag}", True),
+    ('"other", W/{etag}', True),
+    ("*", True),
+])
+def test_if_none_match(if_none_match, matches):
+    etag = make_etag("todo-list", 1, 2)
+    header = None if if_none_match is None else if_none_match.format(etag=etag)
+    assert etag_matches(request_with(header), etag) is matches
+
+
+def test_not_modified_keeps_the_etag():
+    response = not_modified('"etag"')
+    assert response.status_code == HTTPStatus.NOT_MODIFIED
+    assert response.headers["etag"] == '"etag"'
+    assert response.body == b""
+
+
+@needs_database
+@pytest.mark.asyncio
+async def test_versioned_reads_share_one_snapshot():
+    import asyncpg
+    from core.database import database
+    from service.todo_list_service import versioned_read
+
+    other = await asyncpg.connect(os.environ["TEST_DATABASE_URL"])
+    await database.connect()
+    try:
+        async with versioned_read():
+            first = await database.fetch_val("SELECT CAST(pg_current_snapshot() AS TEXT)")
+            # Another connection commits a transaction between the reads
+            await other.execute("SELECT pg_current_xact_id()")
+            second = await database.fetch_val("SELECT CAST(pg_current_snapshot() AS TEXT)")
+            isolation = await database.fetch_val("SELECT current_setting('transaction_isolation')")
+        assert first == second
+        assert isolation == "repeatable read"
+    finally:
+        await database.disconnect()
+        await other.close()
@@ -0,0 +1,55 @@
+from datetime import date
+
+import pytest
+
+from service.todo_item_service import iterate_import_rows, parse_import_row
+
+
+async def chunks(data: bytes, size: int = 5):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+async def parse(data: bytes, format: str) -> list:
+    return [row async for row in iterate_import_rows(chunks(data), format)]
+
+
+@pytest.mark.asyncio
+async def test_parses_ndjson_rows_and_reports_invalid_lines():
+    data = '{"description": "a"}\n\nnot json\n[1]\r\n{"description": "ä"}'.encode()
+    rows = await parse(data, "ndjson")
+    assert [(line, values) for line, values, _ in rows] == [
+        (1, {"description": "a"}), (3, None), (4, None), (5, {"description": "ä"}),
+    ]
+    assert rows[2][2] == "Expected a JSON object"
+
+
+@pytest.mark.asyncio
+async def test_parses_csv_records_spanning_lines():
+    data = b'description,completed\r\n"two\nlines",true\nbad \xff,false\none,two,three\nlast,\n'
+    rows = await parse(data, "csv")
+    assert rows == [
+        (2, {"description": "two\nlines", "completed": "true"}, None),
+        (4, None, "Invalid UTF-8 in line 4"),
+        (5, None, "Expected 2 fields, got 3"),
+        (6, {"description": "last", "completed": ""}, None),
+    ]
+
+
+def test_parses_dates_and_booleans():
+    assert parse_import_row({"description": "a", "due_date": "2024-01-02", "completed": "Yes"}) == (
+        "a", date(2024, 1, 2), True)
+    assert parse_import_row({"description": "a", "due_date": "2024-01-02T10:00:00Z"})[1] == date(2024, 1, 2)
+    assert parse_import_row({"description": "a", "due_date": ""}) == ("a", None, None)
+
+
+@pytest.mark.parametrize("values, detail", [
+    ({"description": ""}, "description is required"),
+    ({"description": "a\x00b"}, "NUL"),
+    ({"description": "a", "due_date": "2024-01-02junk"}, "due_date"),
+    ({"description": "a", "due_date": 20240102}, "due_date"),
+    ({"description": "a", "completed": "maybe"}, "completed"),
+])
+def test_rejects_invalid_values(values, detail):
+    with pytest.raises(ValueError, match=detail):
+        parse_import_row(values)
@@ -0,0 +1,35 @@
+from datetime import datetime, timezone
+from http import HTTPStatus
+
+import pytest
+from fastapi import HTTPException
+
+from core.pagination import decode_cursor, encode_cursor
+from dto.response_dtos import PageDto
+
+
+def test_cursor_round_trips_the_keyset():
+    keyset = (datetime(2024, 5, 6, 7, 8, 9, 123456, tzinfo=timezone.utc), 42)
+    cursor = encode_cursor(keyset)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == keyset
+    assert decode_cursor(None) is None
+
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", "WzFd", encode_cursor((datetime.now(), 1))[:-3]])
+def test_malformed_cursors_are_bad_requests(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == HTTPStatus.BAD_REQUEST
+
+
+def test_page_has_a_next_cursor_only_when_an_extra_item_was_fetched():
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    items = [(created, id) for id in range(1, 4)]
+
+    last_page = PageDto.from_items(items, 3, lambda item: item)
+    assert last_page.items == items and last_page.next_cursor is None
+
+    page = PageDto.from_items(items, 2, lambda item: item)
+    assert page.items == items[:2]
+    assert decode_cursor(page.next_cursor) == items[1]
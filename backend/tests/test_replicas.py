@@ -0,0 +1,180 @@
+"""
+Replica routing against a primary and a streaming replica running in two
+containers, which needs Docker. Set TEST_PRIMARY_URL and TEST_REPLICA_URL
+to run against an existing primary and replica instead.
+"""
+import asyncio
+import os
+
+import pytest
+
+from core.database_wrapper import READ_REPLICA, DatabaseWrapper
+from core.replicas import ReplicaRouter
+
+REPLICA_COMMAND = (
+    "until pg_basebackup -h primary -U postgres -D /tmp/replica -R -X stream; do sleep 1; done; "
+    "chmod 700 /tmp/replica; exec postgres -D /tmp/replica"
+)
+
+
+def asyncpg_url(host: str, port: int | str) -> str:
+    return f"postgresql+asyncpg://postgres:postgres@{host}:{port}/todo"
+
+
+@pytest.fixture(scope="module")
+def cluster():
+    """
+    Yields the urls of a primary and of a replica streaming from it.
+    """
+    if os.getenv("TEST_PRIMARY_URL") and os.getenv("TEST_REPLICA_URL"):
+        yield os.environ["TEST_PRIMARY_URL"], os.environ["TEST_REPLICA_URL"]
+        return
+
+    pytest.importorskip("testcontainers")
+    from testcontainers.core.container import DockerContainer
+    from testcontainers.core.network import Network
+    from testcontainers.core.waiting_utils import wait_for_logs
+    from testcontainers.postgres import PostgresContainer
+
+    try:
+        network = Network()
+        network.create()
+    except Exception as e:
+        pytest.skip(f"Docker is not available: {e}")
+
+    primary = (
+        PostgresContainer("postgres:16.0", username="postgres", password="postgres", dbname="todo")
+        .with_network(network)
+        .with_network_aliases("primary")
+        .with_command("postgres -c wal_level=replica -c max_wal_senders=4")
+    )
+    replica = (
+        DockerContainer("postgres:16.0")
+        .with_network(network)
+        .with_exposed_ports(5432)
+        .with_kwargs(user="postgres")
+        .with_command(["bash", "-c", REPLICA_COMMAND])
+    )
+    try:
+        primary.start()
+        primary.exec(["bash", "-c", "echo 'host replication all all trust' >> $PGDATA/pg_hba.conf"])
+        primary.exec(["psql", "-U", "postgres", "-c", "SELECT pg_reload_conf()"])
+        replica.start()
+        wait_for_logs(replica, "database system is ready to accept read-only connections", timeout=60)
+        yield (
+            asyncpg_url(primary.get_container_host_ip(), primary.get_exposed_port(5432)),
+            asyncpg_url(replica.get_container_host_ip(), replica.get_exposed_port(5432)),
+        )
+    finally:
+        replica.stop()
+        primary.stop()
+        network.remove()
+
+
+async def wait_for_lag(router: ReplicaRouter, healthy: bool, timeout_seconds: float = 30):
+    for _ in range(int(timeout_seconds * 10)):
+        await router.check_lag()
+        if router.is_healthy(router.replicas[0]) == healthy:
+            return
+        await asyncio.sleep(0.1)
+    raise AssertionError(f"Replica did not become {'healthy' if healthy else 'unhealthy'}")
+
+
+@pytest.mark.asyncio
+async def test_lag_check_skips_replica_without_wal_receiver(cluster):
+    _, replica_url = cluster
+    router = ReplicaRouter([replica_url], max_lag_seconds=5, lag_check_interval_seconds=60)
+    await router.connect()
+    replica = router.replicas[0]
+    primary_conninfo = await replica.database.fetch_val("SHOW primary_conninfo")
+    try:
+        await wait_for_lag(router, healthy=True)
+        assert router.choose() is replica
+
+        # Caught up but disconnected from the primary
+        await replica.database.execute("ALTER SYSTEM SET primary_conninfo = ''")
+        await replica.database.execute("SELECT pg_reload_conf()")
+        await wait_for_lag(router, healthy=False)
+        assert router.choose() is None
+    finally:
+        # ALTER SYSTEM takes no bind parameters
+        conninfo = primary_conninfo.replace("'", "''")
+        await replica.database.execute(f"ALTER SYSTEM SET primary_conninfo = '{conninfo}'")
+        await replica.database.execute("SELECT pg_reload_conf()")
+        await wait_for_lag(router, healthy=True)
+        await router.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_reads_of_a_task_stay_on_one_replica(cluster):
+    primary_url, replica_url = cluster
+    database = DatabaseWrapper(primary_url, replica_urls=[replica_url, replica_url])
+    await database.connect()
+    try:
+        @database.transaction(readonly=True)
+        async def read():
+            await database.fetch_val("SELECT 1")
+            return READ_REPLICA.get()
+
+        async def read_twice():
+            return await read(), await read()
+
+        first, second = await asyncio.create_task(read_twice())
+        assert first is not None and first is second
+
+        # Another task, e.g. the next request, may choose the other replica
+        others = {await asyncio.create_task(read()) for _ in range(4)}
+        assert others == set(database.replicas.replicas)
+    finally:
+        await database.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_task_reads_from_primary_once_its_replica_lags(cluster):
+    primary_url, replica_url = cluster
+    database = DatabaseWrapper(primary_url, replica_urls=[replica_url])
+    await database.connect()
+    replica = database.replicas.replicas[0]
+    try:
+        @database.transaction(readonly=True)
+        async def read():
+            await database.fetch_val("SELECT 1")
+            return READ_REPLICA.get()
+
+        async def read_while_lagging():
+            before = await read()
+            replica.lag_seconds = float("inf")
+            during = await read()
+            replica.lag_seconds = 0
+            return before, during, await read()
+
+        before, during, after = await asyncio.create_task(read_while_lagging())
+        assert before is replica
+        # Going back to the replica could read an older state than before
+        assert during is None and after is None
+    finally:
+        await database.disconnect()
+
+
+@pytest.mark.asyncio
+async def test_task_reads_from_primary_after_writing(cluster):
+    primary_url, replica_url = cluster
+    database = DatabaseWrapper(primary_url, replica_urls=[replica_url])
+    await database.connect()
+    try:
+        @database.transaction(readonly=True)
+        async def read():
+            await database.fetch_val("SELECT 1")
+            return READ_REPLICA.get()
+
+        @database.transaction()
+        async def write():
+            await database.fetch_val("SELECT txid_current()")
+
+        async def write_then_read():
+            await write()
+            return await read()
+
+        assert await asyncio.create_task(write_then_read()) is None
+    finally:
+        await database.disconnect()
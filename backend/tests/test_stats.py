@@ -0,0 +1,18 @@
+import asyncio
+import json
+import logging
+
+import pytest
+
+from core.stats import log_stats_periodically
+
+
+@pytest.mark.asyncio
+async def test_logs_the_stats_of_each_source(caplog):
+    caplog.set_level(logging.INFO, logger="app.stats")
+    task = asyncio.create_task(log_stats_periodically({"cache": lambda: {"hits": 1, "hit_rate": 0.5}}, 0.01))
+    await asyncio.sleep(0.015)
+    task.cancel()
+
+    records = [json.loads(record.getMessage()) for record in caplog.records if record.name == "app.stats"]
+    assert records == [{"source": "cache", "hits": 1, "hit_rate": 0.5}]
@@ -0,0 +1,166 @@
+import asyncpg
+import pytest
+from fastapi import HTTPException
+
+from core.database_wrapper import is_connection_error
+from core.write_behind import Pending, WriteBehindBuffer
+
+
+class FakeStore:
+    """
+    Persists batches like update_todo_items, failing a whole batch if it
+    contains a rejected value or while the store is down, and skipping
+    writes to missing rows.
+    """
+
+    def __init__(self):
+        self.rows: dict[tuple, dict] = {}
+        self.missing: set[tuple] = set()
+        self.down = False
+
+    async def write(self, batch: Pending):
+        if self.down:
+            raise ConnectionError("down")
+        for group, writes in batch.items():
+            for key, values in writes.items():
+                if "\x00" in values.get("description", ""):
+                    raise ValueError("invalid byte sequence")
+        skipped = []
+        for group, writes in batch.items():
+            for key, values in writes.items():
+                if (group, key) in self.missing:
+                    skipped.append((group, key))
+                else:
+                    self.rows.setdefault((group, key), {}).update(values)
+        return skipped
+
+
+@pytest.mark.asyncio
+async def test_merges_writes_to_the_same_key():
+    store = FakeStore()
+    buffer = WriteBehindBuffer(store.write, interval_seconds=60, max_pending=100)
+    buffer.add(1, 1, {"description": "a"})
+    buffer.add(1, 1, {"completed": True})
+    await buffer.flush()
+    assert store.rows == {(1, 1): {"description": "a", "completed": True}}
+    assert buffer.stats()["merged"] == 1
+
+
+@pytest.mark.asyncio
+async def test_drops_a_rejected_write_without_holding_back_the_others():
+    store = FakeStore()
+    dropped = []
+
+    async def on_drop(group, key, values, sources, error):
+        dropped.append((group, key, sources))
+
+    buffer = WriteBehindBuffer(store.write, interval_seconds=60, max_pending=100, max_attempts=2, on_drop=on_drop)
+    buffer.add(1, 1, {"description": "bad\x00"}, source="sender")
+    buffer.add(1, 2, {"description": "good"})
+    buffer.add(2, 3, {"description": "good"})
+
+    await buffer.flush()
+    assert store.rows == {(1, 2): {"description": "good"}, (2, 3): {"description": "good"}}
+    assert buffer.stats()["pending"] == 1
+
+    await buffer.flush()
+    assert dropped == [(1, 1, {"sender"})]
+    assert buffer.stats()["pending"] == 0
+    assert buffer.stats()["dropped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_drops_skipped_writes_right_away():
+    store = FakeStore()
+    store.missing.add((1, 1))
+    dropped = []
+
+    async def on_drop(group, key, values, sources, error):
+        dropped.append((group, key, sources, type(error)))
+
+    buffer = WriteBehindBuffer(store.write, interval_seconds=60, max_pending=100, on_drop=on_drop)
+    buffer.add(1, 1, {"description": "a"}, source="sender")
+    buffer.add(1, 2, {"description": "b"})
+
+    await buffer.flush()
+    assert store.rows == {(1, 2): {"description": "b"}}
+    assert dropped == [(1, 1, {"sender"}, LookupError)]
+    assert buffer.stats()["pending"] == 0
+    assert buffer.stats()["written"] == 1
+
+
+@pytest.mark.asyncio
+async def test_keeps_the_batch_while_every_write_fails():
+    store = FakeStore()
+    store.down = True
+    buffer = WriteBehindBuffer(store.write, interval_seconds=60, max_pending=100, max_attempts=1)
+    buffer.add(1, 1, {"description": "a"})
+    buffer.add(2, 2, {"description": "b"})
+
+    for _ in range(3):
+        await buffer.flush()
+    assert buffer.stats()["pending"] == 2
+    assert buffer.stats()["dropped"] == 0
+
+    store.down = False
+    await buffer.flush()
+    assert store.rows == {(1, 1): {"description": "a"}, (2, 2): {"description": "b"}}
+
+
+@pytest.mark.asyncio
+async def test_keeps_a_single_write_while_the_store_is_down():
+    store = FakeStore()
+    store.down = True
+    buffer = WriteBehindBuffer(store.write, interval_seconds=60, max_pending=100, max_attempts=2)
+    buffer.add(1, 1, {"description": "a"})
+
+    for _ in range(3):
+        await buffer.flush()
+    assert buffer.stats()["pending"] == 1
+    assert buffer.stats()["dropped"] == 0
+
+    store.down = False
+    await buffer.flush()
+    assert store.rows == {(1, 1): {"description": "a"}}
+
+
+@pytest.mark.asyncio
+async def test_drops_rejected_writes_even_if_all_of_them_fail():
+    store = FakeStore()
+    buffer = WriteBehindBuffer(store.write, interval_seconds=60, max_pending=100, max_attempts=1)
+    buffer.add(1, 1, {"description": "bad\x00"})
+    buffer.add(2, 2, {"description": "bad\x00"})
+
+    await buffer.flush()
+    assert buffer.stats()["pending"] == 0
+    assert buffer.stats()["dropped"] == 2
+
+
+@pytest.mark.asyncio
+async def test_later_writes_win_over_restored_ones():
+    store = FakeStore()
+    store.down = True
+    buffer = WriteBehindBuffer(store.write, interval_seconds=60, max_pending=100)
+    buffer.add(1, 1, {"description": "old", "completed": True})
+    buffer.add(1, 2, {"description": "other"})
+    await buffer.flush()
+
+    buffer.add(1, 1, {"description": "new"})
+    store.down = False
+    await buffer.flush()
+    assert store.rows[(1, 1)] == {"description": "new", "completed": True}
+
+
+def test_recognizes_connection_errors_raised_as_http_exceptions():
+    def query_error(error: Exception) -> HTTPException:
+        try:
+            try:
+                raise error
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=str(e))
+        except HTTPException as e:
+            return e
+
+    assert is_connection_error(query_error(ConnectionResetError()))
+    assert is_connection_error(query_error(asyncpg.ConnectionDoesNotExistError("connection was closed")))
+    assert not is_connection_error(query_error(asyncpg.ProgramLimitExceededError("null character not permitted")))
@@ -0,0 +1,10 @@
+-- Keyset pagination orders todo lists and todo items by (created, id)
+UPDATE todo_list SET created = CURRENT_TIMESTAMP WHERE created IS NULL;
+ALTER TABLE todo_list ALTER COLUMN created SET NOT NULL;
+
+UPDATE todo_item SET created = CURRENT_TIMESTAMP WHERE created IS NULL;
+ALTER TABLE todo_item ALTER COLUMN created SET NOT NULL;
+
+CREATE INDEX todo_item_todo_list_id_created_id_idx ON todo_item (todo_list_id, created, id);
+CREATE INDEX todo_list_author_id_created_id_idx ON todo_list (author_id, created, id);
+CREATE INDEX todo_list_member_user_id_todo_list_id_idx ON todo_list_member (user_id, todo_list_id);
@@ -0,0 +1,6 @@
+-- Indexes for the optional filters of find_todo_items and find_todo_lists.
+-- Lookups of todo_list by author_id and todo_list_member by user_id are
+-- served by the (author_id, created, id) and (user_id, todo_list_id)
+-- indexes added in V1.
+CREATE INDEX todo_item_todo_list_id_completed_idx ON todo_item (todo_list_id, completed);
+CREATE INDEX todo_item_author_id_idx ON todo_item (author_id);
@@ -0,0 +1,4 @@
+-- Trigram index serving substring and prefix searches of usernames
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX users_username_trgm_idx ON users USING GIN (username gin_trgm_ops);
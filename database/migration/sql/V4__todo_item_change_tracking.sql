@@ -0,0 +1,43 @@
+-- Delta sync of todo items. changed_xid is the id of the transaction that
+-- last wrote a row. Readers resume from the oldest transaction still running
+-- when they read, so rows committed later by older transactions are not missed.
+ALTER TABLE todo_item ADD COLUMN changed_xid xid8 NOT NULL DEFAULT pg_current_xact_id();
+
+CREATE FUNCTION todo_item_set_changed_xid() RETURNS trigger AS $$
+BEGIN
+    NEW.changed_xid := pg_current_xact_id();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER todo_item_set_changed_xid
+    BEFORE UPDATE ON todo_item
+    FOR EACH ROW EXECUTE FUNCTION todo_item_set_changed_xid();
+
+CREATE INDEX todo_item_todo_list_id_changed_xid_idx ON todo_item (todo_list_id, changed_xid);
+
+-- Deleted todo items, reported to clients syncing changes
+CREATE TABLE todo_item_tombstone (
+    todo_item_id INTEGER PRIMARY KEY,
+    todo_list_id INTEGER NOT NULL,
+    changed_xid xid8 NOT NULL DEFAULT pg_current_xact_id(),
+    deleted TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX todo_item_tombstone_todo_list_id_changed_xid_idx ON todo_item_tombstone (todo_list_id, changed_xid);
+
+CREATE FUNCTION todo_item_record_tombstone() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO todo_item_tombstone (todo_item_id, todo_list_id)
+    VALUES (OLD.id, OLD.todo_list_id)
+    ON CONFLICT (todo_item_id) DO UPDATE
+    SET todo_list_id = EXCLUDED.todo_list_id,
+        changed_xid = EXCLUDED.changed_xid,
+        deleted = EXCLUDED.deleted;
+    RETURN OLD;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER todo_item_record_tombstone
+    AFTER DELETE ON todo_item
+    FOR EACH ROW EXECUTE FUNCTION todo_item_record_tombstone();
@@ -0,0 +1,79 @@
+-- Version counters used as ETags. version changes with the todo list itself
+-- and its members, items_version with its todo items. Bumping a counter
+-- locks the todo list row, so versions increase in commit order.
+ALTER TABLE todo_list ADD COLUMN version BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE todo_list ADD COLUMN items_version BIGINT NOT NULL DEFAULT 0;
+
+CREATE FUNCTION todo_list_bump_version() RETURNS trigger AS $$
+BEGIN
+    NEW.version := OLD.version + 1;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER todo_list_bump_version
+    BEFORE UPDATE OF name, description ON todo_list
+    FOR EACH ROW EXECUTE FUNCTION todo_list_bump_version();
+
+-- Statement level triggers bump each affected todo list once per statement
+CREATE FUNCTION todo_item_bump_items_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE todo_list SET items_version = items_version + 1
+        WHERE id IN (SELECT DISTINCT todo_list_id FROM new_rows);
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE todo_list SET items_version = items_version + 1
+        WHERE id IN (SELECT todo_list_id FROM new_rows UNION SELECT todo_list_id FROM old_rows);
+    ELSE
+        UPDATE todo_list SET items_version = items_version + 1
+        WHERE id IN (SELECT DISTINCT todo_list_id FROM old_rows);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER todo_item_bump_items_version_insert
+    AFTER INSERT ON todo_item
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION todo_item_bump_items_version();
+
+CREATE TRIGGER todo_item_bump_items_version_update
+    AFTER UPDATE ON todo_item
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION todo_item_bump_items_version();
+
+CREATE TRIGGER todo_item_bump_items_version_delete
+    AFTER DELETE ON todo_item
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION todo_item_bump_items_version();
+
+CREATE FUNCTION todo_list_member_bump_version() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE todo_list SET version = version + 1
+        WHERE id IN (SELECT DISTINCT todo_list_id FROM new_rows);
+    ELSIF TG_OP = 'UPDATE' THEN
+        UPDATE todo_list SET version = version + 1
+        WHERE id IN (SELECT todo_list_id FROM new_rows UNION SELECT todo_list_id FROM old_rows);
+    ELSE
+        UPDATE todo_list SET version = version + 1
+        WHERE id IN (SELECT DISTINCT todo_list_id FROM old_rows);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER todo_list_member_bump_version_insert
+    AFTER INSERT ON todo_list_member
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION todo_list_member_bump_version();
+
+CREATE TRIGGER todo_list_member_bump_version_update
+    AFTER UPDATE ON todo_list_member
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION todo_list_member_bump_version();
+
+CREATE TRIGGER todo_list_member_bump_version_delete
+    AFTER DELETE ON todo_list_member
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION todo_list_member_bump_version();
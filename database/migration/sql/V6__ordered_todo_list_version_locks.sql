@@ -0,0 +1,42 @@
+-- Bumping the versions of several todo lists in one statement locked them in
+-- arbitrary order, so two statements touching the same lists could deadlock.
+-- The todo lists are now locked in id order before they are bumped.
+CREATE OR REPLACE FUNCTION todo_item_bump_items_version() RETURNS trigger AS $$
+DECLARE
+    todo_list_ids INTEGER[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT todo_list_id ORDER BY todo_list_id) INTO todo_list_ids FROM new_rows;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(DISTINCT todo_list_id ORDER BY todo_list_id) INTO todo_list_ids
+        FROM (SELECT todo_list_id FROM new_rows UNION ALL SELECT todo_list_id FROM old_rows) AS rows;
+    ELSE
+        SELECT array_agg(DISTINCT todo_list_id ORDER BY todo_list_id) INTO todo_list_ids FROM old_rows;
+    END IF;
+
+    PERFORM 1 FROM todo_list WHERE id = ANY(todo_list_ids) ORDER BY id FOR NO KEY UPDATE;
+    UPDATE todo_list SET items_version = items_version + 1
+    WHERE id = ANY(todo_list_ids);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION todo_list_member_bump_version() RETURNS trigger AS $$
+DECLARE
+    todo_list_ids INTEGER[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT todo_list_id ORDER BY todo_list_id) INTO todo_list_ids FROM new_rows;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(DISTINCT todo_list_id ORDER BY todo_list_id) INTO todo_list_ids
+        FROM (SELECT todo_list_id FROM new_rows UNION ALL SELECT todo_list_id FROM old_rows) AS rows;
+    ELSE
+        SELECT array_agg(DISTINCT todo_list_id ORDER BY todo_list_id) INTO todo_list_ids FROM old_rows;
+    END IF;
+
+    PERFORM 1 FROM todo_list WHERE id = ANY(todo_list_ids) ORDER BY id FOR NO KEY UPDATE;
+    UPDATE todo_list SET version = version + 1
+    WHERE id = ANY(todo_list_ids);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
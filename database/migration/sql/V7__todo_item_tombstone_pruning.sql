@@ -0,0 +1,30 @@
+-- Tombstones older than a retention are pruned. pruned_xid is the newest
+-- changed_xid of a pruned tombstone: syncs from a cursor at or before it
+-- could miss deletions and have to start over.
+CREATE TABLE todo_item_tombstone_horizon (
+    pruned_xid xid8 NOT NULL
+);
+
+INSERT INTO todo_item_tombstone_horizon (pruned_xid) VALUES ('0');
+
+CREATE INDEX todo_item_tombstone_deleted_idx ON todo_item_tombstone (deleted);
+
+CREATE FUNCTION prune_todo_item_tombstones(retention INTERVAL) RETURNS BIGINT AS $$
+DECLARE
+    pruned BIGINT;
+    newest_pruned_xid xid8;
+BEGIN
+    WITH deleted AS (
+        DELETE FROM todo_item_tombstone
+        WHERE deleted < CURRENT_TIMESTAMP - retention
+        RETURNING changed_xid
+    )
+    SELECT count(*), max(changed_xid) INTO pruned, newest_pruned_xid FROM deleted;
+
+    IF newest_pruned_xid IS NOT NULL THEN
+        UPDATE todo_item_tombstone_horizon
+        SET pruned_xid = GREATEST(pruned_xid, newest_pruned_xid);
+    END IF;
+    RETURN pruned;
+END;
+$$ LANGUAGE plpgsql;
@@ -10,7 +10,9 @@ import {
 import userState from '../../state/userState'
 import todoItemState from '../../state/todoItemState'
 import activeState from '../../state/activeState'
-import todoActions from '../../http-actions/todoActions'
+import todoActions, {
+  type TodoItemChangesDto,
+} from '../../http-actions/todoActions'
 import { IconButton } from '../common/IconButton'
 import CreateTodoItemForm from '../forms/CreateTodoItemForm'
 import { type TodoItem as TodoItemType } from '../../state/todoItemState'
@@ -137,6 +139,10 @@ export default function TodoList(props: TodoListProps) {
             })
           }
 
+          if (message.action === 'todo_items_batch') {
+            syncTodoItems()
+          }
+
           if (message.action === 'todo_item_update') {
             const index = todoItems.findIndex(
               (todoItem) => todoItem.id === message.todo_item_id,
@@ -156,6 +162,47 @@ export default function TodoList(props: TodoListProps) {
     ),
   )
 
+  // Cursor of the last sync of the todo items, null before the first one
+  let syncCursor: string | null = null
+
+  const syncTodoItems = async () => {
+    let changes: TodoItemChangesDto
+    try {
+      changes = await todoActions.fetchTodoItemChanges(todoListId!, syncCursor)
+    } catch (error) {
+      if (syncCursor === null) {
+        throw error
+      }
+      // The cursor expired, sync all todo items again
+      syncCursor = null
+      return syncTodoItems()
+    }
+    if (syncCursor === null) {
+      // Changes come in commit order, list the todo items by creation
+      setTodoItems(
+        changes.items.sort(
+          (a, b) => a.created.localeCompare(b.created) || a.id - b.id,
+        ),
+      )
+    } else {
+      const changed = new Map(
+        changes.items.map((todoItem) => [todoItem.id, todoItem]),
+      )
+      const deleted = new Set(changes.deleted_ids)
+      const kept = todoItems
+        .filter((todoItem) => !deleted.has(todoItem.id))
+        .map((todoItem) => changed.get(todoItem.id) ?? todoItem)
+      const known = new Set(kept.map((todoItem) => todoItem.id))
+      setTodoItems([
+        ...kept,
+        ...changes.items.filter(
+          (todoItem) => !known.has(todoItem.id) && !deleted.has(todoItem.id),
+        ),
+      ])
+    }
+    syncCursor = changes.next_cursor
+  }
+
   const wsSendEditDescription = (todoItemId: number, description: string) => {
     ws() && console.log('sending edit description:', description)
     ws()?.send(
@@ -262,7 +309,7 @@ export default function TodoList(props: TodoListProps) {
         ? members!.length > 1 ||
           members![0]?.user.id !== active.todoList?.author.id
         : false
-      todoActions.fetchTodoItems(todoListId).then(setTodoItems)
+      syncTodoItems()
 
       if (isShared) {
         setWs(editTodoListWs(user, todoListId))
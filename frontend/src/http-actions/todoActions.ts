@@ -34,10 +34,40 @@ export type TodoItemDto = {
   updated: string
 }
 
+export type TodoListMembersUpdateDto = {
+  added_user_ids: number[]
+  updated_user_ids: number[]
+}
+
+export type PageDto<T> = {
+  items: T[]
+  next_cursor: string | null
+}
+
+export type TodoItemChangesDto = {
+  items: TodoItemDto[]
+  deleted_ids: number[]
+  next_cursor: string
+  next_page: string | null
+}
+
+/* Fetches every page of a cursor paginated endpoint */
+const fetchAllPages = async <T>(url: string): Promise<T[]> => {
+  const items: T[] = []
+  let cursor: string | null = null
+  do {
+    const query: string = cursor ? `?cursor=${encodeURIComponent(cursor)}` : ''
+    const page: PageDto<T> = await http.get(`${url}${query}`)
+    items.push(...page.items)
+    cursor = page.next_cursor
+  } while (cursor)
+  return items
+}
+
 /* TodoList Actions */
 
 const fetchTodoLists = async (): Promise<TodoListDto[]> => {
-  return http.get(`${BASE_URL}`)
+  return fetchAllPages(`${BASE_URL}/`)
 }
 
 const fetchTodoList = async (id: number): Promise<TodoListDto> => {
@@ -63,7 +93,31 @@ const cloneTodoList = async (id: number, newName: string) => {
 /* TodoItem actions */
 
 const fetchTodoItems = async (todoListId: number): Promise<TodoItemDto[]> => {
-  return http.get(`${BASE_URL}/${todoListId}/todos`)
+  return fetchAllPages(`${BASE_URL}/${todoListId}/todos`)
+}
+
+/* Todo items written or deleted since the next_cursor of a previous sync,
+   or all todo items without one, fetching every page */
+const fetchTodoItemChanges = async (
+  todoListId: number,
+  since: string | null,
+): Promise<TodoItemChangesDto> => {
+  const changes: TodoItemChangesDto = {
+    items: [],
+    deleted_ids: [],
+    next_cursor: '',
+    next_page: null,
+  }
+  let query: string = since ? `?since=${encodeURIComponent(since)}` : ''
+  let page: TodoItemChangesDto
+  do {
+    page = await http.get(`${BASE_URL}/${todoListId}/changes${query}`)
+    changes.items.push(...page.items)
+    changes.deleted_ids.push(...page.deleted_ids)
+    query = `?page=${encodeURIComponent(page.next_page ?? '')}`
+  } while (page.next_page)
+  changes.next_cursor = page.next_cursor
+  return changes
 }
 
 const fetchTodoItem = async (todoListId: number, id: number) => {
@@ -93,7 +147,29 @@ const cloneTodoItem = async (todoListId: number, id: number): Promise<TodoItemDt
   return http.post(`${BASE_URL}/${todoListId}/todos/${id}/clone`)
 }
 
-const shareTodoList = async (todoListId: number, data: Record<string, any>): Promise<boolean> => {
+export type TodoItemOperation =
+  | { op: 'create'; description: string; due_date?: string | null }
+  | { op: 'update'; id: number; description?: string; due_date?: string | null; completed?: boolean }
+  | { op: 'complete'; id: number; completed?: boolean }
+  | { op: 'delete'; id: number }
+
+export type TodoItemOperationResultDto = {
+  op: TodoItemOperation['op']
+  status: number
+  id: number | null
+  item: TodoItemDto | null
+  detail: string | null
+}
+
+/* Applies many todo item operations in one request */
+const batchTodoItems = async (
+  todoListId: number,
+  operations: TodoItemOperation[],
+): Promise<{ results: TodoItemOperationResultDto[] }> => {
+  return http.post(`${BASE_URL}/${todoListId}/todos:batch`, { operations })
+}
+
+const shareTodoList = async (todoListId: number, data: Record<string, any>): Promise<TodoListMembersUpdateDto> => {
   return http.post(`${BASE_URL}/${todoListId}/share`, data)
 }
 
@@ -117,10 +193,12 @@ export default {
   shareTodoList,
   fetchTodoItem,
   fetchTodoItems,
+  fetchTodoItemChanges,
   createTodoItem,
   updateTodoItem,
   deleteTodoItem,
   cloneTodoItem,
+  batchTodoItems,
   fetchTodoListRoles,
   fetchTodoListMembers,
 }